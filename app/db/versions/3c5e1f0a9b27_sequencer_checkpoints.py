@@ -0,0 +1,29 @@
+"""sequencer checkpoints
+
+Revision ID: 3c5e1f0a9b27
+Revises: 7e23fdd7ee66
+Create Date: 2026-10-19 09:12:41.532118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c5e1f0a9b27'
+down_revision = '7e23fdd7ee66'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('harvester_sequencer_checkpoint',
+                    sa.Column('stream', sa.String(length=32), nullable=False),
+                    sa.Column('shard', sa.Integer(), autoincrement=False, nullable=False),
+                    sa.Column('block_id', sa.Integer(), nullable=False),
+                    sa.PrimaryKeyConstraint('stream', 'shard')
+                    )
+
+
+def downgrade():
+    op.drop_table('harvester_sequencer_checkpoint')
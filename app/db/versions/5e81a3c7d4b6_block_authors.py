@@ -0,0 +1,33 @@
+"""block authors
+
+Revision ID: 5e81a3c7d4b6
+Revises: b47c9d05e3f2
+Create Date: 2026-10-19 12:26:05.118934
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e81a3c7d4b6'
+down_revision = 'b47c9d05e3f2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('data_session_validator',
+                  sa.Column('count_blocks_authored', sa.Integer(), nullable=False, server_default='0'))
+    op.create_table('data_validator_total',
+                    sa.Column('validator_stash', sa.String(length=64), nullable=False),
+                    sa.Column('count_blocks_authored', sa.Integer(), nullable=False),
+                    sa.Column('first_authored_block', sa.Integer(), nullable=True),
+                    sa.Column('last_authored_block', sa.Integer(), nullable=True),
+                    sa.PrimaryKeyConstraint('validator_stash')
+                    )
+
+
+def downgrade():
+    op.drop_table('data_validator_total')
+    op.drop_column('data_session_validator', 'count_blocks_authored')
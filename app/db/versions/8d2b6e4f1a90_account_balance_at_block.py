@@ -0,0 +1,24 @@
+"""account balance at block
+
+Revision ID: 8d2b6e4f1a90
+Revises: 3c5e1f0a9b27
+Create Date: 2026-10-19 11:03:17.204561
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2b6e4f1a90'
+down_revision = '3c5e1f0a9b27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('data_account', sa.Column('balance_at_block', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('data_account', 'balance_at_block')
@@ -0,0 +1,43 @@
+"""block aggregates
+
+Revision ID: b47c9d05e3f2
+Revises: 8d2b6e4f1a90
+Create Date: 2026-10-19 11:48:52.730419
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b47c9d05e3f2'
+down_revision = '8d2b6e4f1a90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('data_block_aggregate',
+                    sa.Column('timeframe', sa.String(length=8), nullable=False),
+                    sa.Column('bucket', sa.Integer(), autoincrement=False, nullable=False),
+                    sa.Column('block_from', sa.Integer(), nullable=False),
+                    sa.Column('block_to', sa.Integer(), nullable=False),
+                    sa.Column('count_blocks', sa.Integer(), nullable=False),
+                    sa.Column('count_extrinsics', sa.Integer(), nullable=False),
+                    sa.Column('count_extrinsics_signed', sa.Integer(), nullable=False),
+                    sa.Column('count_extrinsics_error', sa.Integer(), nullable=False),
+                    sa.Column('count_events', sa.Integer(), nullable=False),
+                    sa.Column('count_transfers', sa.Integer(), nullable=False),
+                    sa.Column('count_accounts_new', sa.Integer(), nullable=False),
+                    sa.Column('count_accounts_reaped', sa.Integer(), nullable=False),
+                    sa.Column('avg_blocktime', sa.Float(), nullable=True),
+                    sa.PrimaryKeyConstraint('timeframe', 'bucket')
+                    )
+    op.create_index(op.f('ix_data_block_full_hour'), 'data_block', ['full_hour'], unique=False)
+    op.create_index(op.f('ix_data_block_full_day'), 'data_block', ['full_day'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_data_block_full_day'), table_name='data_block')
+    op.drop_index(op.f('ix_data_block_full_hour'), table_name='data_block')
+    op.drop_table('data_block_aggregate')
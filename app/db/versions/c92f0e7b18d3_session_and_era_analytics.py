@@ -0,0 +1,68 @@
+"""session and era analytics
+
+Revision ID: c92f0e7b18d3
+Revises: 5e81a3c7d4b6
+Create Date: 2026-10-19 13:02:44.671205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c92f0e7b18d3'
+down_revision = '5e81a3c7d4b6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('data_session_analytics',
+                    sa.Column('session_id', sa.Integer(), autoincrement=False, nullable=False),
+                    sa.Column('era', sa.Integer(), nullable=True),
+                    sa.Column('count_blocks', sa.Integer(), nullable=False),
+                    sa.Column('blocktime_avg', sa.Float(), nullable=True),
+                    sa.Column('blocktime_p50', sa.Float(), nullable=True),
+                    sa.Column('blocktime_p90', sa.Float(), nullable=True),
+                    sa.Column('blocktime_p99', sa.Float(), nullable=True),
+                    sa.Column('blocktime_max', sa.Float(), nullable=True),
+                    sa.Column('count_validators', sa.Integer(), nullable=False),
+                    sa.Column('stake_total', sa.Numeric(precision=65, scale=0), nullable=True),
+                    sa.Column('stake_min', sa.Numeric(precision=65, scale=0), nullable=True),
+                    sa.Column('stake_median', sa.Numeric(precision=65, scale=0), nullable=True),
+                    sa.Column('stake_max', sa.Numeric(precision=65, scale=0), nullable=True),
+                    sa.Column('stake_gini', sa.Float(), nullable=True),
+                    sa.Column('nakamoto_coefficient', sa.Integer(), nullable=True),
+                    sa.Column('count_nominators', sa.Integer(), nullable=False),
+                    sa.Column('nominator_hhi', sa.Float(), nullable=True),
+                    sa.Column('nominator_top10_share', sa.Float(), nullable=True),
+                    sa.PrimaryKeyConstraint('session_id')
+                    )
+    op.create_index(op.f('ix_data_session_analytics_era'), 'data_session_analytics', ['era'], unique=False)
+    op.create_table('data_era_analytics',
+                    sa.Column('era', sa.Integer(), autoincrement=False, nullable=False),
+                    sa.Column('count_sessions', sa.Integer(), nullable=False),
+                    sa.Column('count_blocks', sa.Integer(), nullable=False),
+                    sa.Column('blocktime_avg', sa.Float(), nullable=True),
+                    sa.Column('blocktime_p50', sa.Float(), nullable=True),
+                    sa.Column('blocktime_p90', sa.Float(), nullable=True),
+                    sa.Column('blocktime_p99', sa.Float(), nullable=True),
+                    sa.Column('blocktime_max', sa.Float(), nullable=True),
+                    sa.Column('count_validators', sa.Integer(), nullable=False),
+                    sa.Column('stake_total', sa.Numeric(precision=65, scale=0), nullable=True),
+                    sa.Column('stake_min', sa.Numeric(precision=65, scale=0), nullable=True),
+                    sa.Column('stake_median', sa.Numeric(precision=65, scale=0), nullable=True),
+                    sa.Column('stake_max', sa.Numeric(precision=65, scale=0), nullable=True),
+                    sa.Column('stake_gini', sa.Float(), nullable=True),
+                    sa.Column('nakamoto_coefficient', sa.Integer(), nullable=True),
+                    sa.Column('count_nominators', sa.Integer(), nullable=False),
+                    sa.Column('nominator_hhi', sa.Float(), nullable=True),
+                    sa.Column('nominator_top10_share', sa.Float(), nullable=True),
+                    sa.PrimaryKeyConstraint('era')
+                    )
+
+
+def downgrade():
+    op.drop_table('data_era_analytics')
+    op.drop_index(op.f('ix_data_session_analytics_era'), table_name='data_session_analytics')
+    op.drop_table('data_session_analytics')
@@ -31,7 +31,7 @@ from app.middleware.sessionmanager import SQLAlchemySessionManager
 from app.resources.harvester import PolkascanStartHarvesterResource, PolkascanStopHarvesterResource, \
     PolkascanStatusHarvesterResource, PolkascanProcessBlockResource, \
     PolkaScanCheckHarvesterTaskResource, SequenceBlockResource, PolkascanBacktrackingResource, PolkascanAccountBalance, \
-    PolkascanSyncAccountId
+    PolkascanSyncAccountId, SequencerStreamRestartResource, SequencerStreamRebuildResource, PolkascanAccountSnapshot
 from app.resources.tools import ExtractMetadataResource, ExtractExtrinsicsResource, \
     HealthCheckResource, ExtractEventsResource
 
@@ -51,6 +51,8 @@ app.add_route('/status', PolkascanStatusHarvesterResource())
 app.add_route('/process', PolkascanProcessBlockResource())
 app.add_route('/sequence', SequenceBlockResource())
 app.add_route('/task/result/{task_id}', PolkaScanCheckHarvesterTaskResource())
+app.add_route('/sequencer/{stream}/restart', SequencerStreamRestartResource())
+app.add_route('/sequencer/{stream}/rebuild', SequencerStreamRebuildResource())
 
 app.add_route('/tools/metadata/extract', ExtractMetadataResource())
 app.add_route('/tools/extrinsics/extract', ExtractExtrinsicsResource())
@@ -58,4 +60,5 @@ app.add_route('/tools/events/extract', ExtractEventsResource())
 
 app.add_route('/backtracking/', PolkascanBacktrackingResource())
 app.add_route('/account/balance', PolkascanAccountBalance())
+app.add_route('/account/snapshot', PolkascanAccountSnapshot())
 app.add_route('/block/sync_account_index', PolkascanSyncAccountId())
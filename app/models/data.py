@@ -18,12 +18,16 @@
 #
 #  data.py
 
+import threading
+
 import sqlalchemy as sa
 from sqlalchemy import text
 from sqlalchemy.dialects.mysql import LONGTEXT
 from sqlalchemy.orm import relationship
 
 from app.models.base import BaseModel
+from app.settings import RUNTIME_STORAGE_CACHE_RUNTIMES
+from app.utils.cache import LRUCache
 
 
 class Block(BaseModel):
@@ -68,8 +72,8 @@ class Block(BaseModel):
     hour = sa.Column(sa.Integer(), nullable=True)
     full_month = sa.Column(sa.Integer(), nullable=True)
     full_week = sa.Column(sa.Integer(), nullable=True)
-    full_day = sa.Column(sa.Integer(), nullable=True)
-    full_hour = sa.Column(sa.Integer(), nullable=True)
+    full_day = sa.Column(sa.Integer(), nullable=True, index=True)
+    full_hour = sa.Column(sa.Integer(), nullable=True, index=True)
     logs = sa.Column(sa.JSON(), default=None, server_default=None)
     spec_version_id = sa.Column(sa.String(64), nullable=False)
     debug_info = sa.Column(sa.JSON(), default=None, server_default=None)
@@ -114,6 +118,12 @@ class Block(BaseModel):
                                             """)
                                )
 
+    @classmethod
+    def get_spec_version_boundaries(cls, session):
+        return session.query(
+            cls.spec_version_id, sa.func.min(cls.id).label('block_from'), sa.func.max(cls.id).label('block_to')
+        ).group_by(cls.spec_version_id).order_by('block_from').all()
+
 
 class BlockTotal(BaseModel):
     __tablename__ = 'data_block_total'
@@ -144,6 +154,36 @@ class BlockTotal(BaseModel):
     total_contracts_new = sa.Column(sa.Numeric(precision=65, scale=0), nullable=False)
 
 
+class BlockAggregate(BaseModel):
+    __tablename__ = 'data_block_aggregate'
+
+    # Aggregated timeframes, with the block column that identifies the bucket
+    timeframes = {
+        'hour': 'full_hour',
+        'day': 'full_day'
+    }
+
+    timeframe = sa.Column(sa.String(8), primary_key=True)
+    bucket = sa.Column(sa.Integer(), primary_key=True, autoincrement=False)
+    block_from = sa.Column(sa.Integer(), nullable=False)
+    block_to = sa.Column(sa.Integer(), nullable=False)
+    count_blocks = sa.Column(sa.Integer(), nullable=False)
+    count_extrinsics = sa.Column(sa.Integer(), nullable=False, default=0)
+    count_extrinsics_signed = sa.Column(sa.Integer(), nullable=False, default=0)
+    count_extrinsics_error = sa.Column(sa.Integer(), nullable=False, default=0)
+    count_events = sa.Column(sa.Integer(), nullable=False, default=0)
+    count_transfers = sa.Column(sa.Integer(), nullable=False, default=0)
+    count_accounts_new = sa.Column(sa.Integer(), nullable=False, default=0)
+    count_accounts_reaped = sa.Column(sa.Integer(), nullable=False, default=0)
+    avg_blocktime = sa.Column(sa.Float(), nullable=True)
+
+    def serialize_id(self):
+        return '{}-{}'.format(self.timeframe, self.bucket)
+
+    def block_filter(self):
+        return getattr(Block, self.timeframes[self.timeframe]) == self.bucket
+
+
 class Event(BaseModel):
     __tablename__ = 'data_event'
 
@@ -236,6 +276,7 @@ class Account(BaseModel):
     is_contract = sa.Column(sa.Boolean, default=False)
     count_reaped = sa.Column(sa.Integer(), default=0)
     balance = sa.Column(sa.Numeric(precision=65, scale=0), nullable=False)
+    balance_at_block = sa.Column(sa.Integer(), nullable=True)
     created_at_block = sa.Column(sa.Integer(), nullable=False)
     updated_at_block = sa.Column(sa.Integer(), nullable=False)
 
@@ -290,6 +331,65 @@ class SessionValidator(BaseModel):
     count_nominators = sa.Column(sa.Integer(), nullable=True)
     unstake_threshold = sa.Column(sa.Integer(), nullable=True)
     commission = sa.Column(sa.Numeric(precision=65, scale=0), nullable=True)
+    count_blocks_authored = sa.Column(sa.Integer(), nullable=False, default=0, server_default='0')
+
+
+class ValidatorTotal(BaseModel):
+    __tablename__ = 'data_validator_total'
+
+    validator_stash = sa.Column(sa.String(64), primary_key=True)
+    count_blocks_authored = sa.Column(sa.Integer(), nullable=False, default=0)
+    first_authored_block = sa.Column(sa.Integer(), nullable=True)
+    last_authored_block = sa.Column(sa.Integer(), nullable=True)
+
+    def serialize_id(self):
+        return self.validator_stash
+
+
+class SessionAnalytics(BaseModel):
+    __tablename__ = 'data_session_analytics'
+
+    session_id = sa.Column(sa.Integer(), primary_key=True, autoincrement=False)
+    era = sa.Column(sa.Integer(), nullable=True, index=True)
+    count_blocks = sa.Column(sa.Integer(), nullable=False)
+    blocktime_avg = sa.Column(sa.Float(), nullable=True)
+    blocktime_p50 = sa.Column(sa.Float(), nullable=True)
+    blocktime_p90 = sa.Column(sa.Float(), nullable=True)
+    blocktime_p99 = sa.Column(sa.Float(), nullable=True)
+    blocktime_max = sa.Column(sa.Float(), nullable=True)
+    count_validators = sa.Column(sa.Integer(), nullable=False)
+    stake_total = sa.Column(sa.Numeric(precision=65, scale=0), nullable=True)
+    stake_min = sa.Column(sa.Numeric(precision=65, scale=0), nullable=True)
+    stake_median = sa.Column(sa.Numeric(precision=65, scale=0), nullable=True)
+    stake_max = sa.Column(sa.Numeric(precision=65, scale=0), nullable=True)
+    stake_gini = sa.Column(sa.Float(), nullable=True)
+    nakamoto_coefficient = sa.Column(sa.Integer(), nullable=True)
+    count_nominators = sa.Column(sa.Integer(), nullable=False)
+    nominator_hhi = sa.Column(sa.Float(), nullable=True)
+    nominator_top10_share = sa.Column(sa.Float(), nullable=True)
+
+
+class EraAnalytics(BaseModel):
+    __tablename__ = 'data_era_analytics'
+
+    era = sa.Column(sa.Integer(), primary_key=True, autoincrement=False)
+    count_sessions = sa.Column(sa.Integer(), nullable=False)
+    count_blocks = sa.Column(sa.Integer(), nullable=False)
+    blocktime_avg = sa.Column(sa.Float(), nullable=True)
+    blocktime_p50 = sa.Column(sa.Float(), nullable=True)
+    blocktime_p90 = sa.Column(sa.Float(), nullable=True)
+    blocktime_p99 = sa.Column(sa.Float(), nullable=True)
+    blocktime_max = sa.Column(sa.Float(), nullable=True)
+    count_validators = sa.Column(sa.Integer(), nullable=False)
+    stake_total = sa.Column(sa.Numeric(precision=65, scale=0), nullable=True)
+    stake_min = sa.Column(sa.Numeric(precision=65, scale=0), nullable=True)
+    stake_median = sa.Column(sa.Numeric(precision=65, scale=0), nullable=True)
+    stake_max = sa.Column(sa.Numeric(precision=65, scale=0), nullable=True)
+    stake_gini = sa.Column(sa.Float(), nullable=True)
+    nakamoto_coefficient = sa.Column(sa.Integer(), nullable=True)
+    count_nominators = sa.Column(sa.Integer(), nullable=False)
+    nominator_hhi = sa.Column(sa.Float(), nullable=True)
+    nominator_top10_share = sa.Column(sa.Float(), nullable=True)
 
 
 class SessionNominator(BaseModel):
@@ -526,6 +626,10 @@ class RuntimeEventAttribute(BaseModel):
 class RuntimeStorage(BaseModel):
     __tablename__ = 'runtime_storage'
 
+    # Storage functions by (module_id, name) per spec version, for the most recently used runtimes
+    _lookup_cache = LRUCache(max_size=RUNTIME_STORAGE_CACHE_RUNTIMES)
+    _lookup_lock = threading.Lock()
+
     id = sa.Column(sa.Integer(), primary_key=True)
     spec_version = sa.Column(sa.Integer())
     module_id = sa.Column(sa.String(64))
@@ -549,6 +653,57 @@ class RuntimeStorage(BaseModel):
         else:
             return self.type_value
 
+    @classmethod
+    def lookup(cls, session, spec_version, module_id, name):
+        """
+        Cached retrieval of a storage function of a runtime. Storage functions never change once a runtime is
+        stored, so detached copies are kept until their runtime is evicted.
+        :param session:
+        :param spec_version:
+        :param module_id:
+        :param name:
+        :return: RuntimeStorage
+        """
+        spec_version = int(spec_version)
+
+        storage_calls = cls._lookup_cache.get(spec_version)
+
+        if storage_calls is not None and (module_id, name) in storage_calls:
+            return storage_calls[(module_id, name)]
+
+        storage_call = cls.query(session).filter_by(spec_version=spec_version, module_id=module_id, name=name).first()
+
+        # Not found could mean the runtime is not stored yet, so this is not cached
+        if not storage_call:
+            return None
+
+        storage_call = storage_call.detached_copy()
+
+        with cls._lookup_lock:
+            storage_calls = cls._lookup_cache.get(spec_version)
+
+            if storage_calls is None:
+                storage_calls = {}
+                cls._lookup_cache[spec_version] = storage_calls
+
+            # Readers look up single keys without the lock, which a concurrent insert doesn't disturb
+            storage_calls.setdefault((module_id, name), storage_call)
+
+            return storage_calls[(module_id, name)]
+
+    @classmethod
+    def preload(cls, session, spec_version):
+        storage_calls = {
+            (storage_call.module_id, storage_call.name): storage_call.detached_copy()
+            for storage_call in cls.query(session).filter_by(spec_version=spec_version)
+        }
+
+        with cls._lookup_lock:
+            cls._lookup_cache[int(spec_version)] = storage_calls
+
+    def detached_copy(self):
+        return RuntimeStorage(**{column.name: getattr(self, column.name) for column in self.__table__.columns})
+
     def serialize_id(self):
         return '{}-{}-{}'.format(self.spec_version, self.module_id, self.name)
 
@@ -28,3 +28,21 @@ import sqlalchemy as sa
 #     first_block = sa.Column(sa.Integer())
 #     last_block = sa.Column(sa.Integer())
 
+
+class SequencerCheckpoint(BaseModel):
+    __tablename__ = 'harvester_sequencer_checkpoint'
+    stream = sa.Column(sa.String(32), primary_key=True)
+    shard = sa.Column(sa.Integer(), primary_key=True, autoincrement=False)
+    block_id = sa.Column(sa.Integer(), nullable=False)
+
+    def serialize_id(self):
+        return '{}-{}'.format(self.stream, self.shard)
+
+    @classmethod
+    def get(cls, session, stream, shard=0):
+        checkpoint = cls.query(session).get((stream, shard))
+
+        if not checkpoint:
+            checkpoint = cls(stream=stream, shard=shard, block_id=-1)
+
+        return checkpoint
@@ -0,0 +1,201 @@
+#  Polkascan PRE Harvester
+#
+#  Copyright 2018-2019 openAware BV (NL).
+#  This file is part of Polkascan.
+#
+#  Polkascan is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Polkascan is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Polkascan. If not, see <http://www.gnu.org/licenses/>.
+#
+#  analytics.py
+
+import numpy as np
+
+from app.models.data import BlockTotal, Session, SessionTotal, SessionValidator, SessionNominator, \
+    SessionAnalytics, EraAnalytics
+
+# Share of the total stake that has to be controlled to halt finality
+NAKAMOTO_THRESHOLD = 1 / 3
+
+NOMINATOR_TOP_COUNT = 10
+
+
+def blocktime_stats(blocktimes):
+    """
+    Average, percentiles and maximum of given blocktimes in seconds
+    :param blocktimes: numpy array
+    :return: dict
+    """
+    if not len(blocktimes):
+        return {}
+
+    p50, p90, p99 = np.percentile(blocktimes, [50, 90, 99])
+
+    return {
+        'blocktime_avg': float(blocktimes.mean()),
+        'blocktime_p50': float(p50),
+        'blocktime_p90': float(p90),
+        'blocktime_p99': float(p99),
+        'blocktime_max': float(blocktimes.max())
+    }
+
+
+def gini(values):
+    """
+    Gini coefficient of given non-negative values, 0 is a perfectly even distribution
+    :param values: numpy array
+    :return: float
+    """
+    total = values.sum()
+
+    if not len(values) or total <= 0:
+        return None
+
+    values = np.sort(values)
+    ranks = np.arange(1, len(values) + 1)
+
+    return float(2 * np.dot(ranks, values) / (len(values) * total) - (len(values) + 1) / len(values))
+
+
+def nakamoto_coefficient(values, threshold=NAKAMOTO_THRESHOLD):
+    """
+    Minimum number of the largest values that together exceed given share of the total
+    :param values: numpy array
+    :param threshold:
+    :return: int
+    """
+    total = values.sum()
+
+    if not len(values) or total <= 0:
+        return None
+
+    cumulative = np.cumsum(np.sort(values)[::-1])
+
+    return int(np.searchsorted(cumulative, total * threshold, side='right')) + 1
+
+
+def stake_stats(bonded):
+    """
+    Distribution of the stake behind validators. Totals are summed exactly, as balances don't fit in 64 bits; the
+    distribution itself is computed on floats.
+    :param bonded: list of int
+    :return: dict
+    """
+    if not bonded:
+        return {}
+
+    values = np.array(bonded, dtype=np.float64)
+    order = np.argsort(values, kind='stable')
+
+    return {
+        'stake_total': sum(bonded),
+        'stake_min': bonded[order[0]],
+        'stake_median': bonded[order[len(order) // 2]],
+        'stake_max': bonded[order[-1]],
+        'stake_gini': gini(values),
+        'nakamoto_coefficient': nakamoto_coefficient(values)
+    }
+
+
+def nominator_stats(nominator_stashes, bonded):
+    """
+    Concentration of the stake of nominators, a nominator backing several validators is counted once
+    :param nominator_stashes: list of nominator stashes, one per nomination
+    :param bonded: list of bonded amounts, one per nomination
+    :return: dict
+    """
+    if not nominator_stashes:
+        return {'count_nominators': 0}
+
+    stashes, inverse = np.unique(np.array(nominator_stashes), return_inverse=True)
+    totals = np.bincount(inverse, weights=np.array(bonded, dtype=np.float64))
+    total = totals.sum()
+
+    stats = {'count_nominators': len(stashes)}
+
+    if total > 0:
+        shares = totals / total
+        stats['nominator_hhi'] = float(np.dot(shares, shares))
+        stats['nominator_top10_share'] = float(np.sort(shares)[::-1][:NOMINATOR_TOP_COUNT].sum())
+
+    return stats
+
+
+def load_blocktimes(db_session, block_from, block_to):
+    rows = db_session.query(BlockTotal.blocktime).filter(
+        BlockTotal.id.between(block_from, block_to)
+    ).all()
+
+    return np.fromiter((row.blocktime for row in rows if row.blocktime is not None), dtype=np.float64)
+
+
+def load_stake(db_session, session_id):
+    validators = db_session.query(SessionValidator.bonded_total).filter_by(session_id=session_id).all()
+    nominators = db_session.query(SessionNominator.nominator_stash, SessionNominator.bonded).filter_by(
+        session_id=session_id
+    ).all()
+
+    stats = stake_stats([int(row.bonded_total or 0) for row in validators])
+    stats['count_validators'] = len(validators)
+    stats.update(nominator_stats(
+        [row.nominator_stash for row in nominators],
+        [int(row.bonded or 0) for row in nominators]
+    ))
+
+    return stats
+
+
+def update_session_analytics(db_session, session_id):
+    """
+    Compute the blocktime and stake analytics of a closed session, requires its SessionTotal
+    :param db_session:
+    :param session_id:
+    :return: SessionAnalytics
+    """
+    session = Session.query(db_session).get(session_id)
+    session_total = SessionTotal.query(db_session).get(session_id)
+
+    if not session or not session_total:
+        return None
+
+    blocktimes = load_blocktimes(db_session, session.start_at_block, session_total.end_at_block)
+
+    stats = blocktime_stats(blocktimes)
+    stats.update(load_stake(db_session, session_id))
+
+    analytics = SessionAnalytics(session_id=session_id, era=session.era, count_blocks=len(blocktimes), **stats)
+
+    return db_session.merge(analytics)
+
+
+def update_era_analytics(db_session, era):
+    """
+    Compute the blocktime analytics over all closed sessions of given era, and the stake analytics of its last session
+    :param db_session:
+    :param era:
+    :return: EraAnalytics
+    """
+    sessions = db_session.query(Session.id, Session.start_at_block, SessionTotal.end_at_block).join(
+        SessionTotal, SessionTotal.id == Session.id
+    ).filter(Session.era == era).order_by(Session.id).all()
+
+    if not sessions:
+        return None
+
+    blocktimes = load_blocktimes(db_session, sessions[0].start_at_block, sessions[-1].end_at_block)
+
+    stats = blocktime_stats(blocktimes)
+    stats.update(load_stake(db_session, sessions[-1].id))
+
+    analytics = EraAnalytics(era=era, count_sessions=len(sessions), count_blocks=len(blocktimes), **stats)
+
+    return db_session.merge(analytics)
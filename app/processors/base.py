@@ -18,6 +18,12 @@
 #
 #  base.py
 
+import threading
+
+from app.settings import SUBSTRATE_RPC_URLS
+from app.utils.cache import LRUCache
+from app.utils.substrate import BalancedSubstrateInterface, prefetch_storage
+
 
 class BaseService(object):
     pass
@@ -25,16 +31,22 @@ class BaseService(object):
 
 class Singleton(type):
     _instances = {}
+    _lock = threading.Lock()
 
     def __call__(cls, *args, **kwargs):
         if cls not in cls._instances:
-            cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
+            # Concurrent first calls must not create (and initialize) the instance twice
+            with cls._lock:
+                if cls not in cls._instances:
+                    cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
         return cls._instances[cls]
 
 
 class ProcessorRegistry(metaclass=Singleton):
-
-    registry = {'event': {}, 'extrinsic': {}, 'block': []}
+    """
+    Processor classes by type, built once per process and read-only afterwards, so it can be shared by concurrent
+    harvesters
+    """
 
     @classmethod
     def all_subclasses(cls, class_):
@@ -42,6 +54,11 @@ class ProcessorRegistry(metaclass=Singleton):
             [s for c in class_.__subclasses__() for s in cls.all_subclasses(c)])
 
     def __init__(self):
+        self.registry = {'event': {}, 'extrinsic': {}, 'block': []}
+
+        # Compiled dispatch tables of the most recent runtimes
+        self.dispatch_tables = LRUCache(max_size=16)
+
         for cls in self.all_subclasses(EventProcessor):
             key = '{}-{}'.format(cls.module_id, cls.event_id)
 
@@ -70,9 +87,98 @@ class ProcessorRegistry(metaclass=Singleton):
     def get_block_processors(self):
         return self.registry['block']
 
+    def get_dispatch_table(self, spec_version, metadata):
+        """
+        Processors of given runtime by raw event and call index, compiled on first use
+        :param spec_version:
+        :param metadata: MetadataDecoder of the runtime
+        :return: ProcessorDispatchTable
+        """
+        dispatch_table = self.dispatch_tables.get(spec_version)
+
+        if dispatch_table is None:
+            dispatch_table = ProcessorDispatchTable(self, metadata)
+            self.dispatch_tables[spec_version] = dispatch_table
+
+        return dispatch_table
+
+
+class ProcessorDispatchTable(object):
+    """
+    Registry compiled for one runtime. Event processors are keyed by the event index (module index and event index as
+    hex, the `type` of a decoded event), extrinsic processors by the call index (`call_code` of a decoded extrinsic).
+    Only types with at least one processor are mapped.
+    """
+
+    def __init__(self, registry, metadata):
+        # Lowercased module id of every event type, as stored in the Event table
+        self.event_module_ids = {}
+        self.event_processors = {}
+        self.extrinsic_processors = {}
+
+        for event_index, (event_module, event) in metadata.event_index.items():
+            module_id = event_module.name.lower()
+            self.event_module_ids[event_index] = module_id
+
+            processors = registry.get_event_processors(module_id, event.name)
+            if processors:
+                self.event_processors[event_index] = tuple(processors)
+
+        for call_index, (call_module, call) in metadata.call_index.items():
+            processors = registry.get_extrinsic_processors(call_module.get_identifier(), call.get_identifier())
+            if processors:
+                self.extrinsic_processors[call_index] = tuple(processors)
+
+        self.block_processors = tuple(registry.get_block_processors())
+
+    def get_event_module_id(self, event_index, module_id):
+        try:
+            return self.event_module_ids[event_index]
+        except KeyError:
+            return module_id.lower()
+
+    def get_event_processors(self, event_index):
+        return self.event_processors.get(event_index, ())
+
+    def get_extrinsic_processors(self, call_index):
+        return self.extrinsic_processors.get(call_index, ())
+
 
 class Processor(object):
 
+    # Sequencing stream the sequencing hook belongs to, streams can be sequenced independently of each other
+    sequencing_stream = 'totals'
+
+    # Futures of the storage items declared by `storage_requests()` by key, set before the accumulation hook runs
+    prefetched_storage = None
+
+    def storage_requests(self, db_session):
+        """
+        Planning phase before the accumulation hook: declare the storage items the hook will need, so the harvester
+        can retrieve the items of all processors of a block concurrently
+        :param db_session:
+        :type db_session: sqlalchemy.orm.Session
+        :return: list of StorageRequest
+        """
+        return []
+
+    def set_prefetched_storage(self, requests, futures):
+        self.prefetched_storage = {request.key: future for request, future in zip(requests, futures)}
+
+    def get_storage(self, db_session, key):
+        """
+        Result of a storage item declared by `storage_requests()`, retrieved now when it was not prefetched
+        :param db_session:
+        :param key: key of the StorageRequest
+        :return: decoded storage item
+        """
+        if self.prefetched_storage is None:
+            requests = self.storage_requests(db_session)
+            substrate = BalancedSubstrateInterface(SUBSTRATE_RPC_URLS)
+            self.set_prefetched_storage(requests, prefetch_storage(substrate, requests))
+
+        return self.prefetched_storage[key].result()
+
     def initialization_hook(self, db_session):
         """
         Hook during initialization phase, which will be a one-time call during processing of the genesis block
@@ -105,12 +211,15 @@ class Processor(object):
         """
         pass
 
-    def aggregation_hook(self, db_session):
+    def aggregation_hook(self, db_session, aggregate):
         """
         Hook during aggregation phase, which will be a periodic call on several pre-defined timeframes in order to
-        write aggregated data over this timeframe
+        write aggregated data over this timeframe. Only called for block processors, once for every bucket that
+        changed since the previous run.
         :param db_session:
         :type db_session: sqlalchemy.orm.Session
+        :param aggregate: timeframe bucket, with block_from and block_to already set
+        :type aggregate: BlockAggregate
         :return:
         """
         pass
@@ -21,22 +21,72 @@
 import datetime
 
 import dateutil
-from sqlalchemy.orm.exc import NoResultFound
-
-from app.models.data import Log, AccountAudit, Account, AccountIndexAudit, AccountIndex, DemocracyProposalAudit, \
-    DemocracyProposal, DemocracyReferendumAudit, DemocracyReferendum, DemocracyVoteAudit, DemocracyVote
-from app.settings import ACCOUNT_AUDIT_TYPE_NEW, ACCOUNT_AUDIT_TYPE_REAPED, ACCOUNT_INDEX_AUDIT_TYPE_NEW, \
-    ACCOUNT_INDEX_AUDIT_TYPE_REAPED, DEMOCRACY_PROPOSAL_AUDIT_TYPE_PROPOSED, DEMOCRACY_PROPOSAL_AUDIT_TYPE_TABLED, \
+from sqlalchemy.sql import func
+
+from app.models.data import AccountAudit, Account, AccountIndexAudit, AccountIndex, DemocracyProposalAudit, \
+    DemocracyProposal, DemocracyReferendumAudit, DemocracyReferendum, DemocracyVoteAudit, DemocracyVote, Block, \
+    BlockTotal, Transfer, SessionValidator, ValidatorTotal
+from app.settings import ACCOUNT_AUDIT_TYPE_NEW, ACCOUNT_AUDIT_TYPE_REAPED, ACCOUNT_AUDIT_TYPE_BALANCE, \
+    ACCOUNT_INDEX_AUDIT_TYPE_NEW, ACCOUNT_INDEX_AUDIT_TYPE_REAPED, DEMOCRACY_PROPOSAL_AUDIT_TYPE_PROPOSED, \
+    DEMOCRACY_PROPOSAL_AUDIT_TYPE_TABLED, \
     DEMOCRACY_REFERENDUM_AUDIT_TYPE_STARTED, DEMOCRACY_REFERENDUM_AUDIT_TYPE_PASSED, \
     DEMOCRACY_REFERENDUM_AUDIT_TYPE_NOTPASSED, DEMOCRACY_REFERENDUM_AUDIT_TYPE_CANCELLED, \
     DEMOCRACY_REFERENDUM_AUDIT_TYPE_EXECUTED, SUBSTRATE_ADDRESS_TYPE, DEMOCRACY_VOTE_AUDIT_TYPE_NORMAL, \
-    DEMOCRACY_VOTE_AUDIT_TYPE_PROXY, SUBSTRATE_RPC_URL
+    DEMOCRACY_VOTE_AUDIT_TYPE_PROXY, SUBSTRATE_RPC_URLS, SEQUENCER_ACCOUNT_SHARDS, SESSION_VALIDATOR_CACHE_SIZE, \
+    ACCOUNT_AUDIT_TYPE_BALANCE_DRIFT
+from app.utils.digest import decode_pre_runtime_log, parse_pre_runtime_log, LOG_DIGEST_PRE_RUNTIME
 from app.utils.ss58 import ss58_encode, ss58_encode_account_index
+from app.utils.cache import EntityCache, LRUCache
 from scalecodec.base import ScaleBytes
 
-from substrateinterface import SubstrateInterface
+from app.utils.substrate import BalancedSubstrateInterface
 from app.processors.base import BlockProcessor
-from scalecodec.block import LogDigest, RawBabePreDigest
+from scalecodec.block import LogDigest
+
+
+class LogDecoder(object):
+    """
+    Decodes the logs of block headers. PreRuntime logs, one in every block, are decoded straight from bytes, once the
+    first one gave the same value as the generic LogDigest decoder of the scalecodec version in use.
+    """
+
+    def __init__(self):
+        # None until the first PreRuntime log is verified
+        self.pre_runtime_verified = None
+
+    @staticmethod
+    def decode_generic(log_data):
+        log_digest = LogDigest(ScaleBytes(log_data))
+        log_digest.decode()
+
+        return log_digest.index, log_digest.index_value, log_digest.value
+
+    def decode(self, log_data):
+        """
+        :param log_data: hex string with 0x prefix, as in the header of a block
+        :return: (type_id, type, value, BabePreDigest or None)
+        """
+        if self.pre_runtime_verified is False:
+            return self.decode_generic(log_data) + (parse_pre_runtime_log(log_data),)
+
+        pre_runtime_log = decode_pre_runtime_log(log_data)
+
+        if pre_runtime_log is None:
+            return self.decode_generic(log_data) + (parse_pre_runtime_log(log_data),)
+
+        value, pre_digest = pre_runtime_log
+
+        if self.pre_runtime_verified is None:
+            generic_log = self.decode_generic(log_data)
+            self.pre_runtime_verified = generic_log == (LOG_DIGEST_PRE_RUNTIME, 'PreRuntime', value)
+
+            if not self.pre_runtime_verified:
+                return generic_log + (pre_digest,)
+
+        return LOG_DIGEST_PRE_RUNTIME, 'PreRuntime', value, pre_digest
+
+
+log_decoder = LogDecoder()
 
 
 class LogBlockProcessor(BlockProcessor):
@@ -45,32 +95,24 @@ class LogBlockProcessor(BlockProcessor):
 
         self.block.count_log = len(self.block.logs)
 
+        logs = []
+
         for idx, log_data in enumerate(self.block.logs):
-            log_digest = LogDigest(ScaleBytes(log_data))
-            log_digest.decode()
-
-            if log_digest.index_value == "PreRuntime":
-                data = log_digest.value.get('value').get('data')
-                if data:
-                    res = RawBabePreDigest(ScaleBytes("0x{}".format(data)))
-                    if data[0:2] == "01" and len(data) == 34:
-                        res.decode()
-                        self.block.account_index = res.value.get("Secondary").get("authorityIndex")
-                    else:
-                        res.decode(check_remaining=False)
-                        self.block.account_index = res.value.get("Primary").get("authorityIndex")
-
-                    self.block.save(db_session)
-
-            log = Log(
-                block_id=self.block.id,
-                log_idx=idx,
-                type_id=log_digest.index,
-                type=log_digest.index_value,
-                data=log_digest.value,
-            )
+            type_id, log_type, value, pre_digest = log_decoder.decode(log_data)
+
+            if pre_digest:
+                self.block.account_index = pre_digest.authority_index
 
-            log.save(db_session)
+            logs.append({
+                'block_id': self.block.id,
+                'log_idx': idx,
+                'type_id': type_id,
+                'type': log_type,
+                'data': value
+            })
+
+        # Written by the harvester after the block row, see PolkascanHarvesterService.add_block
+        self.block._logs = logs
 
 
 class BlockTotalProcessor(BlockProcessor):
@@ -117,42 +159,191 @@ class BlockTotalProcessor(BlockProcessor):
         if parent_block_data and parent_block_data['count_sessions_new'] > 0:
             self.sequenced_block.session_id += 1
 
+    def aggregation_hook(self, db_session, aggregate):
+
+        count_extrinsics, count_extrinsics_signed, count_extrinsics_error, count_events = db_session.query(
+            func.sum(Block.count_extrinsics),
+            func.sum(Block.count_extrinsics_signed),
+            func.sum(Block.count_extrinsics_error),
+            func.sum(Block.count_events)
+        ).filter(aggregate.block_filter()).one()
+
+        aggregate.count_extrinsics = count_extrinsics or 0
+        aggregate.count_extrinsics_signed = count_extrinsics_signed or 0
+        aggregate.count_extrinsics_error = count_extrinsics_error or 0
+        aggregate.count_events = count_events or 0
+
+        aggregate.count_transfers = db_session.query(func.count(Transfer.id)).filter(
+            Transfer.block_id >= aggregate.block_from, Transfer.block_id <= aggregate.block_to
+        ).scalar()
+
+        aggregate.avg_blocktime = db_session.query(func.avg(BlockTotal.blocktime)).filter(
+            BlockTotal.id >= aggregate.block_from, BlockTotal.id <= aggregate.block_to
+        ).scalar()
+
+
+# Validator stashes per session, indexed by authority index. Validators of a session never change once stored.
+session_validators = LRUCache(max_size=SESSION_VALIDATOR_CACHE_SIZE)
+
+
+def get_session_validators(db_session, session_id):
+    validators = session_validators.get(session_id)
+
+    if validators is None:
+        validators = [
+            validator_stash for validator_stash, in db_session.query(SessionValidator.validator_stash).filter_by(
+                session_id=session_id
+            ).order_by(SessionValidator.rank_validator)
+        ]
+
+        # Validators of a session that is not stored yet are not cached
+        if validators:
+            session_validators[session_id] = validators
+
+    return validators
+
+
+class BlockAuthorProcessor(BlockProcessor):
+
+    sequencing_stream = 'sessions'
+
+    def sequencing_hook(self, db_session, parent_block_data, parent_sequenced_block_data):
+
+        if self.block.account_index is None:
+            return
+
+        if self.sequenced_block:
+            # Sequenced together with the block totals, determine session the same way as BlockTotalProcessor
+            sequenced_block = self.sequenced_block
+            session_id = int((parent_sequenced_block_data or {}).get('session_id', 0))
+
+            if parent_block_data and parent_block_data['count_sessions_new'] > 0:
+                session_id += 1
+        else:
+            sequenced_block = BlockTotal.query(db_session).get(self.block.id)
+            session_id = sequenced_block.session_id
+
+        validators = get_session_validators(db_session, session_id)
+
+        if self.block.account_index >= len(validators):
+            return
+
+        sequenced_block.author = validators[self.block.account_index]
+
+        # Authored block counters
+        entity_cache = EntityCache.for_session(db_session)
+
+        session_validator = entity_cache.get_entity(
+            db_session, SessionValidator, (session_id, self.block.account_index)
+        )
+        session_validator.count_blocks_authored = (session_validator.count_blocks_authored or 0) + 1
+        entity_cache.put(SessionValidator, (session_id, self.block.account_index), session_validator)
+
+        validator_total = entity_cache.get_entity(db_session, ValidatorTotal, sequenced_block.author)
+
+        if not validator_total:
+            validator_total = ValidatorTotal(
+                validator_stash=sequenced_block.author,
+                count_blocks_authored=0,
+                first_authored_block=self.block.id
+            )
+
+        validator_total.count_blocks_authored += 1
+        validator_total.last_authored_block = self.block.id
+        entity_cache.put(ValidatorTotal, validator_total.validator_stash, validator_total)
+
+        if not self.sequenced_block:
+            sequenced_block.save(db_session)
+
 
 class AccountBlockProcessor(BlockProcessor):
 
+    sequencing_stream = 'accounts'
+
     def accumulation_hook(self, db_session):
         self.block.count_accounts_new += len(set(self.block._accounts_new))
         self.block.count_accounts_reaped += len(set(self.block._accounts_reaped))
 
         self.block.count_accounts = self.block.count_accounts_new - self.block.count_accounts_reaped
 
+    def aggregation_hook(self, db_session, aggregate):
+
+        count_accounts_new, count_accounts_reaped = db_session.query(
+            func.sum(Block.count_accounts_new),
+            func.sum(Block.count_accounts_reaped)
+        ).filter(aggregate.block_filter()).one()
+
+        aggregate.count_accounts_new = count_accounts_new or 0
+        aggregate.count_accounts_reaped = count_accounts_reaped or 0
+
     def sequencing_hook(self, db_session, parent_block_data, parent_sequenced_block_data):
 
+        if SEQUENCER_ACCOUNT_SHARDS:
+            # Account state is sequenced per shard of accounts, see PolkascanHarvesterService.sequence_account_shard
+            return
+
         for account_audit in AccountAudit.query(db_session).filter_by(block_id=self.block.id).order_by('event_idx'):
-            try:
-                account = Account.query(db_session).filter_by(id=account_audit.account_id).one()
+            self.process_audit(db_session, account_audit)
 
-                if account_audit.type_id == ACCOUNT_AUDIT_TYPE_REAPED:
-                    account.count_reaped += 1
-                    account.is_reaped = True
+    def process_audit(self, db_session, account_audit):
 
-                elif account_audit.type_id == ACCOUNT_AUDIT_TYPE_NEW:
-                    account.is_reaped = False
+        entity_cache = EntityCache.for_session(db_session)
 
-                account.updated_at_block = self.block.id
+        account = entity_cache.get_entity(db_session, Account, account_audit.account_id)
 
-            except NoResultFound:
+        if account:
 
-                account = Account(
-                    id=account_audit.account_id,
-                    address=ss58_encode(account_audit.account_id, SUBSTRATE_ADDRESS_TYPE),
-                    created_at_block=self.block.id,
-                    updated_at_block=self.block.id,
-                    balance=0
-                )
-                ### account balance
-                substrate = SubstrateInterface(SUBSTRATE_RPC_URL)
-                balance = substrate.get_storage(
+            # A balance read from the chain state (snapshot, refresh or reconciliation) already includes the changes
+            # of all blocks up to the block it was read at
+            apply_balance = account.balance_at_block is None or account_audit.block_id > account.balance_at_block
+
+            if account_audit.type_id == ACCOUNT_AUDIT_TYPE_REAPED:
+                account.count_reaped += 1
+                account.is_reaped = True
+                if apply_balance:
+                    account.balance = 0
+
+            elif account_audit.type_id == ACCOUNT_AUDIT_TYPE_NEW:
+                account.is_reaped = False
+                if apply_balance and account_audit.data and account_audit.data.get('balance') is not None:
+                    account.balance = int(account_audit.data['balance'])
+
+            elif account_audit.type_id == ACCOUNT_AUDIT_TYPE_BALANCE:
+                if apply_balance:
+                    # Balance can't be negative, e.g. when the dust of a reaped account is debited afterwards
+                    account.balance = max(0, int(account.balance) + int(account_audit.data['delta']))
+
+            elif account_audit.type_id == ACCOUNT_AUDIT_TYPE_BALANCE_DRIFT:
+                # Recorded by balance reconciliation after the block was sequenced, so only replayed when the stream is
+                # rebuilt. The chain state balance includes all changes of its block.
+                if account_audit.data.get('corrected') and apply_balance:
+                    account.balance = int(account_audit.data['chain_balance'])
+                    account.balance_at_block = account_audit.block_id
+                return
+
+            account.updated_at_block = account_audit.block_id
+
+        elif account_audit.type_id in (ACCOUNT_AUDIT_TYPE_BALANCE, ACCOUNT_AUDIT_TYPE_BALANCE_DRIFT):
+            # Balance change of an unknown account, drift is detected by balance reconciliation
+            return
+
+        else:
+
+            account = Account(
+                id=account_audit.account_id,
+                address=ss58_encode(account_audit.account_id, SUBSTRATE_ADDRESS_TYPE),
+                created_at_block=account_audit.block_id,
+                updated_at_block=account_audit.block_id,
+                balance=0
+            )
+            if account_audit.data and 'balance' in account_audit.data:
+                # Balance is None when the genesis runtime has no free balance storage
+                account.balance = int(account_audit.data['balance'] or 0)
+
+            elif account_audit.type_id == ACCOUNT_AUDIT_TYPE_NEW:
+                # Genesis audits stored by earlier versions have no initial balance
+                substrate = BalancedSubstrateInterface(SUBSTRATE_RPC_URLS)
+                account.balance = substrate.get_storage(
                     block_hash=None,
                     module='Balances',
                     function='FreeBalance',
@@ -160,19 +351,22 @@ class AccountBlockProcessor(BlockProcessor):
                     return_scale_type='Balance',
                     hasher='Blake2_256') or 0
 
-                account.balance = balance
-                # If reaped but does not exist, create new account for now
-                if account_audit.type_id != ACCOUNT_AUDIT_TYPE_NEW:
-                    account.is_reaped = True
-                    account.count_reaped = 1
+            # If reaped but does not exist, create new account for now
+            if account_audit.type_id != ACCOUNT_AUDIT_TYPE_NEW:
+                account.is_reaped = True
+                account.count_reaped = 1
 
-            account.save(db_session)
+        entity_cache.put(Account, account.id, account)
 
 
 class DemocracyProposalBlockProcessor(BlockProcessor):
 
+    sequencing_stream = 'democracy'
+
     def sequencing_hook(self, db_session, parent_block_data, parent_sequenced_block_data):
 
+        entity_cache = EntityCache.for_session(db_session)
+
         for proposal_audit in DemocracyProposalAudit.query(db_session).filter_by(block_id=self.block.id).order_by('event_idx'):
 
             if proposal_audit.type_id == DEMOCRACY_PROPOSAL_AUDIT_TYPE_PROPOSED:
@@ -182,13 +376,14 @@ class DemocracyProposalBlockProcessor(BlockProcessor):
             else:
                 status = '[unknown]'
 
-            try:
-                proposal = DemocracyProposal.query(db_session).filter_by(id=proposal_audit.democracy_proposal_id).one()
+            proposal = entity_cache.get_entity(db_session, DemocracyProposal, proposal_audit.democracy_proposal_id)
+
+            if proposal:
 
                 proposal.status = status
                 proposal.updated_at_block = self.block.id
 
-            except NoResultFound:
+            else:
 
                 proposal = DemocracyProposal(
                     id=proposal_audit.democracy_proposal_id,
@@ -199,13 +394,17 @@ class DemocracyProposalBlockProcessor(BlockProcessor):
                     status=status
                 )
 
-            proposal.save(db_session)
+            entity_cache.put(DemocracyProposal, proposal.id, proposal)
 
 
 class DemocracyReferendumBlockProcessor(BlockProcessor):
 
+    sequencing_stream = 'democracy'
+
     def sequencing_hook(self, db_session, parent_block_data, parent_sequenced_block_data):
 
+        entity_cache = EntityCache.for_session(db_session)
+
         # TODO force insert on Started status
         for referendum_audit in DemocracyReferendumAudit.query(db_session).filter_by(block_id=self.block.id).order_by('event_idx'):
 
@@ -230,8 +429,11 @@ class DemocracyReferendumBlockProcessor(BlockProcessor):
             else:
                 status = '[unknown]'
 
-            try:
-                referendum = DemocracyReferendum.query(db_session).filter_by(id=referendum_audit.democracy_referendum_id).one()
+            referendum = entity_cache.get_entity(
+                db_session, DemocracyReferendum, referendum_audit.democracy_referendum_id
+            )
+
+            if referendum:
 
                 if proposal:
                     referendum.proposal = proposal
@@ -240,7 +442,7 @@ class DemocracyReferendumBlockProcessor(BlockProcessor):
                 referendum.updated_at_block = self.block.id
                 referendum.success = success
 
-            except NoResultFound:
+            else:
 
                 referendum = DemocracyReferendum(
                     id=referendum_audit.democracy_referendum_id,
@@ -252,24 +454,35 @@ class DemocracyReferendumBlockProcessor(BlockProcessor):
                     status=status
                 )
 
-            referendum.save(db_session)
+            entity_cache.put(DemocracyReferendum, referendum.id, referendum)
 
 
 class DemocracyVoteBlockProcessor(BlockProcessor):
 
+    sequencing_stream = 'democracy'
+
     def sequencing_hook(self, db_session, parent_block_data, parent_sequenced_block_data):
 
+        entity_cache = EntityCache.for_session(db_session)
+
         for vote_audit in DemocracyVoteAudit.query(db_session).filter_by(block_id=self.block.id).order_by('extrinsic_idx'):
 
-            try:
-                vote = DemocracyVote.query(db_session).filter_by(
-                    democracy_referendum_id=vote_audit.democracy_referendum_id,
-                    stash_account_id=vote_audit.data.get('stash_account_id')
-                ).one()
+            # Votes are identified by referendum and stash account
+            vote_key = (vote_audit.democracy_referendum_id, vote_audit.data.get('stash_account_id'))
+
+            vote = entity_cache.get_entity(
+                db_session,
+                DemocracyVote,
+                vote_key,
+                democracy_referendum_id=vote_audit.democracy_referendum_id,
+                stash_account_id=vote_audit.data.get('stash_account_id')
+            )
+
+            if vote:
 
                 vote.updated_at_block = self.block.id
 
-            except NoResultFound:
+            else:
 
                 vote = DemocracyVote(
                     democracy_referendum_id=vote_audit.democracy_referendum_id,
@@ -287,38 +500,64 @@ class DemocracyVoteBlockProcessor(BlockProcessor):
             vote.vote_yes_weighted = vote_audit.data.get('vote_yes_weighted')
             vote.vote_no_weighted = vote_audit.data.get('vote_no_weighted')
 
-            vote.save(db_session)
+            entity_cache.put(DemocracyVote, vote_key, vote)
 
 
 class AccountIndexBlockProcessor(BlockProcessor):
 
+    sequencing_stream = 'indices'
+
     def sequencing_hook(self, db_session, parent_block_data, parent_sequenced_block_data):
 
+        if SEQUENCER_ACCOUNT_SHARDS:
+            # Index state is sequenced per shard of accounts, see PolkascanHarvesterService.sequence_account_shard
+            return
+
         for account_index_audit in AccountIndexAudit.query(db_session).filter_by(
                 block_id=self.block.id
         ).order_by('event_idx'):
+            self.process_audit(db_session, account_index_audit)
+
+    def process_audit(self, db_session, account_index_audit, shard=None, count_shards=None):
+        """
+        Apply an index audit to the index state
+        :param db_session:
+        :param account_index_audit: AccountIndexAudit
+        :param shard: when sequenced in shards, only indices of this shard are changed
+        :param count_shards:
+        """
+        entity_cache = EntityCache.for_session(db_session)
+
+        if account_index_audit.type_id == ACCOUNT_INDEX_AUDIT_TYPE_NEW:
+
+            account_index = AccountIndex(
+                id=account_index_audit.account_index_id,
+                account_id=account_index_audit.account_id,
+                short_address=ss58_encode_account_index(
+                    account_index_audit.account_index_id,
+                    SUBSTRATE_ADDRESS_TYPE
+                ),
+                created_at_block=account_index_audit.block_id,
+                updated_at_block=account_index_audit.block_id
+            )
 
-            if account_index_audit.type_id == ACCOUNT_INDEX_AUDIT_TYPE_NEW:
+            entity_cache.put(AccountIndex, account_index.id, account_index)
 
-                account_index = AccountIndex(
-                    id=account_index_audit.account_index_id,
-                    account_id=account_index_audit.account_id,
-                    short_address=ss58_encode_account_index(
-                        account_index_audit.account_index_id,
-                        SUBSTRATE_ADDRESS_TYPE
-                    ),
-                    created_at_block=self.block.id,
-                    updated_at_block=self.block.id
-                )
+        elif account_index_audit.type_id == ACCOUNT_INDEX_AUDIT_TYPE_REAPED:
+
+            # Indices are looked up by account, so pending indices must be written first
+            entity_cache.flush(db_session, AccountIndex)
 
-                account_index.save(db_session)
+            for account_index_id, in db_session.query(AccountIndex.id).filter_by(
+                    account_id=account_index_audit.account_id
+            ):
+                if shard is not None and account_index_id % count_shards != shard:
+                    continue
 
-            elif account_index_audit.type_id == ACCOUNT_INDEX_AUDIT_TYPE_REAPED:
+                account_index = entity_cache.get_entity(db_session, AccountIndex, account_index_id)
 
-                for account_index in AccountIndex.query(db_session).filter_by(
-                        account_id=account_index_audit.account_id
-                ):
+                account_index.account_id = None
+                account_index.is_reclaimable = True
+                account_index.updated_at_block = account_index_audit.block_id
 
-                    account_index.account_id = None
-                    account_index.is_reclaimable = True
-                    account_index.updated_at_block = self.block.id
+                entity_cache.put(AccountIndex, account_index.id, account_index)
@@ -18,28 +18,81 @@
 #
 #  converters.py
 import math
+import random
 
 import time
 
 import decimal
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.sql import func, bindparam
 
 from app.processors import NewSessionEventProcessor, datetime, ss58_encode
-from app.type_registry import load_type_registry
+from app.type_registry import use_type_registry
 from scalecodec import U32
-from scalecodec.base import ScaleBytes, ScaleDecoder, RuntimeConfiguration
+from scalecodec.base import ScaleBytes, ScaleDecoder
 from scalecodec.exceptions import RemainingScaleBytesNotEmptyException
 from scalecodec.metadata import MetadataDecoder
 from scalecodec.block import ExtrinsicsDecoder, EventsDecoder, ExtrinsicsBlock61181Decoder
 
 from app.processors.base import BaseService, ProcessorRegistry
-from substrateinterface import SubstrateInterface, SubstrateRequestException
-
-from app.settings import DEBUG, SUBSTRATE_RPC_URL, ACCOUNT_AUDIT_TYPE_NEW, ACCOUNT_INDEX_AUDIT_TYPE_NEW, \
-    SUBSTRATE_MOCK_EXTRINSICS
+from app.processors.block import AccountBlockProcessor, AccountIndexBlockProcessor, session_validators
+from app.processors.snapshot import AccountSnapshotService
+from substrateinterface import SubstrateRequestException
+from substrateinterface.constants import STORAGE_HASH_SYSTEM_EVENTS, STORAGE_HASH_SYSTEM_EVENTS_V9
+from app.utils.substrate import BalancedSubstrateInterface, prefetch_storage
+from app.utils.cache import MetadataStore, ExtrinsicDecodeCache, EntityCache, load_cached_metadata, \
+    store_cached_metadata
+from app.utils.digest import decode_authority_index
+from app.utils.fastdecode import get_fast_extrinsic_decoder, get_fast_events_decoder, DecodedExtrinsic
+
+from app.settings import DEBUG, SUBSTRATE_RPC_URLS, ACCOUNT_AUDIT_TYPE_NEW, ACCOUNT_INDEX_AUDIT_TYPE_NEW, \
+    SUBSTRATE_MOCK_EXTRINSICS, METADATA_STORE_MAX_SIZE, SEQUENCER_ACCOUNT_SHARDS, SEQUENCER_SHARD_BATCH, \
+    SEQUENCER_STREAMS, GENESIS_RPC_WORKERS, EXTRINSIC_DECODE_CACHE_SIZE, ACCOUNT_AUDIT_TYPE_BALANCE_DRIFT, \
+    BALANCE_RECONCILE_CORRECT, ACCOUNT_SNAPSHOT_PAGE_SIZE
 from app.models.data import Extrinsic, Block, Event, Runtime, RuntimeModule, RuntimeCall, RuntimeCallParam, \
     RuntimeEvent, RuntimeEventAttribute, RuntimeType, RuntimeStorage, BlockTotal, RuntimeConstant, AccountAudit, \
-    AccountIndexAudit, Transfer
+    AccountIndexAudit, Transfer, Account, AccountIndex, DemocracyProposal, DemocracyReferendum, DemocracyVote, \
+    Session, SessionTotal, SessionValidator, SessionNominator, BlockAggregate, ValidatorTotal, \
+    SessionAnalytics, EraAnalytics, Log
+from app.models.harvester import SequencerCheckpoint
+
+
+# Sequencing streams and the tables they maintain. The totals stream maintains the block totals in strict order and
+# is the reference for all other streams.
+SEQUENCING_STREAMS = OrderedDict([
+    ('totals', [BlockTotal]),
+    ('accounts', [Account]),
+    ('indices', [AccountIndex]),
+    ('democracy', [DemocracyVote, DemocracyReferendum, DemocracyProposal]),
+    ('sessions', [SessionNominator, SessionValidator, SessionTotal, Session, ValidatorTotal, SessionAnalytics,
+                  EraAnalytics])
+])
+
+SHARDED_STREAMS = ['accounts', 'indices']
+
+
+def is_independent_stream(stream):
+    if stream not in SEQUENCING_STREAMS:
+        raise ValueError('Unknown sequencing stream "{}"'.format(stream))
+
+    if stream == 'totals':
+        return False
+
+    return bool(SEQUENCER_STREAMS or (SEQUENCER_ACCOUNT_SHARDS and stream in SHARDED_STREAMS))
+
+
+# Shared by all harvesters of a worker process
+extrinsic_decode_cache = ExtrinsicDecodeCache(max_size=EXTRINSIC_DECODE_CACHE_SIZE)
+
+# Shared by all harvesters of a worker process, so the memory budget applies to the process as a whole
+metadata_store = MetadataStore(max_size=METADATA_STORE_MAX_SIZE * 1024 * 1024)
+
+# Number of genesis audits inserted per statement
+GENESIS_INSERT_BATCH = 1000
 
 
 class HarvesterCouldNotAddBlock(Exception):
@@ -47,7 +100,12 @@ class HarvesterCouldNotAddBlock(Exception):
 
 
 class BlockAlreadyAdded(Exception):
-    pass
+
+    def __init__(self, block_hash, block_id=None, parent_hash=None):
+        super().__init__(block_hash)
+        self.block_hash = block_hash
+        self.block_id = block_id
+        self.parent_hash = parent_hash
 
 
 class BlockNotFound(Exception):
@@ -58,24 +116,19 @@ class PolkascanHarvesterService(BaseService):
 
     def __init__(self, db_session, type_registry='default'):
         self.db_session = db_session
-        RuntimeConfiguration().update_type_registry(load_type_registry('default'))
-        if type_registry != 'default':
-            RuntimeConfiguration().update_type_registry(load_type_registry(type_registry))
-        self.metadata_store = {}
+        self.type_registry = type_registry
+        use_type_registry(type_registry)
+        self.metadata_store = metadata_store
 
     def process_genesis(self, block):
-        substrate = SubstrateInterface(SUBSTRATE_RPC_URL)
+        substrate = BalancedSubstrateInterface(SUBSTRATE_RPC_URLS)
 
         # Set block time of parent block
         child_block = Block.query(self.db_session).filter_by(parent_hash=block.hash).first()
         block.set_datetime(child_block.datetime)
 
         # Retrieve genesis accounts
-        storage_call = RuntimeStorage.query(self.db_session).filter_by(
-            module_id='indices',
-            name='NextEnumSet',
-            spec_version=block.spec_version_id
-        ).first()
+        storage_call = RuntimeStorage.lookup(self.db_session, block.spec_version_id, 'indices', 'NextEnumSet')
 
         if storage_call:
             genesis_account_page_count = substrate.get_storage(
@@ -87,61 +140,97 @@ class PolkascanHarvesterService(BaseService):
             ) or 0
 
             # Get Accounts on EnumSet
-            storage_call = RuntimeStorage.query(self.db_session).filter_by(
-                module_id='indices',
-                name='EnumSet',
-                spec_version=block.spec_version_id
-            ).first()
+            storage_call = RuntimeStorage.lookup(self.db_session, block.spec_version_id, 'indices', 'EnumSet')
 
             if storage_call:
 
-                block.count_accounts_new = 0
-                block.count_accounts = 0
-
-                for enum_set_nr in range(0, genesis_account_page_count + 1):
-
+                def get_enum_set(enum_set_nr):
                     account_index_u32 = U32()
                     account_index_u32.encode(enum_set_nr)
 
-                    genesis_accounts = substrate.get_storage(
+                    return substrate.get_storage(
                         block_hash=block.hash,
                         module="Indices",
                         function="EnumSet",
                         params=account_index_u32.data.data.hex(),
                         return_scale_type=storage_call.get_return_type(),
                         hasher=storage_call.type_hasher
-                    )
-
-                    if genesis_accounts:
-                        block.count_accounts_new += len(genesis_accounts)
-                        block.count_accounts += len(genesis_accounts)
-
-                        for idx, account_id in enumerate(genesis_accounts):
-                            account_audit = AccountAudit(
-                                account_id=account_id.replace('0x', ''),
-                                block_id=block.id,
-                                extrinsic_idx=None,
-                                event_idx=None,
-                                type_id=ACCOUNT_AUDIT_TYPE_NEW
+                    ) or []
+
+                with ThreadPoolExecutor(max_workers=GENESIS_RPC_WORKERS) as executor:
+
+                    # Pages are fetched concurrently, map() keeps them in order of their index
+                    genesis_accounts = [
+                        (enum_set_nr * 64 + idx, account_id.replace('0x', ''))
+                        for enum_set_nr, page in enumerate(
+                            executor.map(get_enum_set, range(0, genesis_account_page_count + 1))
+                        )
+                        for idx, account_id in enumerate(page)
+                    ]
+
+                    # Store the genesis balance in the audits, so the sequencer doesn't have to retrieve them one by one
+                    snapshot = AccountSnapshotService(self.db_session, type_registry=self.type_registry)
+                    balance_storage_call, module_prefix = snapshot.get_balance_storage(block.spec_version_id)
+
+                    if balance_storage_call:
+                        # Pages of keys with one state_queryStorageAt request each, as for an account snapshot
+                        account_ids = [account_id for account_index_id, account_id in genesis_accounts]
+                        pages = [
+                            account_ids[offset:offset + ACCOUNT_SNAPSHOT_PAGE_SIZE]
+                            for offset in range(0, len(account_ids), ACCOUNT_SNAPSHOT_PAGE_SIZE)
+                        ]
+
+                        account_balances = {
+                            account_id: balance
+                            for page_balances in executor.map(
+                                lambda page: snapshot.get_balances(page, block.hash, block.spec_version_id), pages
                             )
+                            for account_id, balance in page_balances
+                        }
 
-                            account_audit.save(self.db_session)
-
-                            account_index_id = enum_set_nr * 64 + idx
-
-                            account_index_audit = AccountIndexAudit(
-                                account_index_id=account_index_id,
-                                account_id=account_id.replace('0x', ''),
-                                block_id=block.id,
-                                extrinsic_idx=None,
-                                event_idx=None,
-                                type_id=ACCOUNT_INDEX_AUDIT_TYPE_NEW
-                            )
+                        balances = [str(account_balances[account_id]) for account_id in account_ids]
+                    else:
+                        # Runtime without free balances, the balance is left to the balance events
+                        balances = [None] * len(genesis_accounts)
+
+                    account_audits = [
+                        {
+                            'account_id': account_id,
+                            'block_id': block.id,
+                            'type_id': ACCOUNT_AUDIT_TYPE_NEW,
+                            'data': {'balance': balance}
+                        }
+                        for (account_index_id, account_id), balance in zip(genesis_accounts, balances)
+                    ]
+
+                account_index_audits = [
+                    {
+                        'account_index_id': account_index_id,
+                        'account_id': account_id,
+                        'block_id': block.id,
+                        'type_id': ACCOUNT_INDEX_AUDIT_TYPE_NEW
+                    }
+                    for account_index_id, account_id in genesis_accounts
+                ]
+
+                for offset in range(0, len(genesis_accounts), GENESIS_INSERT_BATCH):
+                    self.db_session.execute(
+                        AccountAudit.__table__.insert(), account_audits[offset:offset + GENESIS_INSERT_BATCH]
+                    )
+                    self.db_session.execute(
+                        AccountIndexAudit.__table__.insert(),
+                        account_index_audits[offset:offset + GENESIS_INSERT_BATCH]
+                    )
 
-                            account_index_audit.save(self.db_session)
+                block.count_accounts_new = len(genesis_accounts)
+                block.count_accounts = len(genesis_accounts)
 
         block.save(self.db_session)
 
+        if SEQUENCER_STREAMS:
+            # Initial session is created by the sessions stream
+            return
+
         # Create initial session
         initial_session_event = NewSessionEventProcessor(block, Event(), None)
         initial_session_event.add_session(db_session=self.db_session, session_id=0)
@@ -180,183 +269,119 @@ class PolkascanHarvesterService(BaseService):
 
             runtime_type.save(self.db_session)
 
-    def process_metadata(self, runtime_version_data, block_hash):
+    def decode_runtime_metadata(self, runtime):
 
-        spec_version = runtime_version_data.get('specVersion', 0)
+        metadata_decoder = load_cached_metadata(runtime, self.type_registry)
 
-        # Check if metadata already in store
-        if spec_version not in self.metadata_store:
-            print('Metadata: CACHE MISS', spec_version)
+        if metadata_decoder is None:
+            metadata_decoder = MetadataDecoder(ScaleBytes(runtime.json_metadata))
+            metadata_decoder.decode()
 
-            runtime = Runtime.query(self.db_session).get(spec_version)
+            store_cached_metadata(runtime, self.type_registry, metadata_decoder)
 
-            if runtime:
+        return metadata_decoder
 
-                metadata_decoder = MetadataDecoder(ScaleBytes(runtime.json_metadata))
-                metadata_decoder.decode()
+    def process_metadata(self, runtime_version_data, block_hash):
 
-                self.metadata_store[spec_version] = metadata_decoder
+        spec_version = runtime_version_data.get('specVersion', 0)
 
-            else:
-                self.db_session.begin(subtransactions=True)
-                try:
+        # Check if metadata already in store
+        metadata_decoder = self.metadata_store.get(spec_version)
 
-                    # ==== Get block Metadata from Substrate ==================
-                    substrate = SubstrateInterface(SUBSTRATE_RPC_URL)
-                    metadata_decoder = substrate.get_block_metadata(block_hash)
-
-                    # Store metadata in database
-                    runtime = Runtime(
-                        id=spec_version,
-                        impl_name=runtime_version_data["implName"],
-                        impl_version=runtime_version_data["implVersion"],
-                        spec_name=runtime_version_data["specName"],
-                        spec_version=spec_version,
-                        json_metadata=str(metadata_decoder.data),
-                        json_metadata_decoded=metadata_decoder.value,
-                        apis=runtime_version_data["apis"],
-                        authoring_version=runtime_version_data["authoringVersion"],
-                        count_call_functions=0,
-                        count_events=0,
-                        count_modules=len(metadata_decoder.metadata.modules),
-                        count_storage_functions=0
-                    )
+        if metadata_decoder is None:
 
-                    runtime.save(self.db_session)
-
-                    print('store version to db', metadata_decoder.version)
-
-                    if not metadata_decoder.version:
-                        # Legacy V0 fallback
-                        for module in metadata_decoder.metadata.modules:
-                            runtime_module = RuntimeModule(
-                                spec_version=spec_version,
-                                module_id=module.get_identifier(),
-                                prefix=module.prefix,
-                                name=module.get_identifier(),
-                                count_call_functions=len(module.functions or []),
-                                count_storage_functions=len(module.storage or []),
-                                count_events=0
-                            )
-                            runtime_module.save(self.db_session)
+            # Concurrent harvesters of the process wait for the first one to load the runtime
+            with self.metadata_store.loading(spec_version):
 
-                            if len(module.functions or []) > 0:
-                                for idx, call in enumerate(module.functions):
-                                    runtime_call = RuntimeCall(
-                                        spec_version=spec_version,
-                                        module_id=module.get_identifier(),
-                                        call_id=call.get_identifier(),
-                                        index=idx,
-                                        name=call.name,
-                                        lookup=call.lookup,
-                                        documentation='\n'.join(call.docs),
-                                        count_params=len(call.args)
-                                    )
-                                    runtime_call.save(self.db_session)
+                # Loaded by another harvester while waiting, it can be evicted again before it is retrieved
+                metadata_decoder = self.metadata_store.get(spec_version)
 
-                                    for arg in call.args:
-                                        runtime_call_param = RuntimeCallParam(
-                                            runtime_call_id=runtime_call.id,
-                                            name=arg.name,
-                                            type=arg.type
-                                        )
-                                        runtime_call_param.save(self.db_session)
+                if metadata_decoder is not None:
+                    return metadata_decoder
 
-                                        # Check if type already registered in database
-                                        self.process_metadata_type(arg.type, spec_version)
+                print('Metadata: CACHE MISS', spec_version)
 
-                        for event_module in metadata_decoder.metadata.events_modules:
-                            for event_index, event in enumerate(event_module.events):
-                                runtime_event = RuntimeEvent(
-                                    spec_version=spec_version,
-                                    module_id=event_module.name,
-                                    event_id=event.name,
-                                    index=event_index,
-                                    name=event.name,
-                                    lookup=event.lookup,
-                                    documentation='\n'.join(event.docs),
-                                    count_attributes=len(event.args)
-                                )
-                                runtime_event.save(self.db_session)
+                runtime = Runtime.query(self.db_session).get(spec_version)
 
-                                runtime_module.count_events += 1
+                if runtime:
 
-                                for arg_index, arg in enumerate(event.args):
-                                    runtime_event_attr = RuntimeEventAttribute(
-                                        runtime_event_id=runtime_event.id,
-                                        index=arg_index,
-                                        type=arg
-                                    )
-                                    runtime_event_attr.save(self.db_session)
+                    metadata_decoder = self.decode_runtime_metadata(runtime)
 
-                        runtime_module.save(self.db_session)
+                    self.metadata_store[spec_version] = metadata_decoder
 
-                    else:
-                        for module in metadata_decoder.metadata.modules:
-
-                            # Check if module exists
-                            if RuntimeModule.query(self.db_session).filter_by(
-                                spec_version=spec_version,
-                                module_id=module.get_identifier()
-                            ).count() == 0:
-                                module_id = module.get_identifier()
-                            else:
-                                module_id = '{}_1'.format(module.get_identifier())
-
-                            # Storage backwards compt check
-                            if module.storage and isinstance(module.storage, list):
-                                storage_functions = module.storage
-                            elif module.storage and isinstance(getattr(module.storage, 'value'), dict):
-                                storage_functions = module.storage.items
-                            else:
-                                storage_functions = []
-
-                            runtime_module = RuntimeModule(
-                                spec_version=spec_version,
-                                module_id=module_id,
-                                prefix=module.prefix,
-                                name=module.name,
-                                count_call_functions=len(module.calls or []),
-                                count_storage_functions=len(storage_functions),
-                                count_events=len(module.events or [])
-                            )
-                            runtime_module.save(self.db_session)
+                else:
+                    self.db_session.begin(subtransactions=True)
+                    try:
 
-                            # Update totals in runtime
-                            runtime.count_call_functions += runtime_module.count_call_functions
-                            runtime.count_events += runtime_module.count_events
-                            runtime.count_storage_functions += runtime_module.count_storage_functions
+                        # ==== Get block Metadata from Substrate ==================
+                        substrate = BalancedSubstrateInterface(SUBSTRATE_RPC_URLS)
+                        metadata_decoder = substrate.get_block_metadata(block_hash)
+
+                        # Store metadata in database
+                        runtime = Runtime(
+                            id=spec_version,
+                            impl_name=runtime_version_data["implName"],
+                            impl_version=runtime_version_data["implVersion"],
+                            spec_name=runtime_version_data["specName"],
+                            spec_version=spec_version,
+                            json_metadata=str(metadata_decoder.data),
+                            json_metadata_decoded=metadata_decoder.value,
+                            apis=runtime_version_data["apis"],
+                            authoring_version=runtime_version_data["authoringVersion"],
+                            count_call_functions=0,
+                            count_events=0,
+                            count_modules=len(metadata_decoder.metadata.modules),
+                            count_storage_functions=0
+                        )
 
-                            if len(module.calls or []) > 0:
-                                for idx, call in enumerate(module.calls):
-                                    runtime_call = RuntimeCall(
-                                        spec_version=spec_version,
-                                        module_id=module_id,
-                                        call_id=call.get_identifier(),
-                                        index=idx,
-                                        name=call.name,
-                                        lookup=call.lookup,
-                                        documentation='\n'.join(call.docs),
-                                        count_params=len(call.args)
-                                    )
-                                    runtime_call.save(self.db_session)
+                        runtime.save(self.db_session)
 
-                                    for arg in call.args:
-                                        runtime_call_param = RuntimeCallParam(
-                                            runtime_call_id=runtime_call.id,
-                                            name=arg.name,
-                                            type=arg.type
+                        print('store version to db', metadata_decoder.version)
+
+                        if not metadata_decoder.version:
+                            # Legacy V0 fallback
+                            for module in metadata_decoder.metadata.modules:
+                                runtime_module = RuntimeModule(
+                                    spec_version=spec_version,
+                                    module_id=module.get_identifier(),
+                                    prefix=module.prefix,
+                                    name=module.get_identifier(),
+                                    count_call_functions=len(module.functions or []),
+                                    count_storage_functions=len(module.storage or []),
+                                    count_events=0
+                                )
+                                runtime_module.save(self.db_session)
+
+                                if len(module.functions or []) > 0:
+                                    for idx, call in enumerate(module.functions):
+                                        runtime_call = RuntimeCall(
+                                            spec_version=spec_version,
+                                            module_id=module.get_identifier(),
+                                            call_id=call.get_identifier(),
+                                            index=idx,
+                                            name=call.name,
+                                            lookup=call.lookup,
+                                            documentation='\n'.join(call.docs),
+                                            count_params=len(call.args)
                                         )
-                                        runtime_call_param.save(self.db_session)
+                                        runtime_call.save(self.db_session)
 
-                                        # Check if type already registered in database
-                                        self.process_metadata_type(arg.type, spec_version)
+                                        for arg in call.args:
+                                            runtime_call_param = RuntimeCallParam(
+                                                runtime_call_id=runtime_call.id,
+                                                name=arg.name,
+                                                type=arg.type
+                                            )
+                                            runtime_call_param.save(self.db_session)
 
-                            if len(module.events or []) > 0:
-                                for event_index, event in enumerate(module.events):
+                                            # Check if type already registered in database
+                                            self.process_metadata_type(arg.type, spec_version)
+
+                            for event_module in metadata_decoder.metadata.events_modules:
+                                for event_index, event in enumerate(event_module.events):
                                     runtime_event = RuntimeEvent(
                                         spec_version=spec_version,
-                                        module_id=module_id,
+                                        module_id=event_module.name,
                                         event_id=event.name,
                                         index=event_index,
                                         name=event.name,
@@ -366,6 +391,8 @@ class PolkascanHarvesterService(BaseService):
                                     )
                                     runtime_event.save(self.db_session)
 
+                                    runtime_module.count_events += 1
+
                                     for arg_index, arg in enumerate(event.args):
                                         runtime_event_attr = RuntimeEventAttribute(
                                             runtime_event_id=runtime_event.id,
@@ -374,110 +401,296 @@ class PolkascanHarvesterService(BaseService):
                                         )
                                         runtime_event_attr.save(self.db_session)
 
-                            if len(storage_functions) > 0:
-                                for idx, storage in enumerate(storage_functions):
-
-                                    # Determine type
-                                    type_hasher = None
-                                    type_key1 = None
-                                    type_key2 = None
-                                    type_value = None
-                                    type_is_linked = None
-                                    type_key2hasher = None
-
-                                    if storage.type.get('PlainType'):
-                                        type_value = storage.type.get('PlainType')
-
-                                    elif storage.type.get('MapType'):
-                                        type_hasher = storage.type['MapType'].get('hasher')
-                                        type_key1 = storage.type['MapType'].get('key')
-                                        type_value = storage.type['MapType'].get('value')
-                                        type_is_linked = storage.type['MapType'].get('isLinked', False)
-
-                                    elif storage.type.get('DoubleMapType'):
-                                        type_hasher = storage.type['DoubleMapType'].get('hasher')
-                                        type_key1 = storage.type['DoubleMapType'].get('key1')
-                                        type_key2 = storage.type['DoubleMapType'].get('key2')
-                                        type_value = storage.type['DoubleMapType'].get('value')
-                                        type_key2hasher = storage.type['DoubleMapType'].get('key2Hasher')
-
-                                    runtime_storage = RuntimeStorage(
-                                        spec_version=spec_version,
-                                        module_id=module_id,
-                                        index=idx,
-                                        name=storage.name,
-                                        lookup=None,
-                                        default=storage.fallback,
-                                        modifier=storage.modifier,
-                                        type_hasher=type_hasher,
-                                        type_key1=type_key1,
-                                        type_key2=type_key2,
-                                        type_value=type_value,
-                                        type_is_linked=type_is_linked,
-                                        type_key2hasher=type_key2hasher,
-                                        documentation='\n'.join(storage.docs)
-                                    )
-                                    runtime_storage.save(self.db_session)
-
-                                    # Check if types already registered in database
-
-                                    self.process_metadata_type(type_value, spec_version)
-
-                                    if type_key1:
-                                        self.process_metadata_type(type_key1, spec_version)
-
-                                    if type_key2:
-                                        self.process_metadata_type(type_key2, spec_version)
+                            runtime_module.save(self.db_session)
 
-                            if len(module.constants or []) > 0:
-                                for idx, constant in enumerate(module.constants):
+                        else:
+                            for module in metadata_decoder.metadata.modules:
 
-                                    # Decode value
-                                    try:
-                                        value_obj = ScaleDecoder.get_decoder_class(
-                                            constant.type,
-                                            ScaleBytes(constant.constant_value)
+                                # Check if module exists
+                                if RuntimeModule.query(self.db_session).filter_by(
+                                    spec_version=spec_version,
+                                    module_id=module.get_identifier()
+                                ).count() == 0:
+                                    module_id = module.get_identifier()
+                                else:
+                                    module_id = '{}_1'.format(module.get_identifier())
+
+                                # Storage backwards compt check
+                                if module.storage and isinstance(module.storage, list):
+                                    storage_functions = module.storage
+                                elif module.storage and isinstance(getattr(module.storage, 'value'), dict):
+                                    storage_functions = module.storage.items
+                                else:
+                                    storage_functions = []
+
+                                runtime_module = RuntimeModule(
+                                    spec_version=spec_version,
+                                    module_id=module_id,
+                                    prefix=module.prefix,
+                                    name=module.name,
+                                    count_call_functions=len(module.calls or []),
+                                    count_storage_functions=len(storage_functions),
+                                    count_events=len(module.events or [])
+                                )
+                                runtime_module.save(self.db_session)
+
+                                # Update totals in runtime
+                                runtime.count_call_functions += runtime_module.count_call_functions
+                                runtime.count_events += runtime_module.count_events
+                                runtime.count_storage_functions += runtime_module.count_storage_functions
+
+                                if len(module.calls or []) > 0:
+                                    for idx, call in enumerate(module.calls):
+                                        runtime_call = RuntimeCall(
+                                            spec_version=spec_version,
+                                            module_id=module_id,
+                                            call_id=call.get_identifier(),
+                                            index=idx,
+                                            name=call.name,
+                                            lookup=call.lookup,
+                                            documentation='\n'.join(call.docs),
+                                            count_params=len(call.args)
                                         )
-                                        value_obj.decode()
-                                        value = value_obj.serialize()
-                                    except ValueError:
-                                        value = constant.constant_value
-                                    except RemainingScaleBytesNotEmptyException:
-                                        value = constant.constant_value
-                                    except NotImplementedError:
-                                        value = constant.constant_value
-
-                                    runtime_constant = RuntimeConstant(
-                                        spec_version=spec_version,
-                                        module_id=module_id,
-                                        index=idx,
-                                        name=constant.name,
-                                        type=constant.type,
-                                        value=value,
-                                        documentation='\n'.join(constant.docs)
-                                    )
-                                    runtime_constant.save(self.db_session)
+                                        runtime_call.save(self.db_session)
+
+                                        for arg in call.args:
+                                            runtime_call_param = RuntimeCallParam(
+                                                runtime_call_id=runtime_call.id,
+                                                name=arg.name,
+                                                type=arg.type
+                                            )
+                                            runtime_call_param.save(self.db_session)
+
+                                            # Check if type already registered in database
+                                            self.process_metadata_type(arg.type, spec_version)
+
+                                if len(module.events or []) > 0:
+                                    for event_index, event in enumerate(module.events):
+                                        runtime_event = RuntimeEvent(
+                                            spec_version=spec_version,
+                                            module_id=module_id,
+                                            event_id=event.name,
+                                            index=event_index,
+                                            name=event.name,
+                                            lookup=event.lookup,
+                                            documentation='\n'.join(event.docs),
+                                            count_attributes=len(event.args)
+                                        )
+                                        runtime_event.save(self.db_session)
+
+                                        for arg_index, arg in enumerate(event.args):
+                                            runtime_event_attr = RuntimeEventAttribute(
+                                                runtime_event_id=runtime_event.id,
+                                                index=arg_index,
+                                                type=arg
+                                            )
+                                            runtime_event_attr.save(self.db_session)
+
+                                if len(storage_functions) > 0:
+                                    for idx, storage in enumerate(storage_functions):
+
+                                        # Determine type
+                                        type_hasher = None
+                                        type_key1 = None
+                                        type_key2 = None
+                                        type_value = None
+                                        type_is_linked = None
+                                        type_key2hasher = None
+
+                                        if storage.type.get('PlainType'):
+                                            type_value = storage.type.get('PlainType')
+
+                                        elif storage.type.get('MapType'):
+                                            type_hasher = storage.type['MapType'].get('hasher')
+                                            type_key1 = storage.type['MapType'].get('key')
+                                            type_value = storage.type['MapType'].get('value')
+                                            type_is_linked = storage.type['MapType'].get('isLinked', False)
+
+                                        elif storage.type.get('DoubleMapType'):
+                                            type_hasher = storage.type['DoubleMapType'].get('hasher')
+                                            type_key1 = storage.type['DoubleMapType'].get('key1')
+                                            type_key2 = storage.type['DoubleMapType'].get('key2')
+                                            type_value = storage.type['DoubleMapType'].get('value')
+                                            type_key2hasher = storage.type['DoubleMapType'].get('key2Hasher')
+
+                                        runtime_storage = RuntimeStorage(
+                                            spec_version=spec_version,
+                                            module_id=module_id,
+                                            index=idx,
+                                            name=storage.name,
+                                            lookup=None,
+                                            default=storage.fallback,
+                                            modifier=storage.modifier,
+                                            type_hasher=type_hasher,
+                                            type_key1=type_key1,
+                                            type_key2=type_key2,
+                                            type_value=type_value,
+                                            type_is_linked=type_is_linked,
+                                            type_key2hasher=type_key2hasher,
+                                            documentation='\n'.join(storage.docs)
+                                        )
+                                        runtime_storage.save(self.db_session)
+
+                                        # Check if types already registered in database
+
+                                        self.process_metadata_type(type_value, spec_version)
+
+                                        if type_key1:
+                                            self.process_metadata_type(type_key1, spec_version)
+
+                                        if type_key2:
+                                            self.process_metadata_type(type_key2, spec_version)
+
+                                if len(module.constants or []) > 0:
+                                    for idx, constant in enumerate(module.constants):
+
+                                        # Decode value
+                                        try:
+                                            value_obj = ScaleDecoder.get_decoder_class(
+                                                constant.type,
+                                                ScaleBytes(constant.constant_value)
+                                            )
+                                            value_obj.decode()
+                                            value = value_obj.serialize()
+                                        except ValueError:
+                                            value = constant.constant_value
+                                        except RemainingScaleBytesNotEmptyException:
+                                            value = constant.constant_value
+                                        except NotImplementedError:
+                                            value = constant.constant_value
+
+                                        runtime_constant = RuntimeConstant(
+                                            spec_version=spec_version,
+                                            module_id=module_id,
+                                            index=idx,
+                                            name=constant.name,
+                                            type=constant.type,
+                                            value=value,
+                                            documentation='\n'.join(constant.docs)
+                                        )
+                                        runtime_constant.save(self.db_session)
+
+                                        # Check if types already registered in database
+                                        self.process_metadata_type(constant.type, spec_version)
+
+                            runtime.save(self.db_session)
+
+                        self.db_session.commit()
+
+                        # Put in local store
+                        self.metadata_store[spec_version] = metadata_decoder
+                    except SQLAlchemyError as e:
+                        self.db_session.rollback()
+                        metadata_decoder = None
+
+        return metadata_decoder
+
+    def insert_block(self, block):
+        """
+        Write the row of a processed block, unless a block with the same number is already stored. The row is written
+        before the other rows of the block, so a duplicate is detected before anything else of the block is written.
+        :param block: Block
+        :return: True if the block was newly added
+        """
+        statement = Block.__table__.insert().prefix_with('IGNORE').values(EntityCache.get_row(Block.__table__, block))
+
+        if self.db_session.execute(statement).rowcount:
+            # Attach the stored block to the session, so later changes to it are written as updates
+            make_transient_to_detached(block)
+            self.db_session.add(block)
+            return True
+
+        # IGNORE also skips rows with other errors, only a stored block is a duplicate
+        if not self.db_session.query(Block.id).filter_by(id=block.id).count():
+            raise SQLAlchemyError('Block {} could not be inserted'.format(block.id))
+
+        return False
+
+    @staticmethod
+    def get_block_events(substrate, block_hash, spec_version, metadata):
+        """
+        Retrieve the events of a block and decode them with the fixed layouts of the runtime where available
+        :param substrate: SubstrateInterface
+        :param block_hash:
+        :param spec_version: spec version of the parent block
+        :param metadata: MetadataDecoder of the runtime
+        :return: DecodedEvents
+        """
+        if metadata.version.index >= 9:
+            storage_hash = STORAGE_HASH_SYSTEM_EVENTS_V9
+        else:
+            storage_hash = STORAGE_HASH_SYSTEM_EVENTS
+
+        response = substrate.rpc_request("state_getStorageAt", [storage_hash, block_hash])
+
+        if not response.get('result'):
+            raise SubstrateRequestException("Error occurred during retrieval of events")
+
+        return get_fast_events_decoder(spec_version, metadata).decode(response.get('result'))
+
+    @staticmethod
+    def decode_extrinsic(extrinsic, spec_version, metadata, fast_extrinsic_decoder):
+        """
+        Decode an extrinsic with a fixed layout decoder when available, otherwise generically. Generic results are
+        cached by payload, so repeated payloads are only decoded once. Cached results are shared and must not be
+        modified.
+        :param extrinsic: hex string with 0x prefix
+        :param spec_version:
+        :param metadata: MetadataDecoder of the runtime
+        :param fast_extrinsic_decoder: FastExtrinsicDecoder of the runtime
+        :return: DecodedExtrinsic or ExtrinsicsDecoder
+        """
+        # Frequent inherents have a fixed layout, and are mostly unique
+        decoded_extrinsic = fast_extrinsic_decoder.decode(extrinsic)
+
+        if decoded_extrinsic:
+            return decoded_extrinsic
+
+        if EXTRINSIC_DECODE_CACHE_SIZE:
+            key = extrinsic_decode_cache.get_key(spec_version, extrinsic)
+            decoded_extrinsic = extrinsic_decode_cache.get(key)
+
+            if decoded_extrinsic:
+                return decoded_extrinsic
+
+        extrinsics_decoder = ExtrinsicsDecoder(data=ScaleBytes(extrinsic), metadata=metadata)
+
+        decoded_extrinsic = DecodedExtrinsic(
+            extrinsics_decoder.decode(),
+            extrinsic_hash=extrinsics_decoder.extrinsic_hash,
+            contains_transaction=extrinsics_decoder.contains_transaction
+        )
 
-                                    # Check if types already registered in database
-                                    self.process_metadata_type(constant.type, spec_version)
+        if EXTRINSIC_DECODE_CACHE_SIZE:
+            extrinsic_decode_cache[key] = decoded_extrinsic
 
-                        runtime.save(self.db_session)
+        return decoded_extrinsic
 
-                    self.db_session.commit()
+    @staticmethod
+    def prefetch_processor_storage(substrate, storage_processors):
+        """
+        Retrieve the storage items declared by processors concurrently, identical items are retrieved once
+        :param substrate:
+        :param storage_processors: list of (processor, list of StorageRequest)
+        """
+        futures = prefetch_storage(substrate, [
+            request for processor, requests in storage_processors for request in requests
+        ])
 
-                    # Put in local store
-                    self.metadata_store[spec_version] = metadata_decoder
-                except SQLAlchemyError as e:
-                    self.db_session.rollback()
+        offset = 0
+        for processor, requests in storage_processors:
+            processor.set_prefetched_storage(requests, futures[offset:offset + len(requests)])
+            offset += len(requests)
 
     def add_block(self, block_hash):
-
-        # Check if block is already process
-        if Block.query(self.db_session).filter_by(hash=block_hash).count() > 0:
-            raise BlockAlreadyAdded(block_hash)
-
+        """
+        Retrieve, decode and store given block. The block row is written with INSERT IGNORE when the block is
+        persisted, a block that was already added is reported by BlockAlreadyAdded and nothing of it is written.
+        :param block_hash:
+        :return: Block
+        """
         # Extract data from json_block
-        substrate = SubstrateInterface(SUBSTRATE_RPC_URL)
+        substrate = BalancedSubstrateInterface(SUBSTRATE_RPC_URLS)
 
         if SUBSTRATE_MOCK_EXTRINSICS:
             substrate.mock_extrinsics = SUBSTRATE_MOCK_EXTRINSICS
@@ -500,18 +713,6 @@ class PolkascanHarvesterService(BaseService):
         # Get spec version
         spec_version = json_runtime_version.get('specVersion', 0)
 
-        self.process_metadata(json_runtime_version, block_hash)
-
-        # ==== Get parent block runtime ===================
-        if block_id > 0:
-            json_parent_runtime_version = substrate.get_block_runtime_version(parent_hash)
-
-            parent_spec_version = json_parent_runtime_version.get('specVersion', 0)
-
-            self.process_metadata(json_parent_runtime_version, parent_hash)
-        else:
-            parent_spec_version = spec_version
-
         # ==== Set initial block properties =====================
 
         block = Block(
@@ -546,22 +747,44 @@ class PolkascanHarvesterService(BaseService):
             logs=digest_logs
         )
 
+        # Keep references to the decoders, the metadata store might evict them while processing this block
+        metadata = self.process_metadata(json_runtime_version, block_hash)
+
+        # ==== Get parent block runtime ===================
+        if block_id > 0:
+            json_parent_runtime_version = substrate.get_block_runtime_version(parent_hash)
+
+            parent_spec_version = json_parent_runtime_version.get('specVersion', 0)
+
+            parent_metadata = self.process_metadata(json_parent_runtime_version, parent_hash)
+        else:
+            parent_spec_version = spec_version
+            parent_metadata = metadata
+
         # Set temp helper variables
         block._accounts_new = []
         block._accounts_reaped = []
+        block._balance_accounts_new = []
+        block._logs = []
 
         # ==== Get block events from Substrate ==================
         extrinsic_success_idx = {}
         events = []
+        # Events of types that have processors, with their processor classes
+        event_processors = []
+
+        dispatch_table = ProcessorRegistry().get_dispatch_table(parent_spec_version, parent_metadata)
 
         try:
-            events_decoder = substrate.get_block_events(block_hash, self.metadata_store[parent_spec_version])
+            events_decoder = self.get_block_events(substrate, block_hash, parent_spec_version, parent_metadata)
 
             event_idx = 0
 
             for event in events_decoder.elements:
 
-                event.value['module_id'] = event.value['module_id'].lower()
+                event.value['module_id'] = dispatch_table.get_event_module_id(
+                    event.value['type'], event.value['module_id']
+                )
 
                 model = Event(
                     block_id=block_id,
@@ -601,10 +824,12 @@ class PolkascanHarvesterService(BaseService):
 
                     block.count_events_module += 1
 
-                model.save(self.db_session)
-
                 events.append(model)
 
+                processors = dispatch_table.get_event_processors(event.value['type'])
+                if processors:
+                    event_processors.append((model, processors))
+
                 event_idx += 1
 
             block.count_events = len(events_decoder.elements)
@@ -621,6 +846,12 @@ class PolkascanHarvesterService(BaseService):
         extrinsic_idx = 0
 
         extrinsics = []
+        transfers = []
+
+        # Processors with storage requests, their hooks run after the storage of the block is prefetched
+        storage_processors = []
+
+        fast_extrinsic_decoder = get_fast_extrinsic_decoder(parent_spec_version, parent_metadata)
 
         for extrinsic in extrinsics_data:
 
@@ -629,12 +860,11 @@ class PolkascanHarvesterService(BaseService):
                 # TODO TEMP fix for exception in Alexander network, remove when network is obsolete
                 extrinsics_decoder = ExtrinsicsBlock61181Decoder(
                     data=ScaleBytes(extrinsic),
-                    metadata=self.metadata_store[parent_spec_version]
+                    metadata=parent_metadata
                 )
             else:
-                extrinsics_decoder = ExtrinsicsDecoder(
-                    data=ScaleBytes(extrinsic),
-                    metadata=self.metadata_store[parent_spec_version]
+                extrinsics_decoder = self.decode_extrinsic(
+                    extrinsic, parent_spec_version, parent_metadata, fast_extrinsic_decoder
                 )
             extrinsic_data = extrinsics_decoder.decode()
 
@@ -667,7 +897,9 @@ class PolkascanHarvesterService(BaseService):
                 error=int(not extrinsic_success),
                 codec_error=False
             )
-            model.save(self.db_session)
+
+            # Typed values of fast decoded calls, so processors don't have to parse the serialized params
+            model._typed_params = extrinsic_data.get('typed_params', {})
 
             if extrinsic_data.get('call_module_function') == 'transfer':
                 if len(extrinsic_data.get('params')) > 1:
@@ -699,7 +931,7 @@ class PolkascanHarvesterService(BaseService):
                     created_at=datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
                     updated_at=datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")#time.asctime(time.localtime(time.time()))
                 )
-                transfer.save(self.db_session)
+                transfers.append(transfer)
 
             extrinsics.append(model)
 
@@ -718,13 +950,19 @@ class PolkascanHarvesterService(BaseService):
                 block.count_extrinsics_unsigned += 1
 
             # Process extrinsic processors
-            for processor_class in ProcessorRegistry().get_extrinsic_processors(model.module_id, model.call_id):
+            for processor_class in dispatch_table.get_extrinsic_processors(model.call):
                 extrinsic_processor = processor_class(block, model)
-                extrinsic_processor.accumulation_hook(self.db_session)
+                requests = extrinsic_processor.storage_requests(self.db_session)
 
+                if requests:
+                    storage_processors.append((extrinsic_processor, requests))
+                else:
+                    extrinsic_processor.accumulation_hook(self.db_session)
 
-        # Process event processors
-        for event in events:
+        # Plan event processors, only events of types that have processors
+        accumulation_processors = [processor for processor, requests in storage_processors]
+
+        for event, processors in event_processors:
             extrinsic = None
             if event.extrinsic_idx is not None:
                 try:
@@ -732,13 +970,25 @@ class PolkascanHarvesterService(BaseService):
                 except IndexError:
                     extrinsic = None
 
-            for processor_class in ProcessorRegistry().get_event_processors(event.module_id, event.event_id):
+            for processor_class in processors:
                 event_processor = processor_class(block, event, extrinsic,
-                                                  metadata=self.metadata_store.get(block.spec_version_id))
-                event_processor.accumulation_hook(self.db_session)
+                                                  metadata=metadata)
+                requests = event_processor.storage_requests(self.db_session)
+
+                if requests:
+                    storage_processors.append((event_processor, requests))
+
+                accumulation_processors.append(event_processor)
+
+        # Retrieve the declared storage items of all processors in one concurrent round
+        self.prefetch_processor_storage(substrate, storage_processors)
+
+        # Process extrinsic processors with storage requests and event processors
+        for processor in accumulation_processors:
+            processor.accumulation_hook(self.db_session)
 
         # Process block processors
-        for processor_class in ProcessorRegistry().get_block_processors():
+        for processor_class in dispatch_table.block_processors:
             block_processor = processor_class(block)
             block_processor.accumulation_hook(self.db_session)
 
@@ -748,19 +998,28 @@ class PolkascanHarvesterService(BaseService):
 
         # ==== Save data block ==================================
 
-        block.save(self.db_session)
+        if not self.insert_block(block):
+            # Discard the rows written by processors, e.g. audits
+            self.db_session.rollback()
+            raise BlockAlreadyAdded(block_hash, block_id=block_id, parent_hash=parent_hash)
+
+        self.db_session.add_all(events + extrinsics + transfers)
+        self.db_session.flush()
+
+        if block._logs:
+            self.db_session.execute(Log.__table__.insert(), block._logs)
 
         return block
 
-    def sequence_block(self, block, parent_block_data=None, parent_sequenced_block_data=None):
+    def run_sequencing_hooks(self, block, sequenced_block=None, parent_block_data=None,
+                             parent_sequenced_block_data=None, streams=None):
 
-        sequenced_block = BlockTotal(
-            id=block.id
-        )
+        def in_streams(processor_class):
+            return streams is None or processor_class.sequencing_stream in streams
 
-        if block:
-            # Process block processors
-            for processor_class in ProcessorRegistry().get_block_processors():
+        # Process block processors
+        for processor_class in ProcessorRegistry().get_block_processors():
+            if in_streams(processor_class):
                 block_processor = processor_class(block, sequenced_block)
                 block_processor.sequencing_hook(
                     self.db_session,
@@ -768,11 +1027,12 @@ class PolkascanHarvesterService(BaseService):
                     parent_sequenced_block_data
                 )
 
-            extrinsics = Extrinsic.query(self.db_session).filter_by(block_id=block.id)
+        extrinsics = Extrinsic.query(self.db_session).filter_by(block_id=block.id)
 
-            for extrinsic in extrinsics:
-                # Process extrinsic processors
-                for processor_class in ProcessorRegistry().get_extrinsic_processors(extrinsic.module_id, extrinsic.call_id):
+        for extrinsic in extrinsics:
+            # Process extrinsic processors
+            for processor_class in ProcessorRegistry().get_extrinsic_processors(extrinsic.module_id, extrinsic.call_id):
+                if in_streams(processor_class):
                     extrinsic_processor = processor_class(block, extrinsic)
                     extrinsic_processor.sequencing_hook(
                         self.db_session,
@@ -780,19 +1040,20 @@ class PolkascanHarvesterService(BaseService):
                         parent_sequenced_block_data
                     )
 
-            events = Event.query(self.db_session).filter_by(block_id=block.id).order_by('event_idx')
-
-            # Process event processors
-            for event in events:
-                extrinsic = None
-                if event.extrinsic_idx is not None:
-                    try:
-                        extrinsic = extrinsics[event.extrinsic_idx]
-                    except IndexError:
-                        extrinsic = None
+        events = Event.query(self.db_session).filter_by(block_id=block.id).order_by('event_idx')
 
+        # Process event processors
+        for event in events:
+            extrinsic = None
+            if event.extrinsic_idx is not None:
+                try:
                     extrinsic = extrinsics[event.extrinsic_idx]
-                for processor_class in ProcessorRegistry().get_event_processors(event.module_id, event.event_id):
+                except IndexError:
+                    extrinsic = None
+
+                extrinsic = extrinsics[event.extrinsic_idx]
+            for processor_class in ProcessorRegistry().get_event_processors(event.module_id, event.event_id):
+                if in_streams(processor_class):
                     event_processor = processor_class(block, event, extrinsic)
                     event_processor.sequencing_hook(
                         self.db_session,
@@ -800,7 +1061,319 @@ class PolkascanHarvesterService(BaseService):
                         parent_sequenced_block_data
                     )
 
+    def sequence_block(self, block, parent_block_data=None, parent_sequenced_block_data=None):
+
+        sequenced_block = BlockTotal(
+            id=block.id
+        )
+
+        if block:
+            # When streams are sequenced independently only the totals stream is processed in this phase
+            self.run_sequencing_hooks(
+                block,
+                sequenced_block,
+                parent_block_data,
+                parent_sequenced_block_data,
+                streams=['totals'] if SEQUENCER_STREAMS else None
+            )
+
         sequenced_block.save(self.db_session)
 
         return sequenced_block
 
+    def sequence_stream_block(self, stream, block):
+        """
+        Process the sequencing hooks of one stream for given block and move the watermark of the stream to this block.
+        Blocks must be processed in order, starting from the genesis block.
+        :param stream:
+        :param block:
+        :return: SequencerCheckpoint
+        """
+        checkpoint = SequencerCheckpoint.get(self.db_session, stream)
+
+        if block.id != checkpoint.block_id + 1:
+            raise ValueError('Stream {} is at block {}, cannot sequence block {}'.format(
+                stream, checkpoint.block_id, block.id
+            ))
+
+        if stream == 'sessions' and block.id == 0:
+            # Create initial session
+            initial_session_event = NewSessionEventProcessor(block, Event(), None)
+            initial_session_event.add_session(db_session=self.db_session, session_id=0)
+
+        self.run_sequencing_hooks(block, streams=[stream])
+
+        checkpoint.block_id = block.id
+        checkpoint.save(self.db_session)
+
+        return checkpoint
+
+    def get_sequencer_progress(self):
+        """
+        Last sequenced block per sequencing stream, for a sharded stream the shard furthest behind
+        :return: dict
+        """
+        max_sequenced_block_id = self.db_session.query(func.max(BlockTotal.id)).scalar()
+
+        if max_sequenced_block_id is None:
+            max_sequenced_block_id = -1
+
+        progress = {}
+
+        for stream in SEQUENCING_STREAMS:
+            if not is_independent_stream(stream):
+                progress[stream] = max_sequenced_block_id
+            elif SEQUENCER_ACCOUNT_SHARDS and stream in SHARDED_STREAMS:
+                checkpoints = SequencerCheckpoint.query(self.db_session).filter_by(stream=stream).all()
+                if len(checkpoints) < SEQUENCER_ACCOUNT_SHARDS:
+                    progress[stream] = -1
+                else:
+                    progress[stream] = min([checkpoint.block_id for checkpoint in checkpoints])
+            else:
+                progress[stream] = SequencerCheckpoint.get(self.db_session, stream).block_id
+
+        return progress
+
+    def rebuild_stream(self, stream):
+        """
+        Remove all state maintained by given stream and reset its watermark, so it will be sequenced again from the
+        genesis block. The caller must hold the sequencer locks of the stream, see `app.tasks.stream_locks`.
+        :param stream:
+        :return:
+        """
+        if not is_independent_stream(stream):
+            raise ValueError('Stream {} is not sequenced independently and can not be rebuilt'.format(stream))
+
+        for model in SEQUENCING_STREAMS[stream]:
+            model.query(self.db_session).delete(synchronize_session=False)
+
+        if stream == 'sessions':
+            # Block authors are derived from the session validators
+            BlockTotal.query(self.db_session).filter(BlockTotal.author.isnot(None)).update(
+                {BlockTotal.author: None}, synchronize_session=False
+            )
+
+        SequencerCheckpoint.query(self.db_session).filter_by(stream=stream).delete(synchronize_session=False)
+
+        self.clear_stream_caches(stream)
+
+    def clear_stream_caches(self, stream):
+        """
+        Drop the state of given stream cached by this process, which is stale once the stream is rebuilt
+        :param stream:
+        :return:
+        """
+        if stream == 'sessions':
+            session_validators.clear()
+
+    def sequence_account_shard(self, stream, shard, count_shards=SEQUENCER_ACCOUNT_SHARDS,
+                               max_blocks=SEQUENCER_SHARD_BATCH):
+        """
+        Process the account or index audits of one shard of accounts or indices, from its checkpoint up to the last
+        block sequenced by the block totals sequencer. Shards are independent, so they can be processed in parallel;
+        within a shard audits are processed in (block_id, event_idx) order. The caller must make sure only one task at
+        a time processes a shard.
+        :param stream: 'accounts' or 'indices'
+        :param shard:
+        :param count_shards:
+        :param max_blocks:
+        :return: SequencerCheckpoint
+        """
+
+        if stream == 'accounts':
+            audit_model = AccountAudit
+            processor = AccountBlockProcessor(block=None)
+        elif stream == 'indices':
+            audit_model = AccountIndexAudit
+            processor = AccountIndexBlockProcessor(block=None)
+        else:
+            raise ValueError('Unknown sequencer stream "{}"'.format(stream))
+
+        checkpoint = SequencerCheckpoint.get(self.db_session, stream, shard)
+
+        # Audits are complete for all blocks that are sequenced, so this bound guarantees there are no gaps
+        max_sequenced_block_id = self.db_session.query(func.max(BlockTotal.id)).scalar()
+
+        if max_sequenced_block_id is None or checkpoint.block_id >= max_sequenced_block_id:
+            return checkpoint
+
+        end_block_id = min(max_sequenced_block_id, checkpoint.block_id + max_blocks)
+
+        audits = audit_model.query(self.db_session).filter(
+            audit_model.block_id > checkpoint.block_id,
+            audit_model.block_id <= end_block_id
+        ).order_by(audit_model.block_id, audit_model.event_idx)
+
+        for audit in audits:
+            if stream == 'accounts':
+                # Shard of an account is determined by the first 4 bytes of its account id
+                if int(audit.account_id[:8], 16) % count_shards == shard:
+                    processor.process_audit(self.db_session, audit)
+            elif audit.account_index_id is None or audit.account_index_id % count_shards == shard:
+                # Audits without an index, like reaped accounts, apply to the indices of the account in each shard
+                processor.process_audit(self.db_session, audit, shard=shard, count_shards=count_shards)
+
+        checkpoint.block_id = end_block_id
+        checkpoint.save(self.db_session)
+
+        return checkpoint
+
+    def reconcile_balances(self, sample_size, correct=BALANCE_RECONCILE_CORRECT):
+        """
+        Compare the balance derived by the balance ledger of a random sample of accounts with the free balance in the
+        chain state at the block the accounts stream has reached. Differences, e.g. because of transaction fees that
+        are withdrawn without an event, are recorded as a drift audit of the account. Only when `correct` is set the
+        derived balance is replaced by the balance in the chain state, the audit then replays the correction when the
+        accounts stream is rebuilt.
+        :param sample_size:
+        :param correct:
+        :return: dict
+        """
+        block_id = self.get_sequencer_progress()['accounts']
+        block = Block.query(self.db_session).get(block_id)
+
+        if not block:
+            return {'block_id': block_id, 'checked': 0, 'drift': []}
+
+        storage_call = RuntimeStorage.lookup(self.db_session, block.spec_version_id, 'balances', 'FreeBalance')
+
+        if not storage_call:
+            return {'block_id': block_id, 'checked': 0, 'drift': []}
+
+        # Accounts changed after given block can't be compared with its state
+        accounts_query = Account.query(self.db_session).filter(Account.updated_at_block <= block.id)
+
+        # Sample consecutive accounts from a random starting point
+        start_account_id = '{:064x}'.format(random.getrandbits(256))
+        accounts = accounts_query.filter(Account.id >= start_account_id).order_by(Account.id).limit(sample_size).all()
+
+        if len(accounts) < sample_size:
+            accounts += accounts_query.filter(Account.id < start_account_id).order_by(Account.id).limit(
+                sample_size - len(accounts)
+            ).all()
+
+        substrate = BalancedSubstrateInterface(SUBSTRATE_RPC_URLS)
+        drift = []
+
+        for account in accounts:
+            balance = substrate.get_storage(
+                block_hash=block.hash,
+                module='Balances',
+                function='FreeBalance',
+                params=account.id,
+                return_scale_type=storage_call.get_return_type(),
+                hasher=storage_call.type_hasher
+            ) or 0
+
+            if int(balance) != int(account.balance):
+                drift.append({
+                    'account_id': account.id,
+                    'balance': int(account.balance),
+                    'chain_balance': int(balance)
+                })
+
+                account_audit = AccountAudit(
+                    account_id=account.id,
+                    block_id=block.id,
+                    type_id=ACCOUNT_AUDIT_TYPE_BALANCE_DRIFT,
+                    # Stored as string, JSON numbers in MySQL lose precision above 64 bits
+                    data={'balance': str(account.balance), 'chain_balance': str(balance), 'corrected': correct}
+                )
+                account_audit.save(self.db_session)
+
+                if correct:
+                    account.balance = balance
+                    account.balance_at_block = block.id
+                    account.save(self.db_session)
+
+        return {'block_id': block_id, 'checked': len(accounts), 'drift': drift, 'corrected': correct}
+
+    def aggregate_blocks(self, max_blocks):
+        """
+        Update the timeframe buckets of blocks sequenced since the previous run, by recomputing every changed bucket
+        with the aggregation hooks of the block processors
+        :param max_blocks:
+        :return: SequencerCheckpoint
+        """
+        checkpoint = SequencerCheckpoint.get(self.db_session, 'aggregates')
+
+        max_sequenced_block_id = self.db_session.query(func.max(BlockTotal.id)).scalar()
+
+        if max_sequenced_block_id is None or checkpoint.block_id >= max_sequenced_block_id:
+            return checkpoint
+
+        end_block_id = min(max_sequenced_block_id, checkpoint.block_id + max_blocks)
+
+        buckets = set()
+
+        for timeframe, column_name in BlockAggregate.timeframes.items():
+            column = getattr(Block, column_name)
+            for bucket, in self.db_session.query(column).filter(
+                    Block.id > checkpoint.block_id, Block.id <= end_block_id, column.isnot(None)
+            ).distinct():
+                buckets.add((timeframe, bucket))
+
+        for timeframe, bucket in sorted(buckets):
+            aggregate = BlockAggregate.query(self.db_session).get((timeframe, bucket)) or \
+                BlockAggregate(timeframe=timeframe, bucket=bucket)
+
+            aggregate.block_from, aggregate.block_to, aggregate.count_blocks = self.db_session.query(
+                func.min(Block.id), func.max(Block.id), func.count(Block.id)
+            ).filter(aggregate.block_filter()).one()
+
+            for processor_class in ProcessorRegistry().get_block_processors():
+                block_processor = processor_class(None)
+                block_processor.aggregation_hook(self.db_session, aggregate)
+
+            aggregate.save(self.db_session)
+
+        checkpoint.block_id = end_block_id
+        checkpoint.save(self.db_session)
+
+        return checkpoint
+
+    def sync_block_account_index(self, checkpoint, block_to, chunk_size):
+        """
+        Set the missing authority index of the next chunk of blocks after the checkpoint, from their PreRuntime logs.
+        Blocks are paginated by key and updated with one statement, so any range of blocks can be processed in
+        bounded memory and transaction size.
+        :param checkpoint: SequencerCheckpoint, advanced to the last block of the chunk
+        :param block_to: last block of the range, inclusive
+        :param chunk_size: maximum number of blocks
+        :return: number of blocks updated
+        """
+        block_ids = [block_id for block_id, in self.db_session.query(Block.id).filter(
+            Block.id > checkpoint.block_id, Block.id <= block_to, Block.account_index.is_(None)
+        ).order_by(Block.id).limit(chunk_size)]
+
+        if not block_ids:
+            checkpoint.block_id = block_to
+            checkpoint.save(self.db_session)
+            return 0
+
+        account_indices = {}
+
+        for block_id, data in self.db_session.query(Log.block_id, Log.data).filter(
+                Log.block_id.in_(block_ids), Log.type == 'PreRuntime'
+        ).order_by(Log.block_id, Log.log_idx):
+            # Only the first PreRuntime log of a block is used
+            if block_id not in account_indices:
+                account_indices[block_id] = decode_authority_index(data.get('value', {}).get('data'))
+
+        rows = [
+            {'b_id': block_id, 'b_account_index': account_indices[block_id]}
+            for block_id in block_ids if account_indices.get(block_id) is not None
+        ]
+
+        if rows:
+            self.db_session.execute(
+                Block.__table__.update().where(Block.id == bindparam('b_id')).values(
+                    account_index=bindparam('b_account_index')
+                ),
+                rows
+            )
+
+        checkpoint.block_id = block_to if len(block_ids) < chunk_size else block_ids[-1]
+        checkpoint.save(self.db_session)
+
+        return len(rows)
@@ -23,23 +23,53 @@ from packaging import version
 from app.models.data import Account, AccountIndex, DemocracyProposal, Contract, Session, AccountAudit, \
     AccountIndexAudit, DemocracyProposalAudit, SessionTotal, SessionValidator, DemocracyReferendumAudit, RuntimeStorage, \
     SessionNominator
+from app.processors.analytics import update_session_analytics, update_era_analytics
 from app.processors.base import EventProcessor
-from app.settings import ACCOUNT_AUDIT_TYPE_NEW, ACCOUNT_AUDIT_TYPE_REAPED, ACCOUNT_INDEX_AUDIT_TYPE_NEW, \
-    ACCOUNT_INDEX_AUDIT_TYPE_REAPED, DEMOCRACY_PROPOSAL_AUDIT_TYPE_PROPOSED, DEMOCRACY_PROPOSAL_AUDIT_TYPE_TABLED, \
-    SUBSTRATE_RPC_URL, DEMOCRACY_REFERENDUM_AUDIT_TYPE_STARTED, DEMOCRACY_REFERENDUM_AUDIT_TYPE_PASSED, \
+from app.settings import ACCOUNT_AUDIT_TYPE_NEW, ACCOUNT_AUDIT_TYPE_REAPED, ACCOUNT_AUDIT_TYPE_BALANCE, \
+    ACCOUNT_INDEX_AUDIT_TYPE_NEW, ACCOUNT_INDEX_AUDIT_TYPE_REAPED, DEMOCRACY_PROPOSAL_AUDIT_TYPE_PROPOSED, \
+    DEMOCRACY_PROPOSAL_AUDIT_TYPE_TABLED, \
+    SUBSTRATE_RPC_URLS, DEMOCRACY_REFERENDUM_AUDIT_TYPE_STARTED, DEMOCRACY_REFERENDUM_AUDIT_TYPE_PASSED, \
     DEMOCRACY_REFERENDUM_AUDIT_TYPE_NOTPASSED, DEMOCRACY_REFERENDUM_AUDIT_TYPE_CANCELLED, \
     DEMOCRACY_REFERENDUM_AUDIT_TYPE_EXECUTED, LEGACY_SESSION_VALIDATOR_LOOKUP
 from app.utils.ss58 import ss58_encode
 from scalecodec import ScaleBytes
 from scalecodec.base import ScaleDecoder
 from scalecodec.exceptions import RemainingScaleBytesNotEmptyException
-from substrateinterface import SubstrateInterface
+from app.utils.substrate import BalancedSubstrateInterface, StorageRequest, prefetch_storage
 
 
 class NewSessionEventProcessor(EventProcessor):
 
     module_id = 'session'
     event_id = 'NewSession'
+    sequencing_stream = 'sessions'
+
+    def storage_request(self, db_session, key, module, function, params=None):
+        """
+        Request of a storage item of the runtime of the block, None when the runtime doesn't have it
+        :return: StorageRequest
+        """
+        storage_call = RuntimeStorage.lookup(db_session, self.block.spec_version_id, module.lower(), function)
+
+        if storage_call:
+            return StorageRequest(
+                key=key,
+                block_hash=self.block.hash,
+                module=module,
+                function=function,
+                params=params,
+                return_scale_type=storage_call.get_return_type(),
+                hasher=storage_call.type_hasher
+            )
+
+    @staticmethod
+    def fetch_storage(substrate, requests):
+        """
+        Retrieve given storage requests concurrently, requests that are None are skipped
+        :return: dict of Future by request key
+        """
+        requests = [request for request in requests if request]
+        return {request.key: future for request, future in zip(requests, prefetch_storage(substrate, requests))}
 
     def add_session(self, db_session, session_id):
         current_era = None
@@ -47,128 +77,114 @@ class NewSessionEventProcessor(EventProcessor):
         nominators = []
         validation_session_lookup = {}
 
-        substrate = SubstrateInterface(SUBSTRATE_RPC_URL)
+        substrate = BalancedSubstrateInterface(SUBSTRATE_RPC_URLS)
 
-        # Retrieve current era
-        storage_call = RuntimeStorage.query(db_session).filter_by(
-            module_id='staking',
-            name='CurrentEra',
-            spec_version=self.block.spec_version_id
-        ).first()
+        # Retrieve current era, validators for new session and all session keys in one concurrent round
+        requests = [
+            self.storage_request(db_session, 'current_era', 'Staking', 'CurrentEra'),
+            self.storage_request(db_session, 'validators', 'Session', 'Validators')
+        ]
 
-        if storage_call:
+        if not LEGACY_SESSION_VALIDATOR_LOOKUP:
+            # TODO move to network specific data types
+            requests.append(self.storage_request(db_session, 'queued_keys', 'Session', 'QueuedKeys'))
+
+        storage = self.fetch_storage(substrate, requests)
+
+        if 'current_era' in storage:
             try:
-                current_era = substrate.get_storage(
-                    block_hash=self.block.hash,
-                    module="Staking",
-                    function="CurrentEra",
-                    return_scale_type=storage_call.get_return_type(),
-                    hasher=storage_call.type_hasher
-                )
+                current_era = storage['current_era'].result()
             except RemainingScaleBytesNotEmptyException:
                 pass
 
-        # Retrieve validators for new session from storage
-
-        storage_call = RuntimeStorage.query(db_session).filter_by(
-            module_id='session',
-            name='Validators',
-            spec_version=self.block.spec_version_id
-        ).first()
-
-        if storage_call:
+        if 'validators' in storage:
             try:
-                validators = substrate.get_storage(
-                    block_hash=self.block.hash,
-                    module="Session",
-                    function="Validators",
-                    return_scale_type=storage_call.get_return_type(),
-                    hasher=storage_call.type_hasher
-                ) or []
+                validators = storage['validators'].result() or []
             except RemainingScaleBytesNotEmptyException:
                 pass
 
         # Retrieve all sessions in one call
-        if not LEGACY_SESSION_VALIDATOR_LOOKUP:
+        if 'queued_keys' in storage:
 
-            # Retrieve session account
-            # TODO move to network specific data types
-            storage_call = RuntimeStorage.query(db_session).filter_by(
-                module_id='session',
-                name='QueuedKeys',
-                spec_version=self.block.spec_version_id
-            ).first()
+            try:
+                validator_session_list = storage['queued_keys'].result() or []
+            except RemainingScaleBytesNotEmptyException:
+
+                storage_call = RuntimeStorage.lookup(db_session, self.block.spec_version_id, 'session', 'QueuedKeys')
 
-            if storage_call:
                 try:
                     validator_session_list = substrate.get_storage(
                         block_hash=self.block.hash,
                         module="Session",
                         function="QueuedKeys",
-                        return_scale_type=storage_call.get_return_type(),
+                        return_scale_type='Vec<(ValidatorId, LegacyKeys)>',
                         hasher=storage_call.type_hasher
                     ) or []
                 except RemainingScaleBytesNotEmptyException:
+                    validator_session_list = substrate.get_storage(
+                        block_hash=self.block.hash,
+                        module="Session",
+                        function="QueuedKeys",
+                        return_scale_type='Vec<(ValidatorId, EdgewareKeys)>',
+                        hasher=storage_call.type_hasher
+                    ) or []
 
-                    try:
-                        validator_session_list = substrate.get_storage(
-                            block_hash=self.block.hash,
-                            module="Session",
-                            function="QueuedKeys",
-                            return_scale_type='Vec<(ValidatorId, LegacyKeys)>',
-                            hasher=storage_call.type_hasher
-                        ) or []
-                    except RemainingScaleBytesNotEmptyException:
-                        validator_session_list = substrate.get_storage(
-                            block_hash=self.block.hash,
-                            module="Session",
-                            function="QueuedKeys",
-                            return_scale_type='Vec<(ValidatorId, EdgewareKeys)>',
-                            hasher=storage_call.type_hasher
-                        ) or []
+            # build lookup dict
+            validation_session_lookup = {}
+            for validator_session_item in validator_session_list:
+                session_key = ''
 
-                # build lookup dict
-                validation_session_lookup = {}
-                for validator_session_item in validator_session_list:
-                    session_key = ''
+                if validator_session_item['keys'].get('grandpa'):
+                    session_key = validator_session_item['keys'].get('grandpa')
 
-                    if validator_session_item['keys'].get('grandpa'):
-                        session_key = validator_session_item['keys'].get('grandpa')
+                if validator_session_item['keys'].get('ed25519'):
+                    session_key = validator_session_item['keys'].get('ed25519')
 
-                    if validator_session_item['keys'].get('ed25519'):
-                        session_key = validator_session_item['keys'].get('ed25519')
+                validation_session_lookup[
+                    validator_session_item['validator'].replace('0x', '')] = session_key.replace('0x', '')
 
-                    validation_session_lookup[
-                        validator_session_item['validator'].replace('0x', '')] = session_key.replace('0x', '')
+        # Retrieve the stash (or with the legacy lookup the controller) related storage of all validators concurrently
+        requests = []
+
+        for rank_nr, validator_account in enumerate(validators):
+            validator_account = validator_account.replace('0x', '')
+
+            if not LEGACY_SESSION_VALIDATOR_LOOKUP:
+                requests.append(self.storage_request(
+                    db_session, (rank_nr, 'bonded'), 'Staking', 'Bonded', validator_account
+                ))
+                requests.append(self.storage_request(
+                    db_session, (rank_nr, 'prefs'), 'Staking', 'Validators', validator_account
+                ))
+                requests.append(self.storage_request(
+                    db_session, (rank_nr, 'exposure'), 'Staking', 'Stakers', validator_account
+                ))
+            else:
+                requests.append(self.storage_request(
+                    db_session, (rank_nr, 'ledger'), 'Staking', 'Ledger', validator_account
+                ))
+                requests.append(self.storage_request(
+                    db_session, (rank_nr, 'session'), 'Session', 'NextKeyFor', validator_account
+                ))
+
+        storage = self.fetch_storage(substrate, requests)
+
+        validator_accounts = []
+        requests = []
 
         for rank_nr, validator_account in enumerate(validators):
             validator_stash = None
             validator_controller = None
             validator_ledger = {}
-            validator_prefs = {}
             validator_session = ''
-            exposure = {}
 
             if not LEGACY_SESSION_VALIDATOR_LOOKUP:
                 validator_stash = validator_account.replace('0x', '')
 
                 # Retrieve stash account
-                storage_call = RuntimeStorage.query(db_session).filter_by(
-                    module_id='staking',
-                    name='Bonded',
-                    spec_version=self.block.spec_version_id
-                ).first()
-
-                if storage_call:
+                if (rank_nr, 'bonded') in storage:
                     try:
-                        validator_controller = substrate.get_storage(
-                            block_hash=self.block.hash,
-                            module="Staking",
-                            function="Bonded",
-                            params=validator_stash,
-                            return_scale_type=storage_call.get_return_type(),
-                            hasher=storage_call.type_hasher
-                        ) or ''
+                        validator_controller = storage[(rank_nr, 'bonded')].result() or ''
 
                         validator_controller = validator_controller.replace('0x', '')
 
@@ -182,22 +198,9 @@ class NewSessionEventProcessor(EventProcessor):
                 validator_controller = validator_account.replace('0x', '')
 
                 # Retrieve stash account
-                storage_call = RuntimeStorage.query(db_session).filter_by(
-                    module_id='staking',
-                    name='Ledger',
-                    spec_version=self.block.spec_version_id
-                ).first()
-
-                if storage_call:
+                if (rank_nr, 'ledger') in storage:
                     try:
-                        validator_ledger = substrate.get_storage(
-                            block_hash=self.block.hash,
-                            module="Staking",
-                            function="Ledger",
-                            params=validator_controller,
-                            return_scale_type=storage_call.get_return_type(),
-                            hasher=storage_call.type_hasher
-                        ) or {}
+                        validator_ledger = storage[(rank_nr, 'ledger')].result() or {}
 
                         validator_stash = validator_ledger.get('stash', '').replace('0x', '')
 
@@ -205,64 +208,42 @@ class NewSessionEventProcessor(EventProcessor):
                         pass
 
                 # Retrieve session account
-                storage_call = RuntimeStorage.query(db_session).filter_by(
-                    module_id='session',
-                    name='NextKeyFor',
-                    spec_version=self.block.spec_version_id
-                ).first()
-
-                if storage_call:
+                if (rank_nr, 'session') in storage:
                     try:
-                        validator_session = substrate.get_storage(
-                            block_hash=self.block.hash,
-                            module="Session",
-                            function="NextKeyFor",
-                            params=validator_controller,
-                            return_scale_type=storage_call.get_return_type(),
-                            hasher=storage_call.type_hasher
-                        ) or ''
+                        validator_session = storage[(rank_nr, 'session')].result() or ''
                     except RemainingScaleBytesNotEmptyException:
                         pass
 
                     validator_session = validator_session.replace('0x', '')
 
-            # Retrieve validator preferences for stash account
-            storage_call = RuntimeStorage.query(db_session).filter_by(
-                module_id='staking',
-                name='Validators',
-                spec_version=self.block.spec_version_id
-            ).first()
+                # The stash is only known from the ledger, so its storage is retrieved in a second round
+                requests.append(self.storage_request(
+                    db_session, (rank_nr, 'prefs'), 'Staking', 'Validators', validator_stash
+                ))
+                requests.append(self.storage_request(
+                    db_session, (rank_nr, 'exposure'), 'Staking', 'Stakers', validator_stash
+                ))
+
+            validator_accounts.append((validator_stash, validator_controller, validator_ledger, validator_session))
+
+        storage.update(self.fetch_storage(substrate, requests))
 
-            if storage_call:
+        for rank_nr, (validator_stash, validator_controller, validator_ledger, validator_session) in \
+                enumerate(validator_accounts):
+            validator_prefs = {}
+            exposure = {}
+
+            # Retrieve validator preferences for stash account
+            if (rank_nr, 'prefs') in storage:
                 try:
-                    validator_prefs = substrate.get_storage(
-                        block_hash=self.block.hash,
-                        module="Staking",
-                        function="Validators",
-                        params=validator_stash,
-                        return_scale_type=storage_call.get_return_type(),
-                        hasher=storage_call.type_hasher
-                    ) or {'col1': {}, 'col2': {}}
+                    validator_prefs = storage[(rank_nr, 'prefs')].result() or {'col1': {}, 'col2': {}}
                 except RemainingScaleBytesNotEmptyException:
                     pass
 
             # Retrieve nominators
-            storage_call = RuntimeStorage.query(db_session).filter_by(
-                module_id='staking',
-                name='Stakers',
-                spec_version=self.block.spec_version_id
-            ).first()
-
-            if storage_call:
+            if (rank_nr, 'exposure') in storage:
                 try:
-                    exposure = substrate.get_storage(
-                        block_hash=self.block.hash,
-                        module="Staking",
-                        function="Stakers",
-                        params=validator_stash,
-                        return_scale_type=storage_call.get_return_type(),
-                        hasher=storage_call.type_hasher
-                    ) or {}
+                    exposure = storage[(rank_nr, 'exposure')].result() or {}
                 except RemainingScaleBytesNotEmptyException:
                     pass
 
@@ -334,6 +315,13 @@ class NewSessionEventProcessor(EventProcessor):
 
         session_total.save(db_session)
 
+        update_session_analytics(db_session, session_id - 1)
+
+        # An era is closed when the current era is known and differs, an unknown era doesn't close the previous one
+        if prev_session and prev_session.era is not None and current_era is not None \
+                and prev_session.era != current_era:
+            update_era_analytics(db_session, prev_session.era)
+
     def accumulation_hook(self, db_session):
         self.block.count_sessions_new += 1
 
@@ -358,13 +346,15 @@ class NewAccountEventProcessor(EventProcessor):
             balance = self.event.attributes[1]['value']
 
             self.block._accounts_new.append(account_id)
+            self.block._balance_accounts_new.append((self.event.extrinsic_idx, account_id))
 
             account_audit = AccountAudit(
                 account_id=account_id,
                 block_id=self.event.block_id,
                 extrinsic_idx=self.event.extrinsic_idx,
                 event_idx=self.event.event_idx,
-                type_id=ACCOUNT_AUDIT_TYPE_NEW
+                type_id=ACCOUNT_AUDIT_TYPE_NEW,
+                data={'balance': str(balance)}
             )
 
             account_audit.save(db_session)
@@ -407,6 +397,86 @@ class ReapedAccount(EventProcessor):
             new_account_index_audit.save(db_session)
 
 
+def add_balance_audit(db_session, event, account_id, delta):
+    """
+    Record change of the free balance of an account, applied to the balance ledger during sequencing
+    """
+    account_audit = AccountAudit(
+        account_id=account_id.replace('0x', ''),
+        block_id=event.block_id,
+        extrinsic_idx=event.extrinsic_idx,
+        event_idx=event.event_idx,
+        type_id=ACCOUNT_AUDIT_TYPE_BALANCE,
+        # Stored as string, JSON numbers in MySQL lose precision above 64 bits
+        data={'delta': str(delta)}
+    )
+
+    account_audit.save(db_session)
+
+
+class BalancesTransferEventProcessor(EventProcessor):
+
+    module_id = 'balances'
+    event_id = 'Transfer'
+
+    def accumulation_hook(self, db_session):
+
+        # Check event requirements: from, to, value and optionally fee
+        if len(self.event.attributes) in [3, 4] and \
+                self.event.attributes[0]['type'] == 'AccountId' and self.event.attributes[1]['type'] == 'AccountId':
+
+            from_account_id = self.event.attributes[0]['value'].replace('0x', '')
+            to_account_id = self.event.attributes[1]['value'].replace('0x', '')
+            value = int(self.event.attributes[2]['value'])
+
+            # Only the transfer fee is reported by an event, the balance ledger excludes other transaction fees
+            fee = 0
+            if len(self.event.attributes) == 4:
+                fee = int(self.event.attributes[3]['value'])
+
+            add_balance_audit(db_session, self.event, from_account_id, -(value + fee))
+
+            # Initial balance of a new account is already set by its NewAccount event
+            if (self.event.extrinsic_idx, to_account_id) not in self.block._balance_accounts_new:
+                add_balance_audit(db_session, self.event, to_account_id, value)
+
+
+class BalancesReservedEventProcessor(EventProcessor):
+
+    module_id = 'balances'
+    event_id = 'Reserved'
+
+    def accumulation_hook(self, db_session):
+        if len(self.event.attributes) == 2 and self.event.attributes[0]['type'] == 'AccountId':
+            add_balance_audit(
+                db_session, self.event, self.event.attributes[0]['value'], -int(self.event.attributes[1]['value'])
+            )
+
+
+class BalancesUnreservedEventProcessor(EventProcessor):
+
+    module_id = 'balances'
+    event_id = 'Unreserved'
+
+    def accumulation_hook(self, db_session):
+        if len(self.event.attributes) == 2 and self.event.attributes[0]['type'] == 'AccountId':
+            add_balance_audit(
+                db_session, self.event, self.event.attributes[0]['value'], int(self.event.attributes[1]['value'])
+            )
+
+
+class BalancesDepositEventProcessor(EventProcessor):
+
+    module_id = 'balances'
+    event_id = 'Deposit'
+
+    def accumulation_hook(self, db_session):
+        if len(self.event.attributes) == 2 and self.event.attributes[0]['type'] == 'AccountId':
+            add_balance_audit(
+                db_session, self.event, self.event.attributes[0]['value'], int(self.event.attributes[1]['value'])
+            )
+
+
 class NewAccountIndexEventProcessor(EventProcessor):
 
     module_id = 'indices'
@@ -487,29 +557,39 @@ class DemocracyStartedProcessor(EventProcessor):
     module_id = 'democracy'
     event_id = 'Started'
 
+    def check_requirements(self):
+        return len(self.event.attributes) == 2 and \
+            self.event.attributes[0]['type'] == 'ReferendumIndex' and \
+            self.event.attributes[1]['type'] == 'VoteThreshold'
+
+    def storage_requests(self, db_session):
+
+        if not self.check_requirements():
+            return []
+
+        # Retrieve proposal from storage
+        storage_call = RuntimeStorage.query(db_session).filter_by(
+            module_id='democracy',
+            name='ReferendumInfoOf',
+        ).order_by(RuntimeStorage.spec_version.desc()).first()
+
+        return [StorageRequest(
+            key='proposal',
+            block_hash=self.block.hash,
+            module='Democracy',
+            function='ReferendumInfoOf',
+            params=self.event.attributes[0]['valueRaw'],
+            return_scale_type=storage_call.type_value,
+            hasher=storage_call.type_hasher,
+            metadata=self.metadata
+        )]
+
     def accumulation_hook(self, db_session):
 
         # Check event requirements
-        if len(self.event.attributes) == 2 and \
-                self.event.attributes[0]['type'] == 'ReferendumIndex' and \
-                self.event.attributes[1]['type'] == 'VoteThreshold':
+        if self.check_requirements():
 
-            # Retrieve proposal from storage
-            substrate = SubstrateInterface(SUBSTRATE_RPC_URL)
-            storage_call = RuntimeStorage.query(db_session).filter_by(
-                module_id='democracy',
-                name='ReferendumInfoOf',
-            ).order_by(RuntimeStorage.spec_version.desc()).first()
-
-            proposal = substrate.get_storage(
-                block_hash=self.block.hash,
-                module='Democracy',
-                function='ReferendumInfoOf',
-                params=self.event.attributes[0]['valueRaw'],
-                return_scale_type=storage_call.type_value,
-                hasher=storage_call.type_hasher,
-                metadata=self.metadata
-            )
+            proposal = self.get_storage(db_session, 'proposal')
 
             referendum_audit = DemocracyReferendumAudit(
                 democracy_referendum_id=self.event.attributes[0]['value'],
@@ -24,9 +24,9 @@ import pytz
 
 from app.models.data import DemocracyVoteAudit, RuntimeStorage
 from app.processors.base import ExtrinsicProcessor
-from app.settings import DEMOCRACY_VOTE_AUDIT_TYPE_NORMAL, SUBSTRATE_RPC_URL
+from app.settings import DEMOCRACY_VOTE_AUDIT_TYPE_NORMAL
 from scalecodec import Conviction
-from substrateinterface import SubstrateInterface
+from app.utils.substrate import StorageRequest
 
 
 class TimestampExtrinsicProcessor(ExtrinsicProcessor):
@@ -38,6 +38,12 @@ class TimestampExtrinsicProcessor(ExtrinsicProcessor):
 
         if self.extrinsic.success:
             # Store block date time related fields
+            now = getattr(self.extrinsic, '_typed_params', {}).get('now')
+
+            if now:
+                self.block.set_datetime(now.replace(tzinfo=pytz.UTC))
+                return
+
             for param in self.extrinsic.params:
                 if param.get('name') == 'now':
                     self.block.set_datetime(dateutil.parser.parse(param.get('value')).replace(tzinfo=pytz.UTC))
@@ -48,6 +54,30 @@ class DemocracyVoteExtrinsicProcessor(ExtrinsicProcessor):
     module_id = 'democracy'
     call_id = 'vote'
 
+    def storage_requests(self, db_session):
+
+        if not self.extrinsic.success:
+            return []
+
+        # TODO refactor when new runtime aware substrateinterface
+        # TODO make substrateinterface part of processor over websockets
+
+        # Get balance of stash_account
+        storage_call = RuntimeStorage.query(db_session).filter_by(
+            module_id='balances',
+            name='FreeBalance',
+        ).order_by(RuntimeStorage.spec_version.desc()).first()
+
+        return [StorageRequest(
+            key='stash',
+            block_hash=self.block.hash,
+            module='Balances',
+            function='FreeBalance',
+            params=self.extrinsic.address,
+            return_scale_type=storage_call.type_value,
+            hasher=storage_call.type_hasher
+        )]
+
     def accumulation_hook(self, db_session):
 
         if self.extrinsic.success:
@@ -55,24 +85,7 @@ class DemocracyVoteExtrinsicProcessor(ExtrinsicProcessor):
             vote_account_id = self.extrinsic.address
             stash_account_id = self.extrinsic.address
 
-            # TODO refactor when new runtime aware substrateinterface
-            # TODO make substrateinterface part of processor over websockets
-
-            # Get balance of stash_account
-            substrate = SubstrateInterface(SUBSTRATE_RPC_URL)
-            storage_call = RuntimeStorage.query(db_session).filter_by(
-                module_id='balances',
-                name='FreeBalance',
-            ).order_by(RuntimeStorage.spec_version.desc()).first()
-
-            stash = substrate.get_storage(
-                block_hash=self.block.hash,
-                module='Balances',
-                function='FreeBalance',
-                params=stash_account_id,
-                return_scale_type=storage_call.type_value,
-                hasher=storage_call.type_hasher
-            )
+            stash = self.get_storage(db_session, 'stash')
 
             vote_audit = DemocracyVoteAudit(
                 block_id=self.extrinsic.block_id,
@@ -0,0 +1,244 @@
+#  Polkascan PRE Harvester
+#
+#  Copyright 2018-2019 openAware BV (NL).
+#  This file is part of Polkascan.
+#
+#  Polkascan is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Polkascan is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Polkascan. If not, see <http://www.gnu.org/licenses/>.
+#
+#  snapshot.py
+
+from scalecodec.base import ScaleBytes, ScaleDecoder
+from sqlalchemy.dialects.mysql import insert
+
+from app.models.data import Account, Block, RuntimeStorage, Extrinsic, Event
+from app.processors.base import BaseService
+from app.settings import SUBSTRATE_RPC_URLS, SUBSTRATE_ADDRESS_TYPE
+from app.type_registry import use_type_registry
+from app.utils.ss58 import ss58_encode
+from app.utils.storage import storage_prefix, storage_map_key, key_from_storage_key, CONCAT_HASHERS
+from app.utils.substrate import BalancedSubstrateInterface
+
+
+class AccountSnapshotService(BaseService):
+    """
+    Import the free balance of all accounts at a given block by enumerating the balances storage map page by page,
+    instead of one storage request per account
+    """
+
+    # Storage functions holding the free balance, in order of preference: (module_id, name, storage prefix)
+    balance_storage_functions = [
+        ('balances', 'FreeBalance', 'Balances'),
+        ('system', 'Account', 'System')
+    ]
+
+    def __init__(self, db_session, type_registry='default'):
+        self.db_session = db_session
+        self.substrate = BalancedSubstrateInterface(SUBSTRATE_RPC_URLS)
+        use_type_registry(type_registry)
+
+    def get_balance_storage(self, spec_version):
+        for module_id, name, module_prefix in self.balance_storage_functions:
+            storage_call = RuntimeStorage.lookup(self.db_session, spec_version, module_id, name)
+            if storage_call:
+                return storage_call, module_prefix
+
+        return None, None
+
+    @staticmethod
+    def decode_balance(storage_call, value):
+        balance = ScaleDecoder.get_decoder_class(storage_call.get_return_type(), ScaleBytes(value)).decode()
+
+        # Linked maps store a (value, linkage) tuple
+        if type(balance) in (list, tuple):
+            balance = balance[0]
+
+        # AccountInfo of the system module
+        if type(balance) is dict:
+            balance = balance.get('data', {}).get('free', 0)
+
+        return int(balance or 0)
+
+    def query_storage_at(self, storage_keys, block_hash):
+        """
+        Retrieve values of several storage keys at given block in one request
+        :param storage_keys:
+        :param block_hash:
+        :return: list of (storage key, value) tuples, value is None for empty keys
+        """
+        response = self.substrate.rpc_request('state_queryStorageAt', [storage_keys, block_hash])
+
+        values = {}
+        for change_set in response.get('result') or []:
+            for storage_key, value in change_set['changes']:
+                values[storage_key] = value
+
+        return [(storage_key, values.get(storage_key)) for storage_key in storage_keys]
+
+    def get_block_id(self, block_hash):
+        block = Block.query(self.db_session).filter_by(hash=block_hash).first()
+
+        if block:
+            return block.id
+
+        return self.substrate.get_block_number(block_hash)
+
+    def iter_balances(self, block_hash, page_size):
+        """
+        Balances of all accounts at given block, one page at a time. Keys of maps with a concat hasher are enumerated
+        with `state_getKeysPaged`. Other hashers don't reveal the account id in the storage key, in that case the
+        accounts already known in `data_account` are queried.
+        :param block_hash:
+        :param page_size:
+        :return: generator of lists of (account_id, balance) tuples
+        """
+        spec_version = self.substrate.get_block_runtime_version(block_hash).get('specVersion', 0)
+
+        storage_call, module_prefix = self.get_balance_storage(spec_version)
+
+        if not storage_call:
+            raise ValueError('No balance storage function found in runtime {}'.format(spec_version))
+
+        if storage_call.type_hasher in CONCAT_HASHERS:
+
+            prefix = storage_prefix(module_prefix, storage_call.name)
+            start_key = None
+
+            while True:
+                storage_keys = self.substrate.rpc_request(
+                    'state_getKeysPaged', [prefix, page_size, start_key, block_hash]
+                ).get('result')
+
+                if not storage_keys:
+                    break
+
+                yield [
+                    (key_from_storage_key(storage_call.type_hasher, storage_key),
+                     self.decode_balance(storage_call, value))
+                    for storage_key, value in self.query_storage_at(storage_keys, block_hash) if value
+                ]
+
+                if len(storage_keys) < page_size:
+                    break
+
+                start_key = storage_keys[-1]
+
+        else:
+
+            last_account_id = ''
+
+            while True:
+                account_ids = [account_id for account_id, in self.db_session.query(Account.id).filter(
+                    Account.id > last_account_id
+                ).order_by(Account.id).limit(page_size)]
+
+                if not account_ids:
+                    break
+
+                storage_keys = {
+                    storage_map_key(module_prefix, storage_call.name, storage_call.type_hasher, account_id): account_id
+                    for account_id in account_ids
+                }
+
+                yield [
+                    (storage_keys[storage_key], self.decode_balance(storage_call, value) if value else 0)
+                    for storage_key, value in self.query_storage_at(list(storage_keys.keys()), block_hash)
+                ]
+
+                last_account_id = account_ids[-1]
+
+    def get_balances(self, account_ids, block_hash, spec_version=None):
+        """
+        Balances of given accounts at given block, retrieved with one storage request
+        :param account_ids:
+        :param block_hash:
+        :param spec_version: runtime of the block, retrieved when not given
+        :return: list of (account_id, balance) tuples
+        """
+        if spec_version is None:
+            spec_version = self.substrate.get_block_runtime_version(block_hash).get('specVersion', 0)
+
+        storage_call, module_prefix = self.get_balance_storage(spec_version)
+
+        if not storage_call:
+            raise ValueError('No balance storage function found in runtime {}'.format(spec_version))
+
+        storage_keys = {
+            storage_map_key(module_prefix, storage_call.name, storage_call.type_hasher, account_id): account_id
+            for account_id in account_ids
+        }
+
+        return [
+            (storage_keys[storage_key], self.decode_balance(storage_call, value) if value else 0)
+            for storage_key, value in self.query_storage_at(list(storage_keys.keys()), block_hash)
+        ]
+
+    def get_touched_accounts(self, from_block_id, to_block_id):
+        """
+        Known accounts that signed an extrinsic or appear in an event in given range of blocks
+        :param from_block_id: first block, inclusive
+        :param to_block_id: last block, inclusive
+        :return: set of account ids
+        """
+        account_ids = set()
+
+        for address, in self.db_session.query(Extrinsic.address).filter(
+                Extrinsic.block_id >= from_block_id, Extrinsic.block_id <= to_block_id, Extrinsic.signed == 1
+        ):
+            if address:
+                account_ids.add(address.replace('0x', ''))
+
+        for attributes, in self.db_session.query(Event.attributes).filter(
+                Event.block_id >= from_block_id, Event.block_id <= to_block_id
+        ):
+            for attribute in attributes or []:
+                if attribute.get('type') == 'AccountId' and attribute.get('value'):
+                    account_ids.add(attribute['value'].replace('0x', ''))
+
+        # Only refresh accounts that are already known
+        known_account_ids = set()
+        account_ids = list(account_ids)
+
+        for offset in range(0, len(account_ids), 1000):
+            known_account_ids.update([account_id for account_id, in self.db_session.query(Account.id).filter(
+                Account.id.in_(account_ids[offset:offset + 1000])
+            )])
+
+        return known_account_ids
+
+    def store_balances(self, balances, block_id):
+        """
+        Insert new accounts and update the balance of existing accounts with one statement
+        :param balances: list of (account_id, balance) tuples
+        :param block_id: block the balances were retrieved at
+        """
+        if not balances:
+            return
+
+        statement = insert(Account.__table__).values([
+            {
+                'id': account_id,
+                'address': ss58_encode(account_id, SUBSTRATE_ADDRESS_TYPE),
+                'balance': balance,
+                'balance_at_block': block_id,
+                'created_at_block': block_id,
+                'updated_at_block': block_id
+            } for account_id, balance in balances
+        ])
+
+        statement = statement.on_duplicate_key_update(
+            balance=statement.inserted.balance,
+            balance_at_block=statement.inserted.balance_at_block
+        )
+
+        self.db_session.execute(statement)
@@ -29,10 +29,12 @@ from scalecodec.block import RawBabePreDigest
 
 from app.models.data import Block, BlockTotal, Account, Log
 from app.resources.base import BaseResource
-from app.processors.converters import PolkascanHarvesterService, BlockAlreadyAdded
-from substrateinterface import SubstrateInterface
-from app.tasks import start_harvester, sync_block_account_id
-from app.settings import SUBSTRATE_RPC_URL, TYPE_REGISTRY
+from app.processors.converters import PolkascanHarvesterService, BlockAlreadyAdded, SEQUENCING_STREAMS, \
+    is_independent_stream
+from app.utils.substrate import BalancedSubstrateInterface
+from app.tasks import start_harvester, sync_block_account_id, start_sequencer, start_stream, import_account_snapshot, \
+    stream_locks, get_worker_rpc_metrics
+from app.settings import SUBSTRATE_RPC_URLS, TYPE_REGISTRY
 
 
 class PolkascanSyncAccountId(BaseResource):
@@ -50,6 +52,22 @@ class PolkascanSyncAccountId(BaseResource):
         }
 
 
+class PolkascanAccountSnapshot(BaseResource):
+
+    def on_post(self, req, resp):
+
+        task = import_account_snapshot.delay(block_hash=(req.media or {}).get('block_hash'))
+
+        resp.status = falcon.HTTP_201
+
+        resp.media = {
+            'status': 'success',
+            'data': {
+                'task_id': task.id
+            }
+        }
+
+
 class PolkascanAccountBalance(BaseResource):
     ## POST raw
     def on_post(self, req, resp):
@@ -59,7 +77,7 @@ class PolkascanAccountBalance(BaseResource):
             account = Account.query(self.session).filter(Account.id == req.media.get('account_id')).first()
 
             if account:
-                substrate = SubstrateInterface(SUBSTRATE_RPC_URL)
+                substrate = BalancedSubstrateInterface(SUBSTRATE_RPC_URLS)
                 balance = substrate.get_storage(
                     block_hash=None,
                     module='Balances',
@@ -101,6 +119,10 @@ class PolkascanBacktrackingResource(BaseResource):
                     block = harvester.add_block(block_hash)
                 except BlockAlreadyAdded as e:
                     print('Skipping {}'.format(block_hash))
+                    block_hash = e.parent_hash
+                    if e.block_id == 0:
+                        break
+                    continue
                 block_hash = block.parent_hash
                 if block.id == 0:
                     break
@@ -178,6 +200,8 @@ class PolkascanStatusHarvesterResource(BaseResource):
 
             remaining_sets_result = Block.get_missing_block_ids(self.session)
 
+            harvester = PolkascanHarvesterService(self.session, type_registry=TYPE_REGISTRY)
+
             resp.status = falcon.HTTP_200
 
             resp.media = {
@@ -187,11 +211,71 @@ class PolkascanStatusHarvesterResource(BaseResource):
                     'block_process_queue': [
                         {'from': block_set['block_from'], 'to': block_set['block_to']}
                         for block_set in remaining_sets_result
-                    ]
+                    ],
+                    'sequencer': [
+                        {
+                            'stream': stream,
+                            'independent': is_independent_stream(stream),
+                            'block_id': block_id,
+                            'behind': last_known_block.id - block_id
+                        } for stream, block_id in harvester.get_sequencer_progress().items()
+                    ],
+                    'rpc': get_worker_rpc_metrics()
                 }
             }
 
 
+class SequencerStreamRestartResource(BaseResource):
+
+    def on_post(self, req, resp, stream):
+
+        if stream not in SEQUENCING_STREAMS:
+            resp.status = falcon.HTTP_404
+            resp.media = {'errors': ['Unknown sequencing stream']}
+            return
+
+        if is_independent_stream(stream):
+            start_stream(stream)
+        else:
+            start_sequencer.delay()
+
+        resp.status = falcon.HTTP_201
+        resp.media = {'status': 'success', 'data': {'stream': stream}}
+
+
+class SequencerStreamRebuildResource(BaseResource):
+
+    def on_post(self, req, resp, stream):
+
+        if stream not in SEQUENCING_STREAMS:
+            resp.status = falcon.HTTP_404
+            resp.media = {'errors': ['Unknown sequencing stream']}
+            return
+
+        if not is_independent_stream(stream):
+            resp.status = falcon.HTTP_BAD_REQUEST
+            resp.media = {'errors': ['Only independently sequenced streams can be rebuilt']}
+            return
+
+        # Not while a sequencer task of the stream is running, it would write on top of the removed state
+        with stream_locks(self.session.get_bind(), stream) as acquired:
+
+            if not acquired:
+                resp.status = falcon.HTTP_CONFLICT
+                resp.media = {'errors': ['Stream is being sequenced, try again later']}
+                return
+
+            harvester = PolkascanHarvesterService(self.session, type_registry=TYPE_REGISTRY)
+            harvester.rebuild_stream(stream)
+
+            self.session.commit()
+
+        start_stream(stream)
+
+        resp.status = falcon.HTTP_201
+        resp.media = {'status': 'success', 'data': {'stream': stream}}
+
+
 class PolkascanProcessBlockResource(BaseResource):
 
     def on_post(self, req, resp):
@@ -199,7 +283,7 @@ class PolkascanProcessBlockResource(BaseResource):
         block_hash = None
 
         if req.media.get('block_id'):
-            substrate = SubstrateInterface(SUBSTRATE_RPC_URL)
+            substrate = BalancedSubstrateInterface(SUBSTRATE_RPC_URLS)
             block_hash = substrate.get_block_hash(req.media.get('block_id'))
         elif req.media.get('block_hash'):
             block_hash = req.media.get('block_hash')
@@ -225,6 +309,10 @@ class PolkascanProcessBlockResource(BaseResource):
                         block = harvester.add_block(block_hash)
                     except BlockAlreadyAdded as e:
                         print('Skipping {}'.format(block_hash))
+                        block_hash = e.parent_hash
+                        if e.block_id == 0:
+                            break
+                        continue
                     block_hash = block.parent_hash
                     if block.id == 0:
                         break
@@ -232,7 +320,7 @@ class PolkascanProcessBlockResource(BaseResource):
                 self.session.commit()
 
                 resp.status = falcon.HTTP_201
-                resp.media = {'result': 'added', 'parentHash': block.parent_hash}
+                resp.media = {'result': 'added', 'parentHash': block_hash}
 
         else:
             resp.status = falcon.HTTP_404
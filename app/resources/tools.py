@@ -26,8 +26,8 @@ from scalecodec.base import ScaleBytes
 from scalecodec.metadata import MetadataDecoder
 from scalecodec.block import EventsDecoder, ExtrinsicsDecoder, ExtrinsicsBlock61181Decoder
 
-from substrateinterface import SubstrateInterface
-from app.settings import SUBSTRATE_RPC_URL
+from app.utils.substrate import BalancedSubstrateInterface
+from app.settings import SUBSTRATE_RPC_URLS
 
 
 class ExtractMetadataResource(BaseResource):
@@ -35,7 +35,7 @@ class ExtractMetadataResource(BaseResource):
     def on_get(self, req, resp):
 
         if 'block_hash' in req.params:
-            substrate = SubstrateInterface(SUBSTRATE_RPC_URL)
+            substrate = BalancedSubstrateInterface(SUBSTRATE_RPC_URLS)
             metadata = substrate.get_block_metadata(req.params.get('block_hash'))
 
             resp.status = falcon.HTTP_200
@@ -54,7 +54,7 @@ class ExtractExtrinsicsResource(BaseResource):
 
     def on_get(self, req, resp):
 
-        substrate = SubstrateInterface(SUBSTRATE_RPC_URL)
+        substrate = BalancedSubstrateInterface(SUBSTRATE_RPC_URLS)
 
         # Get extrinsics
         json_block = substrate.get_chain_block(req.params.get('block_hash'))
@@ -86,7 +86,7 @@ class ExtractEventsResource(BaseResource):
 
     def on_get(self, req, resp):
 
-        substrate = SubstrateInterface(SUBSTRATE_RPC_URL)
+        substrate = BalancedSubstrateInterface(SUBSTRATE_RPC_URLS)
 
         # Get Parent hash
         json_block = substrate.get_block_header(req.params.get('block_hash'))
@@ -110,7 +110,7 @@ class StorageValidatorResource(BaseResource):
 
     def on_get(self, req, resp):
 
-        substrate = SubstrateInterface(SUBSTRATE_RPC_URL)
+        substrate = BalancedSubstrateInterface(SUBSTRATE_RPC_URLS)
 
         resp.status = falcon.HTTP_200
 
@@ -33,6 +33,26 @@ DB_CONNECTION = os.environ.get("DB_CONNECTION", "mysql+mysqlconnector://{}:{}@{}
 SUBSTRATE_RPC_URL = os.environ.get("SUBSTRATE_RPC_URL", "http://substrate-node:9933/")
 SUBSTRATE_ADDRESS_TYPE = int(os.environ.get("SUBSTRATE_ADDRESS_TYPE", 42))
 
+# Comma separated list of RPC endpoints, requests are routed to the healthiest, lowest latency node
+SUBSTRATE_RPC_URLS = [
+    url.strip() for url in os.environ.get("SUBSTRATE_RPC_URLS", SUBSTRATE_RPC_URL).split(',') if url.strip()
+]
+SUBSTRATE_RPC_TIMEOUT = float(os.environ.get("SUBSTRATE_RPC_TIMEOUT", 30))
+# Seconds to wait before an idempotent by-hash request is also sent to a second node, 0 to disable
+SUBSTRATE_RPC_HEDGE_DELAY = float(os.environ.get("SUBSTRATE_RPC_HEDGE_DELAY", 0.5))
+# Consecutive failures before a node is taken out of rotation, and seconds before it is tried again
+SUBSTRATE_RPC_CIRCUIT_FAILURES = int(os.environ.get("SUBSTRATE_RPC_CIRCUIT_FAILURES", 3))
+SUBSTRATE_RPC_CIRCUIT_COOLDOWN = float(os.environ.get("SUBSTRATE_RPC_CIRCUIT_COOLDOWN", 30))
+
+# Adaptive (AIMD) limit of concurrent RPC requests per worker process, limits are not shared between workers
+SUBSTRATE_RPC_CONCURRENCY = int(os.environ.get("SUBSTRATE_RPC_CONCURRENCY", 8))
+SUBSTRATE_RPC_CONCURRENCY_MIN = int(os.environ.get("SUBSTRATE_RPC_CONCURRENCY_MIN", 1))
+SUBSTRATE_RPC_CONCURRENCY_MAX = int(os.environ.get("SUBSTRATE_RPC_CONCURRENCY_MAX", 64))
+# Seconds of latency above which a response is treated as a sign of node overload
+SUBSTRATE_RPC_LATENCY_TARGET = float(os.environ.get("SUBSTRATE_RPC_LATENCY_TARGET", 2))
+# Share of the concurrency limit of a worker process reserved for the head follower
+SUBSTRATE_RPC_HEAD_RESERVE = float(os.environ.get("SUBSTRATE_RPC_HEAD_RESERVE", 0.25))
+
 # Simulate Scale encoded extrinsics per block for e.g. performance tests
 # Example:
 # SUBSTRATE_MOCK_EXTRINSICS = ["0xa50383ff76729e17ad31469debcb60f3ce3622f79143e442e77b58d6e2195d9ea998680d283c1715298aada424241284e4c3d2bec57a8b89e1bfa5502c0f84866cb94f64b666c04ceb88b7274612fea6bcdf7683701b96c13264d5326ecdcd5661df5502d500080008000f69590e7c83f3b71826537aff19ce9d173efeb887cca69c02b991f6ca75a8f43e05e5ef718a29d168e8df39367398cc60b9b45c7815fb2bfa362693a281676e1c7e66ad780b39e767f22efe0065929db7c69cef006d69a0ea8739c22fa1a06cf257d1cc14c340bdf2944ba8615b2a32cdc5774c9f93af6ef7eb3eab07caf94f00"] * 5000
@@ -40,8 +60,81 @@ SUBSTRATE_MOCK_EXTRINSICS = os.environ.get("SUBSTRATE_MOCK_EXTRINSICS", None)
 
 TYPE_REGISTRY = os.environ.get("TYPE_REGISTRY", "default")
 
+# Memory budget in MB for decoded runtime metadata kept per worker process
+METADATA_STORE_MAX_SIZE = int(os.environ.get("METADATA_STORE_MAX_SIZE", 1024))
+# Directory with pickled decoded metadata to speed up (re)starting workers, disabled when empty. Its files are
+# unpickled, so it must be a trusted directory that only the harvester can write to
+METADATA_CACHE_DIR = os.environ.get("METADATA_CACHE_DIR", None)
+# Number of most recent runtimes loaded when a worker process starts
+WORKER_WARM_START_RUNTIMES = int(os.environ.get("WORKER_WARM_START_RUNTIMES", 2))
+# Number of runtimes of which the storage functions are kept per worker process
+RUNTIME_STORAGE_CACHE_RUNTIMES = int(os.environ.get("RUNTIME_STORAGE_CACHE_RUNTIMES", 8))
+
+# Number of accumulate queues blocks are routed to by spec version, 0 to use the default queue only. Every queue
+# `accumulate-0` up to `accumulate-<N-1>` must be consumed by a worker, e.g. `-Q celery,accumulate-0`, so each worker
+# keeps the metadata of its own runtimes in memory. The head follower always uses the default queue.
+CELERY_SPEC_VERSION_QUEUES = int(os.environ.get("CELERY_SPEC_VERSION_QUEUES", 0))
+
 DEBUG = bool(os.environ.get("DEBUG", False))
 
+# Sequence each processor family (accounts, indices, democracy, sessions) as an independent stream with its own
+# watermark, instead of in lockstep with the block totals
+SEQUENCER_STREAMS = bool(os.environ.get("SEQUENCER_STREAMS", False))
+# Maximum number of blocks processed by one stream sequencer task
+SEQUENCER_STREAM_BATCH = int(os.environ.get("SEQUENCER_STREAM_BATCH", 100))
+
+# Number of shards (by account id) in which account and index state is sequenced in parallel, independent of the
+# strictly ordered block totals. 0 sequences account and index state together with the block totals.
+# Changing the number of shards requires resetting the `accounts` and `indices` checkpoints.
+SEQUENCER_ACCOUNT_SHARDS = int(os.environ.get("SEQUENCER_ACCOUNT_SHARDS", 0))
+# Maximum number of blocks processed by one shard sequencer task
+SEQUENCER_SHARD_BATCH = int(os.environ.get("SEQUENCER_SHARD_BATCH", 1000))
+
+# Maximum number of Account, AccountIndex and Democracy entities cached during a sequencing run
+SEQUENCER_ENTITY_CACHE_SIZE = int(os.environ.get("SEQUENCER_ENTITY_CACHE_SIZE", 10000))
+# Number of blocks sequenced by a stream before changed entities are written and committed
+SEQUENCER_FLUSH_BLOCKS = int(os.environ.get("SEQUENCER_FLUSH_BLOCKS", 10))
+
+# Number of accounts of which the derived balance is compared with the chain state per reconciliation run, and the
+# interval in seconds between runs. 0 disables reconciliation. Drift is recorded as an account audit, and only
+# corrected with the balance in the chain state when BALANCE_RECONCILE_CORRECT is set. The derived balance excludes
+# transaction fees other than the fee of Transfer events, as other fees are withdrawn without an event.
+BALANCE_RECONCILE_SAMPLE = int(os.environ.get("BALANCE_RECONCILE_SAMPLE", 20))
+BALANCE_RECONCILE_INTERVAL = float(os.environ.get("BALANCE_RECONCILE_INTERVAL", 600))
+BALANCE_RECONCILE_CORRECT = bool(os.environ.get("BALANCE_RECONCILE_CORRECT", False))
+
+# Number of storage keys per request when importing an account balance snapshot or the genesis balances
+ACCOUNT_SNAPSHOT_PAGE_SIZE = int(os.environ.get("ACCOUNT_SNAPSHOT_PAGE_SIZE", 1000))
+
+# Interval in seconds between refreshes of the balances of accounts touched since the last refresh, 0 to disable,
+# and maximum number of blocks covered by one refresh
+BALANCE_REFRESH_INTERVAL = float(os.environ.get("BALANCE_REFRESH_INTERVAL", 60))
+BALANCE_REFRESH_BLOCKS = int(os.environ.get("BALANCE_REFRESH_BLOCKS", 1000))
+
+# Interval in seconds between updates of the hourly and daily block aggregates, 0 to disable, and maximum number of
+# blocks covered by one update
+AGGREGATION_INTERVAL = float(os.environ.get("AGGREGATION_INTERVAL", 60))
+AGGREGATION_BLOCKS = int(os.environ.get("AGGREGATION_BLOCKS", 10000))
+
+# Number of sessions of which the validators are kept in memory to attribute block authors
+SESSION_VALIDATOR_CACHE_SIZE = int(os.environ.get("SESSION_VALIDATOR_CACHE_SIZE", 16))
+
+# Number of concurrent storage requests when processing the genesis accounts
+GENESIS_RPC_WORKERS = int(os.environ.get("GENESIS_RPC_WORKERS", 8))
+
+# Number of blocks per task and per transaction when setting the missing authority index of blocks
+SYNC_ACCOUNT_INDEX_RANGE = int(os.environ.get("SYNC_ACCOUNT_INDEX_RANGE", 100000))
+SYNC_ACCOUNT_INDEX_CHUNK = int(os.environ.get("SYNC_ACCOUNT_INDEX_CHUNK", 1000))
+
+# Number of SS58 addresses kept in memory by the address encoder and decoder
+SS58_CACHE_SIZE = int(os.environ.get("SS58_CACHE_SIZE", 100000))
+
+# Number of decoded extrinsics kept per worker process, so identical payloads are only decoded once, 0 to disable
+EXTRINSIC_DECODE_CACHE_SIZE = int(os.environ.get("EXTRINSIC_DECODE_CACHE_SIZE", 10000))
+
+# Number of concurrent storage requests of processors, prefetched per block before the processors run
+STORAGE_PREFETCH_WORKERS = int(os.environ.get("STORAGE_PREFETCH_WORKERS", 16))
+
 # Version compatibility switches
 
 LEGACY_SESSION_VALIDATOR_LOOKUP = bool(os.environ.get("LEGACY_SESSION_VALIDATOR_LOOKUP", False))
@@ -51,6 +144,8 @@ LEGACY_SESSION_VALIDATOR_LOOKUP = bool(os.environ.get("LEGACY_SESSION_VALIDATOR_
 
 ACCOUNT_AUDIT_TYPE_NEW = 1
 ACCOUNT_AUDIT_TYPE_REAPED = 2
+ACCOUNT_AUDIT_TYPE_BALANCE = 3
+ACCOUNT_AUDIT_TYPE_BALANCE_DRIFT = 4
 
 ACCOUNT_INDEX_AUDIT_TYPE_NEW = 1
 ACCOUNT_INDEX_AUDIT_TYPE_REAPED = 2
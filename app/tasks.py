@@ -19,22 +19,34 @@
 #  tasks.py
 
 import os
-from time import sleep
+import threading
+from bisect import bisect
+from contextlib import contextmanager, ExitStack
+from hashlib import blake2b
+from time import sleep, time
 
 import celery
-from scalecodec import ScaleBytes
-from scalecodec.block import RawBabePreDigest
+from celery.signals import worker_process_init
+from celery.worker.control import inspect_command
 
 from sqlalchemy import create_engine, text
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.sql import func
 
-from app.models.data import Extrinsic, Block, BlockTotal, Log
-from app.processors.converters import PolkascanHarvesterService, HarvesterCouldNotAddBlock, BlockAlreadyAdded
-from substrateinterface import SubstrateInterface
+from app.models.data import Extrinsic, Block, BlockTotal, Runtime, RuntimeStorage
+from app.models.harvester import SequencerCheckpoint
+from app.processors.converters import PolkascanHarvesterService, HarvesterCouldNotAddBlock, BlockAlreadyAdded, \
+    SEQUENCING_STREAMS, SHARDED_STREAMS, is_independent_stream, extrinsic_decode_cache, metadata_store
+from app.processors.snapshot import AccountSnapshotService
+from app.utils.substrate import BalancedSubstrateInterface, rpc_priority, rpc_metrics, RPC_PRIORITY_HEAD, \
+    RPC_PRIORITY_DEFAULT
 
-from app.settings import DB_CONNECTION, DEBUG, SUBSTRATE_RPC_URL, TYPE_REGISTRY
+from app.settings import DB_CONNECTION, DEBUG, SUBSTRATE_RPC_URLS, TYPE_REGISTRY, CELERY_SPEC_VERSION_QUEUES, \
+    WORKER_WARM_START_RUNTIMES, SEQUENCER_ACCOUNT_SHARDS, SEQUENCER_STREAM_BATCH, \
+    SEQUENCER_FLUSH_BLOCKS, BALANCE_RECONCILE_SAMPLE, BALANCE_RECONCILE_INTERVAL, \
+    ACCOUNT_SNAPSHOT_PAGE_SIZE, BALANCE_REFRESH_INTERVAL, BALANCE_REFRESH_BLOCKS, AGGREGATION_INTERVAL, \
+    AGGREGATION_BLOCKS, SYNC_ACCOUNT_INDEX_RANGE, SYNC_ACCOUNT_INDEX_CHUNK
 
 CELERY_BROKER = os.environ.get('CELERY_BROKER')
 CELERY_BACKEND = os.environ.get('CELERY_BACKEND')
@@ -49,94 +61,239 @@ app.conf.beat_schedule = {
     },
 }
 
+if BALANCE_RECONCILE_SAMPLE:
+    app.conf.beat_schedule['reconcile-balances'] = {
+        'task': 'app.tasks.reconcile_balances',
+        'schedule': BALANCE_RECONCILE_INTERVAL,
+        'args': ()
+    }
+
+if BALANCE_REFRESH_INTERVAL:
+    app.conf.beat_schedule['refresh-account-balances'] = {
+        'task': 'app.tasks.refresh_account_balances',
+        'schedule': BALANCE_REFRESH_INTERVAL,
+        'args': ()
+    }
+
+if AGGREGATION_INTERVAL:
+    app.conf.beat_schedule['aggregate-blocks'] = {
+        'task': 'app.tasks.aggregate_blocks',
+        'schedule': AGGREGATION_INTERVAL,
+        'args': ()
+    }
+
 app.conf.timezone = 'UTC'
 
 
+@inspect_command()
+def rpc_worker_metrics(state):
+    """RPC concurrency limiter and node metrics of this worker"""
+    return rpc_metrics()
+
+
+def get_worker_rpc_metrics(timeout=1):
+    """
+    RPC metrics by worker, as the limiter and node statistics are kept per worker process. Workers on the prefork
+    pool answer from their main process, which sends no requests, so only gevent workers report useful metrics.
+    """
+    replies = app.control.broadcast('rpc_worker_metrics', reply=True, timeout=timeout)
+    return {hostname: metrics for reply in replies for hostname, metrics in reply.items()}
+
+
+class SpecVersionQueueRing(object):
+    """
+    Consistent hash ring of accumulate queues, so blocks of the same runtime are processed by the same workers and
+    adding a queue only moves a small part of the spec versions
+    """
+
+    replicas = 64
+
+    def __init__(self, count_queues):
+        self.ring = sorted([
+            (self.hash('accumulate-{}-{}'.format(queue_nr, replica)), 'accumulate-{}'.format(queue_nr))
+            for queue_nr in range(0, count_queues) for replica in range(0, self.replicas)
+        ])
+        self.keys = [key for key, queue in self.ring]
+
+    @staticmethod
+    def hash(value):
+        return int.from_bytes(blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+    def get_queue(self, spec_version):
+        if not self.ring or spec_version is None:
+            return None
+
+        return self.ring[bisect(self.keys, self.hash(str(spec_version))) % len(self.ring)][1]
+
+
+spec_version_queues = SpecVersionQueueRing(CELERY_SPEC_VERSION_QUEUES)
+
+
+def get_spec_version_at(spec_version_boundaries, block_id):
+    # Runtime of the latest known upgrade boundary at or before given block
+    spec_version = None
+    for boundary in spec_version_boundaries:
+        if boundary.block_from <= block_id:
+            spec_version = boundary.spec_version_id
+    return spec_version
+
+
+def accumulate_block_async(block_hash, end_block_hash=None, spec_version=None, head_follower=False, **kwargs):
+    return accumulate_block_recursive.apply_async(
+        args=(block_hash, end_block_hash),
+        kwargs=dict(kwargs, spec_version=spec_version, head_follower=head_follower),
+        # The head follower stays on the default queue, so it never waits behind the backlog of a runtime
+        queue=None if head_follower else spec_version_queues.get_queue(spec_version)
+    )
+
+
+# Durations in seconds of the startup phases of this worker process
+warm_start_timings = {}
+
+
+@worker_process_init.connect
+def warm_start_worker(**kwargs):
+    """
+    Load the type registry, decoded metadata and storage lookups of the most recent runtimes before the worker
+    process starts consuming tasks, so the first tasks after a (re)start don't pay for it
+    """
+    if not WORKER_WARM_START_RUNTIMES:
+        return
+
+    start = time()
+
+    engine = create_engine(DB_CONNECTION, echo=DEBUG, isolation_level="READ_UNCOMMITTED")
+    session = sessionmaker(bind=engine, autoflush=False, autocommit=False)()
+
+    try:
+        harvester = PolkascanHarvesterService(session, type_registry=TYPE_REGISTRY)
+        warm_start_timings['type_registry'] = time() - start
+
+        runtimes = Runtime.query(session).order_by(Runtime.spec_version.desc()).limit(WORKER_WARM_START_RUNTIMES)
+
+        for runtime in runtimes:
+            phase_start = time()
+            metadata_store[runtime.spec_version] = harvester.decode_runtime_metadata(runtime)
+            warm_start_timings['metadata_{}'.format(runtime.spec_version)] = time() - phase_start
+
+            phase_start = time()
+            RuntimeStorage.preload(session, runtime.spec_version)
+            warm_start_timings['storage_{}'.format(runtime.spec_version)] = time() - phase_start
+
+    except SQLAlchemyError as e:
+        print('Init: warm start failed', e)
+    finally:
+        session.close()
+        engine.dispose()
+
+    warm_start_timings['total'] = time() - start
+
+    print('Init: warm start completed', warm_start_timings)
+
+
 class BaseTask(celery.Task):
+    """
+    Task with its own database engine and session per call. A task instance is shared by all threads (or greenlets)
+    of a worker, so the engine and session of the running call are kept in thread-local storage.
+    """
 
     def __init__(self):
-        self.metadata_store = {}
+        self.metadata_store = metadata_store
+        self.call_context = threading.local()
+
+    @property
+    def engine(self):
+        return self.call_context.engine
+
+    @property
+    def session(self):
+        return self.call_context.session
 
     def __call__(self, *args, **kwargs):
-        self.engine = create_engine(DB_CONNECTION, echo=DEBUG, isolation_level="READ_UNCOMMITTED")
+        self.call_context.engine = create_engine(DB_CONNECTION, echo=DEBUG, isolation_level="READ_UNCOMMITTED")
         session_factory = sessionmaker(bind=self.engine, autoflush=False, autocommit=False)
-        self.session = scoped_session(session_factory)
+        self.call_context.session = scoped_session(session_factory)
 
         return super().__call__(*args, **kwargs)
 
     def after_return(self, status, retval, task_id, args, kwargs, einfo):
-        if hasattr(self, 'session'):
+        if hasattr(self.call_context, 'session'):
             self.session.remove()
-        if hasattr(self, 'engine'):
+            del self.call_context.session
+        if hasattr(self.call_context, 'engine'):
             self.engine.engine.dispose()
+            del self.call_context.engine
 
 
 @app.task(base=BaseTask, bind=True)
-def accumulate_block_recursive(self, block_hash, end_block_hash=None):
+def accumulate_block_recursive(self, block_hash, end_block_hash=None, head_follower=False, spec_version=None):
 
-    harvester = PolkascanHarvesterService(self.session, type_registry=TYPE_REGISTRY)
-    harvester.metadata_store = self.metadata_store
+    # Only the task started at the chain head gets the RPC capacity reserved for the head follower
+    with rpc_priority(RPC_PRIORITY_HEAD if head_follower else RPC_PRIORITY_DEFAULT):
+        harvester = PolkascanHarvesterService(self.session, type_registry=TYPE_REGISTRY)
 
-    # If metadata store isn't initialized yet, perform some tests
-    if not harvester.metadata_store:
-        print('Init: create entrypoints')
-        # Check if blocks exists
-        max_block_id = self.session.query(func.max(Block.id)).one()[0]
+        # First run, when no blocks are harvested yet: the head follower creates the entry points. Not tied to an
+        # empty metadata store, which a warm start fills before any task runs
+        if head_follower and self.session.query(func.max(Block.id)).scalar() is None:
+            print('Init: create entrypoints')
 
-        if not max_block_id:
             # Speed up accumulating by creating several entry points
-            substrate = SubstrateInterface(SUBSTRATE_RPC_URL)
+            substrate = BalancedSubstrateInterface(SUBSTRATE_RPC_URLS)
             block_nr = substrate.get_block_number(block_hash)
             if block_nr > 100:
                 for entry_point in range(0, block_nr, block_nr // 4)[1:-1]:
                     entry_point_hash = substrate.get_block_hash(entry_point)
-                    accumulate_block_recursive.delay(entry_point_hash)
-
-    block = None
-    max_sequenced_block_id = False
+                    accumulate_block_async(entry_point_hash)
 
-    add_count = 0
+        block = None
+        max_sequenced_block_id = False
+        already_added = False
 
-    try:
+        add_count = 0
 
-        for nr in range(0, 10):
-            if not block or block.id > 0:
-                # Process block
-                block = harvester.add_block(block_hash)
+        try:
 
-                print('+ Added {} '.format(block_hash))
+            for nr in range(0, 10):
+                if not block or block.id > 0:
+                    # Process block
+                    block = harvester.add_block(block_hash)
 
-                add_count += 1
+                    print('+ Added {} '.format(block_hash))
 
-                self.session.commit()
+                    add_count += 1
 
-                # Break loop if targeted end block hash is reached
-                if block_hash == end_block_hash or block.id == 0:
-                    break
+                    self.session.commit()
 
-                # Continue with parent block hash
-                block_hash = block.parent_hash
+                    # Break loop if targeted end block hash is reached
+                    if block_hash == end_block_hash or block.id == 0:
+                        break
 
-        # Update persistent metadata store in Celery task
-        self.metadata_store = harvester.metadata_store
+                    # Continue with parent block hash
+                    block_hash = block.parent_hash
 
-        if block_hash != end_block_hash and block and block.id > 0:
-            accumulate_block_recursive.delay(block.parent_hash, end_block_hash)
+            if block_hash != end_block_hash and block and block.id > 0:
+                # Parent block is most likely of the same runtime
+                accumulate_block_async(block.parent_hash, end_block_hash, spec_version=block.spec_version_id)
 
-    except BlockAlreadyAdded as e:
-        print('. Skipped {} '.format(block_hash))
-        start_sequencer.delay()
-    except IntegrityError as e:
-        print('. Skipped duplicate {} '.format(block_hash))
-    except Exception as exc:
-        print('! ERROR adding {}'.format(block_hash))
-        raise HarvesterCouldNotAddBlock(block_hash) from exc
+        except BlockAlreadyAdded as e:
+            print('. Skipped {} '.format(block_hash))
+            already_added = True
+            start_sequencer.delay()
+        except IntegrityError as e:
+            print('. Skipped duplicate {} '.format(block_hash))
+        except Exception as exc:
+            print('! ERROR adding {}'.format(block_hash))
+            raise HarvesterCouldNotAddBlock(block_hash) from exc
 
-    return {
-        'result': '{} blocks added'.format(add_count),
-        'lastAddedBlockHash': block_hash,
-        'sequencerStartedFrom': max_sequenced_block_id
-    }
+        return {
+            'result': '{} blocks added'.format(add_count),
+            'lastAddedBlockHash': block_hash,
+            'blockAlreadyAdded': already_added,
+            'sequencerStartedFrom': max_sequenced_block_id,
+            'rpc': rpc_metrics(),
+            'metadataStore': self.metadata_store.stats(),
+            'extrinsicDecodeCache': extrinsic_decode_cache.stats()
+        }
 
 
 @app.task(base=BaseTask, bind=True)
@@ -155,18 +312,263 @@ def start_sequencer(self):
     else:
         sequence_block_recursive.delay(parent_block_data=None)
 
+    for stream in SEQUENCING_STREAMS:
+        if is_independent_stream(stream):
+            start_stream(stream)
+
+
+def start_stream(stream):
+    if SEQUENCER_ACCOUNT_SHARDS and stream in SHARDED_STREAMS:
+        for shard in range(0, SEQUENCER_ACCOUNT_SHARDS):
+            sequence_account_shard.delay(stream, shard)
+    else:
+        sequence_stream.delay(stream)
+
+
+# Last block sequenced by this process per stream, a checkpoint before it means the stream was rebuilt meanwhile
+sequenced_stream_block_ids = {}
+
+
+@app.task(base=BaseTask, bind=True)
+def sequence_stream(self, stream):
+
+    with named_lock(self.engine, 'sequencer-{}'.format(stream)) as acquired:
+
+        if not acquired:
+            return {'result': 'Stream {} already being sequenced'.format(stream)}
+
+        harvester = PolkascanHarvesterService(self.session, type_registry=TYPE_REGISTRY)
+
+        start_block_id = SequencerCheckpoint.get(self.session, stream).block_id
+        end_block_id = start_block_id
+
+        if start_block_id < sequenced_stream_block_ids.get(stream, start_block_id):
+            harvester.clear_stream_caches(stream)
+
+        # Other streams never pass the totals stream, which guarantees all blocks up to there are present
+        max_sequenced_block_id = self.session.query(func.max(BlockTotal.id)).scalar()
+
+        if max_sequenced_block_id is not None:
+            blocks = Block.query(self.session).filter(
+                Block.id > start_block_id,
+                Block.id <= min(max_sequenced_block_id, start_block_id + SEQUENCER_STREAM_BATCH)
+            ).order_by(Block.id)
+
+            try:
+                for nr, block in enumerate(blocks):
+                    harvester.sequence_stream_block(stream, block)
+                    end_block_id = block.id
+
+                    # Changed entities are written in bulk on commit
+                    if (nr + 1) % SEQUENCER_FLUSH_BLOCKS == 0:
+                        self.session.commit()
+
+                self.session.commit()
+            except Exception:
+                self.session.rollback()
+                raise
+
+        sequenced_stream_block_ids[stream] = end_block_id
+
+    if end_block_id > start_block_id:
+        # Continue with next batch, until the stream has caught up with the totals stream
+        sequence_stream.delay(stream)
+
+    return {'result': 'Stream {} sequenced from {} to {}'.format(stream, start_block_id, end_block_id)}
+
+
+@contextmanager
+def named_lock(engine, name):
+    """
+    Non-blocking MySQL named lock held on a dedicated connection, so it outlives the commit of the task session.
+    Yields whether the lock was acquired.
+    """
+    connection = engine.connect()
+    try:
+        acquired = connection.execute(text('SELECT GET_LOCK(:name, 0)'), name=name).scalar() == 1
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                connection.execute(text('SELECT RELEASE_LOCK(:name)'), name=name)
+    finally:
+        connection.close()
+
+
+@contextmanager
+def stream_locks(engine, stream):
+    """
+    Named locks of all sequencer tasks of given stream, held while the stream is changed outside of them.
+    Yields whether all locks were acquired.
+    """
+    if SEQUENCER_ACCOUNT_SHARDS and stream in SHARDED_STREAMS:
+        names = ['sequencer-{}-{}'.format(stream, shard) for shard in range(0, SEQUENCER_ACCOUNT_SHARDS)]
+    else:
+        names = ['sequencer-{}'.format(stream)]
+
+    with ExitStack() as stack:
+        yield all(stack.enter_context(named_lock(engine, name)) for name in names)
+
+
+@app.task(base=BaseTask, bind=True)
+def sequence_account_shard(self, stream, shard):
+
+    with named_lock(self.engine, 'sequencer-{}-{}'.format(stream, shard)) as acquired:
+
+        if not acquired:
+            return {'result': 'Shard {} of {} already being sequenced'.format(shard, stream)}
+
+        harvester = PolkascanHarvesterService(self.session, type_registry=TYPE_REGISTRY)
+
+        try:
+            start_block_id = SequencerCheckpoint.get(self.session, stream, shard).block_id
+            checkpoint = harvester.sequence_account_shard(stream, shard)
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+
+    if checkpoint.block_id > start_block_id:
+        # Continue with next batch, until the shard has caught up with the block totals sequencer
+        sequence_account_shard.delay(stream, shard)
+
+    return {
+        'result': 'Shard {} of {} sequenced from {} to {}'.format(shard, stream, start_block_id, checkpoint.block_id)
+    }
+
+
+@app.task(base=BaseTask, bind=True)
+def reconcile_balances(self, sample_size=BALANCE_RECONCILE_SAMPLE):
+
+    harvester = PolkascanHarvesterService(self.session, type_registry=TYPE_REGISTRY)
+
+    result = harvester.reconcile_balances(sample_size)
+
+    for account in result['drift']:
+        print('! Balance drift of {} at block {}: {} derived, {} on chain{}'.format(
+            account['account_id'], result['block_id'], account['balance'], account['chain_balance'],
+            ', corrected' if result['corrected'] else ''
+        ))
+
+    self.session.commit()
+
+    return result
+
+
+@app.task(base=BaseTask, bind=True)
+def import_account_snapshot(self, block_hash=None):
+
+    snapshot = AccountSnapshotService(self.session, type_registry=TYPE_REGISTRY)
+
+    if not block_hash:
+        # Balance changes after the snapshot block are applied by the accounts stream, so default to the last block
+        # it has sequenced
+        harvester = PolkascanHarvesterService(self.session, type_registry=TYPE_REGISTRY)
+        block = Block.query(self.session).get(harvester.get_sequencer_progress()['accounts'])
+
+        if not block:
+            return {'result': 'No sequenced blocks'}
+
+        block_hash = block.hash
+
+    block_id = snapshot.get_block_id(block_hash)
+    count_accounts = 0
+
+    for balances in snapshot.iter_balances(block_hash, ACCOUNT_SNAPSHOT_PAGE_SIZE):
+        snapshot.store_balances(balances, block_id)
+        self.session.commit()
+
+        count_accounts += len(balances)
+
+    return {'result': '{} accounts imported'.format(count_accounts), 'blockHash': block_hash, 'blockId': block_id}
+
+
+@app.task(base=BaseTask, bind=True)
+def refresh_account_balances(self):
+
+    with named_lock(self.engine, 'refresh-account-balances') as acquired:
+
+        if not acquired:
+            return {'result': 'Balance refresh already running'}
+
+        snapshot = AccountSnapshotService(self.session, type_registry=TYPE_REGISTRY)
+
+        checkpoint = SequencerCheckpoint.get(self.session, 'balances')
+
+        # Events of all blocks up to the last sequenced block are present. Balances are not read past the accounts
+        # stream, which would otherwise apply the changes of the blocks in between a second time.
+        harvester = PolkascanHarvesterService(self.session, type_registry=TYPE_REGISTRY)
+        max_sequenced_block_id = harvester.get_sequencer_progress()['accounts']
+
+        if max_sequenced_block_id < 0 or checkpoint.block_id >= max_sequenced_block_id:
+            return {'result': 'No new blocks'}
+
+        start_block_id = checkpoint.block_id + 1
+        end_block_id = min(max_sequenced_block_id, checkpoint.block_id + BALANCE_REFRESH_BLOCKS)
+
+        # All balances are read at the same block, so they are consistent with each other
+        block = Block.query(self.session).get(end_block_id)
+
+        account_ids = list(snapshot.get_touched_accounts(start_block_id, end_block_id))
+
+        for offset in range(0, len(account_ids), ACCOUNT_SNAPSHOT_PAGE_SIZE):
+            snapshot.store_balances(
+                snapshot.get_balances(account_ids[offset:offset + ACCOUNT_SNAPSHOT_PAGE_SIZE], block.hash),
+                block.id
+            )
+
+        checkpoint.block_id = end_block_id
+        checkpoint.save(self.session)
+
+        self.session.commit()
+
+    return {
+        'result': '{} accounts refreshed'.format(len(account_ids)),
+        'blockFrom': start_block_id,
+        'blockTo': end_block_id
+    }
+
+
+@app.task(base=BaseTask, bind=True)
+def aggregate_blocks(self):
+
+    with named_lock(self.engine, 'aggregate-blocks') as acquired:
+
+        if not acquired:
+            return {'result': 'Aggregation already running'}
+
+        harvester = PolkascanHarvesterService(self.session, type_registry=TYPE_REGISTRY)
+
+        start_block_id = SequencerCheckpoint.get(self.session, 'aggregates').block_id
+
+        try:
+            checkpoint = harvester.aggregate_blocks(AGGREGATION_BLOCKS)
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+
+    if checkpoint.block_id - start_block_id >= AGGREGATION_BLOCKS:
+        # More blocks remaining, continue without waiting for the next scheduled run
+        aggregate_blocks.delay()
+
+    return {'result': 'Blocks aggregated from {} to {}'.format(start_block_id, checkpoint.block_id)}
+
 
 @app.task(base=BaseTask, bind=True)
 def start_harvester(self, check_gaps=False):
 
     print("---------- {}".format(check_gaps))
-    substrate = SubstrateInterface(SUBSTRATE_RPC_URL)
+    substrate = BalancedSubstrateInterface(SUBSTRATE_RPC_URLS)
 
     block_sets = []
 
     if check_gaps:
         # Check for gaps between already harvested blocks and try to fill them first
-        remaining_sets_result = Block.get_missing_block_ids(self.session)
+        remaining_sets_result = Block.get_missing_block_ids(self.session).fetchall()
+
+        if remaining_sets_result:
+            spec_version_boundaries = Block.get_spec_version_boundaries(self.session)
 
         for block_set in remaining_sets_result:
 
@@ -175,7 +577,11 @@ def start_harvester(self, check_gaps=False):
             start_block_hash = substrate.get_block_hash(int(block_set['block_to']))
 
             # Start processing task
-            accumulate_block_recursive.delay(start_block_hash, end_block_hash)
+            accumulate_block_async(
+                start_block_hash,
+                end_block_hash,
+                spec_version=get_spec_version_at(spec_version_boundaries, int(block_set['block_to']))
+            )
 
             block_sets.append({
                 'start_block_hash': start_block_hash,
@@ -190,7 +596,10 @@ def start_harvester(self, check_gaps=False):
     start_block_hash = substrate.get_chain_head()
     end_block_hash = None
 
-    accumulate_block_recursive.delay(start_block_hash, end_block_hash)
+    # Runtime of the latest harvested block, a lookup by primary key instead of the boundaries of all runtimes
+    head_spec_version = self.session.query(Block.spec_version_id).order_by(Block.id.desc()).limit(1).scalar()
+
+    accumulate_block_async(start_block_hash, end_block_hash, spec_version=head_spec_version, head_follower=True)
 
     block_sets.append({
         'start_block_hash': start_block_hash,
@@ -207,7 +616,6 @@ def start_harvester(self, check_gaps=False):
 def sequence_block_recursive(self, parent_block_data, parent_sequenced_block_data=None):
 
     harvester = PolkascanHarvesterService(self.session, type_registry=TYPE_REGISTRY)
-    harvester.metadata_store = self.metadata_store
     for nr in range(0, 10):
         if not parent_sequenced_block_data:
             # No block ever sequenced, check if chain is at genesis state
@@ -251,32 +659,59 @@ def sequence_block_recursive(self, parent_block_data, parent_sequenced_block_dat
 
 
 @app.task(base=BaseTask, bind=True)
-def sync_block_account_id(self):
-
-    db_session = self.session
-    blocks = Block.query(db_session).filter(Block.account_index.is_(None)).all()
-
-    for block in blocks:
-        log = Log.query(db_session).filter(Log.block_id == block.id).filter(Log.type == 'PreRuntime').first()
-        if log:
-            data = log.data.get("value").get("data")
-            if data:
-                if data[0:2] != "01" and data[0:2] != "00":
-                    continue
-
-                res = RawBabePreDigest(ScaleBytes("0x{}".format(data)))
-                if data[0:2] == "01" and len(data) == 34:
-                    res.decode()
-                    block.account_index = res.value.get("Secondary").get("authorityIndex")
-                elif data[0:2] == "00":
-                    res.decode(check_remaining=False)
-                    block.account_index = res.value.get("Primary").get("authorityIndex")
-                else:
-                    raise "error log data ".format(data)
-
-                block.save(db_session)
-                print("...................", block.id, block.account_index)
+def sync_block_account_id(self, range_size=SYNC_ACCOUNT_INDEX_RANGE):
+    """
+    Start a task per range of blocks to set the missing authority index of blocks from their PreRuntime logs
+    """
+    block_from, block_to = self.session.query(func.min(Block.id), func.max(Block.id)).filter(
+        Block.account_index.is_(None)
+    ).one()
+
+    if block_from is None:
+        return {'result': 'No blocks without authority index'}
+
+    range_nrs = range(block_from // range_size, block_to // range_size + 1)
+
+    for range_nr in range_nrs:
+        sync_block_account_id_range.delay(range_nr, range_size)
+
+    return {'result': '{} ranges of blocks {} to {} started'.format(len(range_nrs), block_from, block_to)}
+
+
+@app.task(base=BaseTask, bind=True)
+def sync_block_account_id_range(self, range_nr, range_size=SYNC_ACCOUNT_INDEX_RANGE,
+                                chunk_size=SYNC_ACCOUNT_INDEX_CHUNK):
+
+    with named_lock(self.engine, 'sync-account-index-{}-{}'.format(range_size, range_nr)) as acquired:
+
+        if not acquired:
+            return {'result': 'Range {} already being synced'.format(range_nr)}
+
+        harvester = PolkascanHarvesterService(self.session, type_registry=TYPE_REGISTRY)
+
+        block_from = range_nr * range_size
+        block_to = block_from + range_size - 1
+        count_blocks = 0
+
+        # The checkpoint of a range is kept until the range is synced, so an interrupted sync resumes where it stopped
+        checkpoint = SequencerCheckpoint.get(self.session, 'account_index_{}'.format(range_size), range_nr)
+
+        if checkpoint.block_id >= block_to:
+            # Left by a completed sync, blocks added since are synced again from the start of the range
+            checkpoint.block_id = block_from - 1
         else:
-            print("...................", "Blocks not found")
+            checkpoint.block_id = max(checkpoint.block_id, block_from - 1)
+
+        while checkpoint.block_id < block_to:
+            try:
+                count_blocks += harvester.sync_block_account_index(checkpoint, block_to, chunk_size)
+                self.session.commit()
+            except Exception:
+                self.session.rollback()
+                raise
+
+        # Remove the checkpoint of the completed range, so a next sync processes the range again
+        self.session.delete(checkpoint)
+        self.session.commit()
 
-    db_session.commit()
+    return {'result': 'Authority index of {} blocks in {} to {} synced'.format(count_blocks, block_from, block_to)}
@@ -1,6 +1,8 @@
 import os
 import json
 
+from app.utils.typecache import type_resolution_cache, install_type_resolution_cache
+
 
 def load_type_registry(name):
     module_path = os.path.dirname(__file__)
@@ -10,3 +12,18 @@ def load_type_registry(name):
         data = fp.read()
 
     return json.loads(data)
+
+
+def use_type_registry(name):
+    """
+    Configure the default type registry, extended with given type registry, unless it is already active, and route
+    decoder lookups through the type resolution cache
+    :param name: e.g. "default" or "kusama"
+    """
+    install_type_resolution_cache()
+
+    type_registry = [load_type_registry('default')]
+    if name != 'default':
+        type_registry.append(load_type_registry(name))
+
+    type_resolution_cache.use_type_registry(name, type_registry)
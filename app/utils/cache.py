@@ -0,0 +1,449 @@
+#  Polkascan PRE Harvester
+#
+#  Copyright 2018-2019 openAware BV (NL).
+#  This file is part of Polkascan.
+#
+#  Polkascan is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Polkascan is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Polkascan. If not, see <http://www.gnu.org/licenses/>.
+#
+#  cache.py
+
+import os
+import pickle
+import sys
+import threading
+import types
+from collections import OrderedDict
+from contextlib import contextmanager
+from hashlib import blake2b
+
+from sqlalchemy import event
+from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.orm import scoped_session
+
+from app.settings import METADATA_CACHE_DIR, SEQUENCER_ENTITY_CACHE_SIZE
+
+
+def approximate_size(obj):
+    """
+    Approximate memory footprint in bytes of given object and all objects reachable from it, shared objects are
+    counted once. Classes, modules and functions are not followed.
+    :param obj:
+    :return: int
+    """
+    seen = set()
+    size = 0
+    stack = [obj]
+
+    while stack:
+        obj = stack.pop()
+
+        if id(obj) in seen or isinstance(obj, (type, types.ModuleType, types.FunctionType, types.MethodType)):
+            continue
+
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+
+    return size
+
+
+class LRUCache(object):
+    """
+    Thread-safe mapping with a maximum size, the least recently used items are evicted first. Hit and miss
+    statistics are recorded by `get()`.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.sizes = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+
+    def get_size(self, key, value):
+        return 1
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self.items.move_to_end(key)
+            self.hits += 1
+
+            return value
+
+    def remove(self, key):
+        with self.lock:
+            del self.items[key]
+            self.size -= self.sizes.pop(key)
+
+    def evict(self):
+        # The most recently added item is always kept, even when it exceeds the maximum size on its own
+        while self.size > self.max_size and len(self.items) > 1:
+            self.remove(next(iter(self.items)))
+            self.evictions += 1
+
+    def __getitem__(self, key):
+        with self.lock:
+            value = self.items[key]
+            self.items.move_to_end(key)
+            return value
+
+    def __setitem__(self, key, value):
+        size = self.get_size(key, value)
+
+        with self.lock:
+            if key in self.items:
+                self.remove(key)
+
+            self.items[key] = value
+            self.sizes[key] = size
+            self.size += size
+
+            self.evict()
+
+    def __delitem__(self, key):
+        self.remove(key)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def keys(self):
+        with self.lock:
+            return list(self.items.keys())
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.sizes.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'count': len(self.items),
+                'size': self.size,
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+class MetadataStore(LRUCache):
+    """
+    Decoded runtime metadata per spec version, bounded by a memory budget in bytes
+    """
+
+    def __init__(self, max_size):
+        super().__init__(max_size)
+        # Lock and number of users per spec version being loaded
+        self.loading_locks = {}
+        # Size per spec version, measured once: the metadata of a runtime decodes the same each time it is loaded
+        self.entry_sizes = {}
+
+    @contextmanager
+    def loading(self, spec_version):
+        """
+        Hold the lock of given spec version while loading its metadata, so concurrent misses load it once. Locks are
+        removed when no longer in use, so only the runtimes being loaded have one.
+        :param spec_version:
+        """
+        with self.lock:
+            loading_lock = self.loading_locks.setdefault(spec_version, [threading.Lock(), 0])
+            loading_lock[1] += 1
+
+        try:
+            with loading_lock[0]:
+                yield
+        finally:
+            with self.lock:
+                loading_lock[1] -= 1
+                if not loading_lock[1]:
+                    del self.loading_locks[spec_version]
+
+    def get_size(self, key, value):
+        size = self.entry_sizes.get(key)
+
+        if size is None:
+            # Walks the whole object graph, so not repeated when a runtime is stored again after its eviction
+            size = approximate_size(value)
+            self.entry_sizes[key] = size
+
+        return size
+
+    def stats(self):
+        stats = super().stats()
+        with self.lock:
+            stats['runtimes'] = {spec_version: size for spec_version, size in self.sizes.items()}
+        return stats
+
+
+class ExtrinsicDecodeCache(LRUCache):
+    """
+    Decoded extrinsics by (spec_version, hash of the payload), identical payloads within a runtime decode identically
+    """
+
+    @staticmethod
+    def get_key(spec_version, extrinsic):
+        return spec_version, blake2b(extrinsic.encode(), digest_size=16).digest()
+
+    def stats(self):
+        stats = super().stats()
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else None
+        return stats
+
+
+class EntityCache(LRUCache):
+    """
+    Write-behind identity map of entities maintained by the sequencer, kept across blocks for the lifetime of a
+    database session. Cached entities are detached from the session: changes are registered with `put()` and written
+    in bulk by `flush()`, which runs automatically before the session commits. A rollback discards the cache.
+    Only the columns changed since an entity was loaded or last flushed are written, so columns maintained by other
+    writers, e.g. the balance refresher, are not overwritten with stale values.
+    """
+
+    def __init__(self, max_size):
+        super().__init__(max_size)
+        self.dirty = OrderedDict()
+        # Column values of cached entities as last read from or written to the database
+        self.snapshots = {}
+        self.flushed = 0
+
+    @classmethod
+    def for_session(cls, db_session):
+        """
+        Entity cache bound to given session, created on first use
+        :param db_session:
+        :return: EntityCache
+        """
+        if isinstance(db_session, scoped_session):
+            db_session = db_session.registry()
+
+        if 'entity_cache' not in db_session.info:
+            entity_cache = cls(max_size=SEQUENCER_ENTITY_CACHE_SIZE)
+            event.listen(db_session, 'before_commit', entity_cache.flush)
+            event.listen(db_session, 'after_rollback', entity_cache.discard)
+            db_session.info['entity_cache'] = entity_cache
+
+        return db_session.info['entity_cache']
+
+    @staticmethod
+    def get_key(model, key):
+        return model.__tablename__, key
+
+    def get_entity(self, db_session, model, key, **filters):
+        """
+        Retrieve entity from cache, or from the database when not cached. Lookups by primary key only need `key`,
+        otherwise `filters` are used to query the entity.
+        :param db_session:
+        :param model:
+        :param key: primary key, or the unique combination of values in `filters`
+        :param filters:
+        :return: entity or None
+        """
+        cache_key = self.get_key(model, key)
+
+        with self.lock:
+            if cache_key in self.dirty:
+                return self.dirty[cache_key]
+
+            entity = self.get(cache_key)
+
+        if entity is None:
+            if filters:
+                entity = model.query(db_session).filter_by(**filters).first()
+            else:
+                entity = model.query(db_session).get(key)
+
+            if entity is not None:
+                db_session.expunge(entity)
+                self[cache_key] = entity
+                self.snapshots[cache_key] = self.get_row(entity.__table__, entity)
+
+        return entity
+
+    def put(self, model, key, entity):
+        """
+        Register a new or changed entity, written to the database on next flush
+        """
+        cache_key = self.get_key(model, key)
+
+        with self.lock:
+            self.dirty[cache_key] = entity
+            self[cache_key] = entity
+
+    def flush(self, db_session, model=None):
+        """
+        Write all changed entities, or only of given model, to the database with one statement per model. New
+        entities without a primary key are inserted and evicted, as their generated key is not known.
+        :param db_session:
+        :param model:
+        """
+        with self.lock:
+            keys = [key for key in self.dirty if model is None or key[0] == model.__tablename__]
+            entities = [(key, self.dirty.pop(key)) for key in keys]
+
+        tables = OrderedDict()
+
+        for cache_key, entity in entities:
+            tables.setdefault(entity.__table__, []).append((cache_key, entity))
+
+        for table, table_entities in tables.items():
+            primary_keys = [column.name for column in table.primary_key.columns]
+            insert_rows = []
+            # Rows to upsert by the columns to update
+            upsert_rows = OrderedDict()
+
+            for cache_key, entity in table_entities:
+                row = self.get_row(table, entity)
+
+                if None in [row[name] for name in primary_keys]:
+                    insert_rows.append({name: value for name, value in row.items() if name not in primary_keys})
+                    with self.lock:
+                        if cache_key in self.items:
+                            self.remove(cache_key)
+                    continue
+
+                snapshot = self.snapshots.get(cache_key)
+
+                if snapshot is None:
+                    # New entity, or one of which the stored state isn't known
+                    columns = tuple(name for name in row if name not in primary_keys)
+                else:
+                    columns = tuple(
+                        name for name in row if name not in primary_keys and row[name] != snapshot.get(name)
+                    )
+
+                if columns:
+                    upsert_rows.setdefault(columns, []).append(row)
+
+                with self.lock:
+                    if cache_key in self.items:
+                        self.snapshots[cache_key] = row
+                    else:
+                        self.snapshots.pop(cache_key, None)
+
+            if insert_rows:
+                db_session.execute(table.insert(), insert_rows)
+
+            for columns, rows in upsert_rows.items():
+                statement = insert(table).values(rows)
+                statement = statement.on_duplicate_key_update({
+                    name: statement.inserted[name] for name in columns
+                })
+                db_session.execute(statement)
+
+        self.flushed += len(entities)
+
+    @staticmethod
+    def get_row(table, entity):
+        row = {}
+        for column in table.columns:
+            value = getattr(entity, column.key)
+            # Column defaults are not applied to explicit values, so apply scalar defaults of unset attributes here
+            if value is None and column.default is not None and column.default.is_scalar:
+                value = column.default.arg
+            row[column.name] = value
+        return row
+
+    def remove(self, key):
+        with self.lock:
+            super().remove(key)
+            # The snapshot of an evicted entity is still needed to flush its pending changes
+            if key not in self.dirty:
+                self.snapshots.pop(key, None)
+
+    def discard(self, db_session=None):
+        with self.lock:
+            self.dirty.clear()
+            self.snapshots.clear()
+            self.clear()
+
+    def stats(self):
+        stats = super().stats()
+        with self.lock:
+            stats['dirty'] = len(self.dirty)
+            stats['flushed'] = self.flushed
+        return stats
+
+
+def get_metadata_cache_path(runtime, type_registry):
+    """
+    Path of the cached metadata of a runtime, decoded with given type registry. Spec versions are only unique within
+    a chain, so the key also contains the spec name and a digest of the metadata itself.
+    :param runtime: Runtime
+    :param type_registry: name of the type registry
+    :return: str
+    """
+    digest = blake2b(runtime.json_metadata.encode(), digest_size=8).hexdigest()
+
+    return os.path.join(METADATA_CACHE_DIR, 'metadata-{}-{}-{}-{}.pickle'.format(
+        runtime.spec_name, runtime.spec_version, type_registry, digest
+    ))
+
+
+def load_cached_metadata(runtime, type_registry):
+    """
+    Load decoded metadata from the precomputed cache in METADATA_CACHE_DIR, returns None when not available.
+    Files in the cache are unpickled, which can execute arbitrary code: METADATA_CACHE_DIR must only be writable
+    by the harvester.
+    :param runtime: Runtime
+    :param type_registry: name of the type registry
+    :return: MetadataDecoder
+    """
+    if not METADATA_CACHE_DIR:
+        return None
+
+    try:
+        with open(get_metadata_cache_path(runtime, type_registry), 'rb') as fp:
+            return pickle.load(fp)
+    except (OSError, pickle.UnpicklingError, AttributeError, EOFError, ImportError):
+        return None
+
+
+def store_cached_metadata(runtime, type_registry, metadata_decoder):
+    if not METADATA_CACHE_DIR:
+        return
+
+    path = get_metadata_cache_path(runtime, type_registry)
+
+    try:
+        os.makedirs(METADATA_CACHE_DIR, exist_ok=True)
+
+        # Write to a temporary file first, so concurrent workers never read a partially written file
+        with open('{}.{}'.format(path, os.getpid()), 'wb') as fp:
+            pickle.dump(metadata_decoder, fp, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace('{}.{}'.format(path, os.getpid()), path)
+    except (OSError, pickle.PicklingError, AttributeError, TypeError, RecursionError):
+        print('Metadata: could not store {} in cache'.format(runtime.spec_version))
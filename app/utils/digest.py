@@ -0,0 +1,151 @@
+#  Polkascan PRE Harvester
+#
+#  Copyright 2018-2019 openAware BV (NL).
+#  This file is part of Polkascan.
+#
+#  Polkascan is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Polkascan is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Polkascan. If not, see <http://www.gnu.org/licenses/>.
+#
+#  digest.py
+
+""" Parsing of BABE pre-runtime digests straight from bytes. The layout is fixed and tiny, so the generic
+LogDigest and RawBabePreDigest decoders are not needed to find the author of a block.
+
+"""
+from collections import namedtuple
+
+# Index of the PreRuntime variant of DigestItem
+LOG_DIGEST_PRE_RUNTIME = 6
+
+BABE_ENGINE_ID = b'BABE'
+
+# Type string of the PreRuntime variant, as in the decoded value of a log
+PRE_RUNTIME_LOG_TYPE = '(ConsensusEngineId, Bytes)'
+
+# Variants of RawBabePreDigest, both start with the authority index (u32) and slot number (u64)
+BABE_PRE_DIGEST_TYPES = {
+    0: 'Primary',
+    1: 'Secondary'
+}
+
+BabePreDigest = namedtuple('BabePreDigest', ['type', 'authority_index', 'slot_number'])
+
+
+def decode_compact_length(data, offset):
+    """
+    Decode a SCALE compact integer
+    :param data: bytes
+    :param offset:
+    :return: (value, offset after the compact integer)
+    """
+    mode = data[offset] & 0b11
+
+    if mode == 0:
+        return data[offset] >> 2, offset + 1
+    elif mode == 1:
+        return int.from_bytes(data[offset:offset + 2], 'little') >> 2, offset + 2
+    elif mode == 2:
+        return int.from_bytes(data[offset:offset + 4], 'little') >> 2, offset + 4
+    else:
+        length = (data[offset] >> 2) + 4
+        return int.from_bytes(data[offset + 1:offset + 1 + length], 'little'), offset + 1 + length
+
+
+def parse_babe_pre_digest(data):
+    """
+    Parse a SCALE encoded RawBabePreDigest
+    :param data: bytes
+    :return: BabePreDigest, or None when not a primary or secondary BABE pre-digest
+    """
+    if len(data) < 13 or data[0] not in BABE_PRE_DIGEST_TYPES:
+        return None
+
+    return BabePreDigest(
+        type=BABE_PRE_DIGEST_TYPES[data[0]],
+        authority_index=int.from_bytes(data[1:5], 'little'),
+        slot_number=int.from_bytes(data[5:13], 'little')
+    )
+
+
+def parse_pre_runtime_log(log_data):
+    """
+    Parse the BABE pre-digest of a SCALE encoded log of a block header
+    :param log_data: hex string with 0x prefix, as in the header of a block
+    :return: BabePreDigest, or None when not a BABE PreRuntime log
+    """
+    # Skip logs of other types before converting to bytes
+    if log_data[2:4] != '{:02x}'.format(LOG_DIGEST_PRE_RUNTIME):
+        return None
+
+    data = bytes.fromhex(log_data[2:])
+
+    if data[1:5] != BABE_ENGINE_ID:
+        return None
+
+    length, offset = decode_compact_length(data, 5)
+
+    return parse_babe_pre_digest(data[offset:offset + length])
+
+
+def decode_pre_runtime_log(log_data):
+    """
+    Decode a SCALE encoded PreRuntime log of a block header to the value the generic LogDigest decoder gives
+    :param log_data: hex string with 0x prefix, as in the header of a block
+    :return: (value, BabePreDigest or None), or None when not a well-formed PreRuntime log
+    """
+    if log_data[2:4] != '{:02x}'.format(LOG_DIGEST_PRE_RUNTIME):
+        return None
+
+    data = bytes.fromhex(log_data[2:])
+
+    if len(data) < 6:
+        return None
+
+    length, offset = decode_compact_length(data, 5)
+
+    # Truncated or trailing bytes are left to the generic decoder to report
+    if offset + length != len(data):
+        return None
+
+    engine = data[1:5]
+    payload = data[offset:]
+
+    try:
+        engine_id = engine.decode()
+    except UnicodeDecodeError:
+        engine_id = engine.hex()
+
+    value = {
+        'type': PRE_RUNTIME_LOG_TYPE,
+        'value': {'engine': engine_id, 'data': '0x{}'.format(payload.hex())}
+    }
+
+    if engine != BABE_ENGINE_ID:
+        return value, None
+
+    return value, parse_babe_pre_digest(payload)
+
+
+def decode_authority_index(data):
+    """
+    Authority index of the block author from the data of a stored BABE PreRuntime log
+    :param data: hex string without 0x prefix
+    :return: int, or None when not a primary or secondary BABE pre-digest
+    """
+    if not data:
+        return None
+
+    pre_digest = parse_babe_pre_digest(bytes.fromhex(data.replace('0x', '')))
+
+    if pre_digest:
+        return pre_digest.authority_index
@@ -0,0 +1,511 @@
+#  Polkascan PRE Harvester
+#
+#  Copyright 2018-2019 openAware BV (NL).
+#  This file is part of Polkascan.
+#
+#  Polkascan is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Polkascan is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Polkascan. If not, see <http://www.gnu.org/licenses/>.
+#
+#  fastdecode.py
+
+""" Fixed layout decoders of the most frequent inherents and events, which skip the type string machinery of the
+generic ExtrinsicsDecoder and EventsDecoder. A decoder is only used in runtimes where the call or event has exactly the
+expected arguments, all other extrinsics and events are decoded generically.
+
+"""
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+from scalecodec.base import ScaleDecoder, ScaleBytes
+from scalecodec.types import H256, U8, U16, U32, U64, U128, Bool, Null, Enum, Struct
+
+from app.utils.cache import LRUCache
+from app.utils.digest import decode_compact_length
+
+# Extrinsic versions of which unsigned extrinsics are directly followed by the call index
+EXTRINSIC_VERSIONS = (1, 2, 3, 4)
+
+
+class FastCallDecoder(ABC):
+    """
+    Decoder of the arguments of a call with a fixed layout. A decoder instance belongs to the call of one runtime, and
+    is only used when it decodes its samples exactly like the generic decoder with the type registry in use.
+    """
+
+    module_id = None
+    call_id = None
+
+    # Arguments of the call in the metadata, as (name, type) tuples
+    args = ()
+
+    # Encoded arguments to compare with the generic decoder, as hex strings
+    samples = ()
+
+    def matches(self, call):
+        return tuple((arg.name, ScaleDecoder.convert_type(arg.type)) for arg in call.args) == self.args
+
+    def verify(self, call):
+        """
+        Compare the decoded samples with the params and typed values of the generic decoder
+        :param call: call of the metadata
+        :return: True if all samples decode identically
+        """
+        for sample in self.samples:
+            data = bytes.fromhex(sample)
+
+            try:
+                params, typed_params, end = self.decode_args(data, 0)
+            except (ValueError, OverflowError, OSError):
+                return False
+
+            scale_bytes = ScaleBytes(bytearray(data))
+
+            for param, arg in zip(params, call.args):
+                try:
+                    arg_obj = ScaleDecoder.get_decoder_class(arg.type, scale_bytes)
+                    arg_obj.decode(check_remaining=False)
+                except Exception:
+                    return False
+
+                if arg_obj.serialize() != param['value'] or arg_obj.raw_value != param['valueRaw'] \
+                        or arg_obj.value != typed_params[arg.name]:
+                    return False
+
+            if end != len(data) or scale_bytes.offset != len(data):
+                return False
+
+        return True
+
+    @abstractmethod
+    def decode_args(self, data, offset):
+        """
+        Decode the arguments of the call
+        :param data: bytes
+        :param offset: offset of the first argument
+        :return: (list of params as produced by the generic decoder, dict of typed values by name, offset after the
+        arguments)
+        """
+
+
+class TimestampSetDecoder(FastCallDecoder):
+
+    module_id = 'timestamp'
+    call_id = 'set'
+    args = (('now', 'Compact<Moment>'),)
+
+    # Moments in seconds and in milliseconds, and one with a fraction of a second
+    samples = ('03002f6859', '0b00d44a8b6d01', '0b7bd44a8b6d01')
+
+    # Conversions of a Moment to seconds: milliseconds in runtimes since 2019 and seconds before, or a single unit
+    conversions = (
+        lambda value: value / 1000 if value > 10000000000 else value,
+        lambda value: value / 1000,
+        lambda value: value
+    )
+
+    def __init__(self):
+        self.convert = None
+
+    def verify(self, call):
+        # Use the conversion of the Moment decoder in the type registry
+        for convert in self.conversions:
+            self.convert = convert
+            if super().verify(call):
+                return True
+
+        return False
+
+    def decode_args(self, data, offset):
+        value, end = decode_compact_length(data, offset)
+
+        now = datetime.utcfromtimestamp(self.convert(value))
+
+        params = [{
+            'name': 'now',
+            'type': 'Compact<Moment>',
+            'value': now.isoformat(),
+            'valueRaw': data[offset:end].hex()
+        }]
+
+        return params, {'now': now}, end
+
+
+class FinalityTrackerFinalHintDecoder(FastCallDecoder):
+
+    module_id = 'finalitytracker'
+    call_id = 'final_hint'
+    args = (('hint', 'Compact<BlockNumber>'),)
+
+    samples = ('00', 'a8', '1e5a4b00')
+
+    def decode_args(self, data, offset):
+        hint, end = decode_compact_length(data, offset)
+
+        params = [{
+            'name': 'hint',
+            'type': 'Compact<BlockNumber>',
+            'value': hint,
+            'valueRaw': data[offset:end].hex()
+        }]
+
+        return params, {'hint': hint}, end
+
+
+FAST_CALL_DECODERS = [TimestampSetDecoder, FinalityTrackerFinalHintDecoder]
+
+
+class DecodedExtrinsic(object):
+    """
+    Decoded extrinsic, with the attributes of ExtrinsicsDecoder used by the harvester
+    """
+
+    def __init__(self, value, extrinsic_hash=None, contains_transaction=False):
+        self.value = value
+        self.extrinsic_hash = extrinsic_hash
+        self.contains_transaction = contains_transaction
+
+    def decode(self):
+        return self.value
+
+
+class FastExtrinsicDecoder(object):
+    """
+    Fast decoders of a runtime by call index
+    """
+
+    def __init__(self, metadata):
+        self.decoders = {}
+
+        for call_index, (call_module, call) in metadata.call_index.items():
+            for decoder_class in FAST_CALL_DECODERS:
+                if call_module.get_identifier() == decoder_class.module_id \
+                        and call.get_identifier() == decoder_class.call_id:
+                    decoder = decoder_class()
+
+                    if decoder.matches(call) and decoder.verify(call):
+                        self.decoders[bytes.fromhex(call_index)] = (call_index, call_module, call, decoder)
+
+    def decode(self, extrinsic):
+        """
+        Decode an extrinsic if it is an unsigned call with a fast decoder
+        :param extrinsic: hex string with 0x prefix
+        :return: DecodedExtrinsic, or None when the extrinsic has to be decoded generically
+        """
+        if not self.decoders:
+            return None
+
+        data = bytes.fromhex(extrinsic[2:])
+
+        extrinsic_length, offset = decode_compact_length(data, 0)
+
+        if extrinsic_length != len(data) - offset:
+            # Legacy extrinsics without length prefix
+            extrinsic_length = None
+            offset = 0
+
+        if data[offset] not in EXTRINSIC_VERSIONS:
+            return None
+
+        version_info = data[offset:offset + 1].hex()
+
+        try:
+            call_index, call_module, call, decoder = self.decoders[data[offset + 1:offset + 3]]
+        except KeyError:
+            return None
+
+        params, typed_params, end = decoder.decode_args(data, offset + 3)
+
+        if end != len(data):
+            return None
+
+        # Report the argument types as declared in the metadata, like the generic decoder
+        for param, arg in zip(params, call.args):
+            param['type'] = arg.type
+
+        return DecodedExtrinsic({
+            'valueRaw': data.hex(),
+            'extrinsic_length': extrinsic_length,
+            'version_info': version_info,
+            'call_code': call_index,
+            'call_function': call.get_identifier(),
+            'call_module_function': call.get_identifier(),
+            'call_module': call_module.get_identifier(),
+            'params': params,
+            'typed_params': typed_params
+        })
+
+
+def convert_hash(raw):
+    return '0x{}'.format(raw.hex())
+
+
+def convert_int(raw):
+    return int.from_bytes(raw, byteorder='little')
+
+
+def convert_bool(raw):
+    if raw not in (b'\x00', b'\x01'):
+        raise ValueError('Invalid value for datatype "bool"')
+    return raw == b'\x01'
+
+
+def convert_enum(value_list, raw):
+    try:
+        return value_list[raw[0]]
+    except IndexError:
+        raise ValueError("Index '{}' not present in Enum value list".format(raw[0]))
+
+
+# Decoder classes of fixed size types, with their size in bytes and the conversion to the value of the generic decoder
+FIXED_SIZE_TYPES = (
+    (H256, 32, convert_hash),
+    (U128, 16, convert_int),
+    (U64, 8, convert_int),
+    (U32, 4, convert_int),
+    (U16, 2, convert_int),
+    (U8, 1, convert_int),
+    (Bool, 1, convert_bool),
+    (Null, 0, lambda raw: None)
+)
+
+
+def get_fixed_size_converter(type_string):
+    """
+    Fixed size conversion of a type as resolved in the type registry
+    :param type_string:
+    :return: (size in bytes, conversion of the raw bytes to the value of the generic decoder), or None if the type has
+    no fixed size
+    """
+    try:
+        decoder = ScaleDecoder.get_decoder_class(type_string, ScaleBytes('0x'))
+    except NotImplementedError:
+        return None
+
+    decoder_class = type(decoder)
+
+    # Subclasses that override the decoding, like Compact<Moment>, are left to the generic decoder
+    if decoder_class.serialize is not ScaleDecoder.serialize:
+        return None
+
+    for base_class, size, convert in FIXED_SIZE_TYPES:
+        if isinstance(decoder, base_class) and decoder_class.process is base_class.process:
+            return size, convert
+
+    if isinstance(decoder, Enum) and decoder_class.process is Enum.process and not decoder.type_mapping \
+            and decoder.value_list:
+        value_list = tuple(decoder.value_list)
+        return 1, lambda raw: convert_enum(value_list, raw)
+
+    if isinstance(decoder, Struct) and decoder_class.process is Struct.process and decoder.type_mapping:
+        fields = []
+        size = 0
+
+        for name, field_type in decoder.type_mapping:
+            converter = get_fixed_size_converter(field_type)
+
+            if converter is None:
+                return None
+
+            fields.append((name, size, size + converter[0], converter[1]))
+            size += converter[0]
+
+        return size, lambda raw: {name: convert(raw[start:end]) for name, start, end, convert in fields}
+
+    return None
+
+
+def get_fixed_size_layout(arg_types):
+    """
+    Layout of event arguments that all resolve to fixed size types in the type registry. Each conversion is checked
+    against the generic decoder, which for composite types doesn't report the raw value.
+    :param arg_types: types of the arguments as declared in the metadata
+    :return: tuple of (type, size, conversion, whether the raw value is reported) per argument, or None if an argument
+    has no fixed size
+    """
+    layout = []
+
+    for arg_type in arg_types:
+        converter = get_fixed_size_converter(arg_type)
+
+        if converter is None:
+            return None
+
+        size, convert = converter
+        sample = bytes(size)
+
+        decoder = ScaleDecoder.get_decoder_class(arg_type, ScaleBytes(bytearray(sample)))
+        decoder.decode()
+
+        if decoder.serialize() != convert(sample) or decoder.raw_value not in (sample.hex(), ''):
+            return None
+
+        layout.append((arg_type, size, convert, decoder.raw_value != ''))
+
+    return tuple(layout)
+
+
+class DecodedEvent(object):
+    """
+    Decoded event record, with the attributes of EventRecord used by the harvester
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+
+class DecodedEvents(object):
+    """
+    Decoded events of a block, with the attributes of EventsDecoder used by the harvester
+    """
+
+    def __init__(self, elements):
+        self.elements = elements
+        self.value = [element.value for element in elements]
+
+
+class FastEventsDecoder(object):
+    """
+    Decoder of the events of a block in a runtime, with fixed layouts by event index. Records of events with variable
+    size arguments are decoded with the generic EventRecord.
+    """
+
+    def __init__(self, metadata):
+        self.metadata = metadata
+        self.layouts = {}
+
+        for event_index, (event_module, event) in metadata.event_index.items():
+            layout = get_fixed_size_layout(event.args)
+            if layout is not None:
+                self.layouts[bytes.fromhex(event_index)] = (event_index, event_module, event, layout)
+
+        # Topics introduced since MetadataV5
+        self.has_topics = bool(metadata.version and metadata.version.index >= 5)
+
+    def decode(self, events_data):
+        """
+        Decode the events of a block
+        :param events_data: hex string with 0x prefix of the System.Events storage
+        :return: DecodedEvents
+        """
+        data = bytes.fromhex(events_data[2:])
+        scale_bytes = None
+
+        element_count, offset = decode_compact_length(data, 0)
+
+        elements = []
+
+        for event_idx in range(element_count):
+            record = self.decode_record(data, offset)
+
+            if record is None:
+                # Generic decoding of records of events with variable size arguments
+                if scale_bytes is None:
+                    scale_bytes = ScaleBytes(bytearray(data))
+
+                scale_bytes.offset = offset
+                element = ScaleDecoder.get_decoder_class('EventRecord', scale_bytes, metadata=self.metadata)
+                element.decode(check_remaining=False)
+                offset = scale_bytes.offset
+            else:
+                value, offset = record
+                element = DecodedEvent(value)
+
+            element.value['event_idx'] = event_idx
+            elements.append(element)
+
+        if offset != len(data):
+            raise ValueError('Events data not fully decoded, offset: {} / length: {}'.format(offset, len(data)))
+
+        return DecodedEvents(elements)
+
+    def decode_record(self, data, offset):
+        """
+        Decode an event record with a fixed layout
+        :param data: bytes
+        :param offset: offset of the record
+        :return: (value as produced by EventRecord, offset after the record), or None when the event has no fixed
+        layout
+        """
+        phase = data[offset]
+        extrinsic_idx = None
+        offset += 1
+
+        if phase == 0:
+            extrinsic_idx = int.from_bytes(data[offset:offset + 4], byteorder='little')
+            offset += 4
+
+        try:
+            event_index, event_module, event, layout = self.layouts[data[offset:offset + 2]]
+        except KeyError:
+            return None
+
+        offset += 2
+
+        params = []
+
+        for arg_type, size, convert, has_raw_value in layout:
+            raw = data[offset:offset + size]
+            offset += size
+
+            params.append({
+                'type': arg_type,
+                'value': convert(raw),
+                'valueRaw': raw.hex() if has_raw_value else ''
+            })
+
+        topics = []
+
+        if self.has_topics:
+            topic_count, offset = decode_compact_length(data, offset)
+
+            for topic_idx in range(topic_count):
+                topics.append('0x{}'.format(data[offset:offset + 32].hex()))
+                offset += 32
+
+        if offset > len(data):
+            raise ValueError('Event record exceeds events data')
+
+        return {
+            'phase': phase,
+            'extrinsic_idx': extrinsic_idx,
+            'type': event_index,
+            'module_id': event_module.name,
+            'event_id': event.name,
+            'params': params,
+            'topics': topics
+        }, offset
+
+
+# Fast decoders per spec version, cheap to build so only the most recent runtimes are kept
+fast_extrinsic_decoders = LRUCache(max_size=16)
+fast_events_decoders = LRUCache(max_size=16)
+
+
+def get_fast_extrinsic_decoder(spec_version, metadata):
+    fast_decoder = fast_extrinsic_decoders.get(spec_version)
+
+    if fast_decoder is None:
+        fast_decoder = FastExtrinsicDecoder(metadata)
+        fast_extrinsic_decoders[spec_version] = fast_decoder
+
+    return fast_decoder
+
+
+def get_fast_events_decoder(spec_version, metadata):
+    fast_decoder = fast_events_decoders.get(spec_version)
+
+    if fast_decoder is None:
+        fast_decoder = FastEventsDecoder(metadata)
+        fast_events_decoders[spec_version] = fast_decoder
+
+    return fast_decoder
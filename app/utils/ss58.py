@@ -23,14 +23,31 @@
 
 """
 import base58
+from functools import lru_cache
 from hashlib import blake2b
 
-from scalecodec import ScaleBytes
-from scalecodec.types import U8, U16, U32, U64
+from app.settings import SS58_CACHE_SIZE
 
+CHECKSUM_PREFIX = b'SS58PRE'
 
+# Checksum length by length of the decoded address, including address type and checksum
+CHECKSUM_LENGTHS = {
+    3: 1, 4: 1, 6: 1, 10: 1,
+    5: 2, 7: 2, 11: 2, 35: 2,
+    8: 3, 12: 3,
+    9: 4, 13: 4,
+    14: 5,
+    15: 6,
+    16: 7,
+    17: 8
+}
+
+# Size in bytes of an encoded account index, by the largest value that fits
+ACCOUNT_INDEX_SIZES = ((2**8 - 1, 1), (2**16 - 1, 2), (2**32 - 1, 4), (2**64 - 1, 8))
+
+
+@lru_cache(maxsize=SS58_CACHE_SIZE)
 def ss58_decode(address, valid_address_type=42):
-    checksum_prefix = b'SS58PRE'
 
     ss58_format = base58.b58decode(address)
 
@@ -38,26 +55,12 @@ def ss58_decode(address, valid_address_type=42):
         raise ValueError("Invalid Address type")
 
     # Public keys has a two byte checksum, account index 1 byte
-    if len(ss58_format) in [3, 4, 6, 10]:
-        checksum_length = 1
-    elif len(ss58_format) in [5, 7, 11, 35]:
-        checksum_length = 2
-    elif len(ss58_format) in [8, 12]:
-        checksum_length = 3
-    elif len(ss58_format) in [9, 13]:
-        checksum_length = 4
-    elif len(ss58_format) in [14]:
-        checksum_length = 5
-    elif len(ss58_format) in [15]:
-        checksum_length = 6
-    elif len(ss58_format) in [16]:
-        checksum_length = 7
-    elif len(ss58_format) in [17]:
-        checksum_length = 8
-    else:
+    checksum_length = CHECKSUM_LENGTHS.get(len(ss58_format))
+
+    if not checksum_length:
         raise ValueError("Invalid address length")
 
-    checksum = blake2b(checksum_prefix + ss58_format[0:-checksum_length]).digest()
+    checksum = blake2b(CHECKSUM_PREFIX + ss58_format[0:-checksum_length]).digest()
 
     if checksum[0:checksum_length] != ss58_format[-checksum_length:]:
         raise ValueError("Invalid checksum")
@@ -66,13 +69,22 @@ def ss58_decode(address, valid_address_type=42):
 
 
 def ss58_encode(address, address_type=42):
-    checksum_prefix = b'SS58PRE'
 
-    if type(address) is bytes or type(address) is bytearray:
+    if type(address) is bytearray:
+        # Cached by argument, so only hashable types
+        address = bytes(address)
+
+    return _ss58_encode(address, address_type)
+
+
+@lru_cache(maxsize=SS58_CACHE_SIZE)
+def _ss58_encode(address, address_type):
+
+    if type(address) is bytes:
         address_bytes = address
     else:
         address_bytes = bytes.fromhex(address)
-    
+
     if len(address_bytes) == 32:
         # Checksum size is 2 bytes for public key
         checksum_length = 2
@@ -83,39 +95,45 @@ def ss58_encode(address, address_type=42):
         raise ValueError("Invalid length for address")
 
     address_format = bytes([address_type]) + address_bytes
-    checksum = blake2b(checksum_prefix + address_format).digest()
+    checksum = blake2b(CHECKSUM_PREFIX + address_format).digest()
 
     return base58.b58encode(address_format + checksum[:checksum_length]).decode()
 
 
+def ss58_encode_many(addresses, address_type=42):
+    """
+    Encode a list of public keys or account indices
+    :param addresses: list of hex strings or bytes
+    :param address_type:
+    :return: list of SS58 addresses, in order of given addresses
+    """
+    return [ss58_encode(address, address_type) for address in addresses]
+
+
+def ss58_decode_many(addresses, valid_address_type=42):
+    """
+    Decode a list of SS58 addresses
+    :param addresses: list of SS58 addresses
+    :param valid_address_type:
+    :return: list of hex strings, in order of given addresses
+    """
+    return [ss58_decode(address, valid_address_type) for address in addresses]
+
+
 def ss58_encode_account_index(account_index, address_type=42):
 
-    if 0 <= account_index <= 2**8 - 1:
-        account_idx_encoder = U8()
-    elif 2**8 <= account_index <= 2**16 - 1:
-        account_idx_encoder = U16()
-    elif 2**16 <= account_index <= 2**32 - 1:
-        account_idx_encoder = U32()
-    elif 2**32 <= account_index <= 2**64 - 1:
-        account_idx_encoder = U64()
-    else:
-        raise ValueError("Value too large for an account index")
+    for max_value, size in ACCOUNT_INDEX_SIZES:
+        if 0 <= account_index <= max_value:
+            return ss58_encode(account_index.to_bytes(size, 'little'), address_type)
 
-    return ss58_encode(account_idx_encoder.encode(account_index).data, address_type)
+    raise ValueError("Value too large for an account index")
 
 
 def ss58_decode_account_index(address, valid_address_type=42):
 
     account_index_bytes = ss58_decode(address, valid_address_type)
 
-    if len(account_index_bytes) == 2:
-        return U8(ScaleBytes('0x{}'.format(account_index_bytes))).decode()
-    if len(account_index_bytes) == 4:
-        return U16(ScaleBytes('0x{}'.format(account_index_bytes))).decode()
-    if len(account_index_bytes) == 8:
-        return U32(ScaleBytes('0x{}'.format(account_index_bytes))).decode()
-    if len(account_index_bytes) == 16:
-        return U64(ScaleBytes('0x{}'.format(account_index_bytes))).decode()
-    else:
+    if len(account_index_bytes) not in (2, 4, 8, 16):
         raise ValueError("Invalid account index length")
 
+    return int.from_bytes(bytes.fromhex(account_index_bytes), 'little')
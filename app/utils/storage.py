@@ -0,0 +1,93 @@
+#  Polkascan PRE Harvester
+#
+#  Copyright 2018-2019 openAware BV (NL).
+#  This file is part of Polkascan.
+#
+#  Polkascan is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Polkascan is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Polkascan. If not, see <http://www.gnu.org/licenses/>.
+#
+#  storage.py
+
+""" Storage keys of Substrate storage maps, so keys can be enumerated and queried in batches
+
+"""
+from hashlib import blake2b
+
+import xxhash
+
+# Hashers that append the key itself to its hash, so the key can be recovered from an enumerated storage key
+CONCAT_HASHERS = {
+    'Blake2_128Concat': 16,
+    'Twox64Concat': 8
+}
+
+
+def twox(data, length):
+    return b''.join([
+        xxhash.xxh64(data, seed=seed).intdigest().to_bytes(8, 'little') for seed in range(0, length // 8)
+    ])
+
+
+def storage_prefix(module, function):
+    """
+    Storage key prefix shared by all entries of a storage map
+    :param module: module prefix, e.g. "Balances"
+    :param function: e.g. "FreeBalance"
+    :return: hex string with 0x prefix
+    """
+    return '0x{}{}'.format(twox(module.encode(), 16).hex(), twox(function.encode(), 16).hex())
+
+
+def hash_key(hasher, key):
+    """
+    Hash the SCALE encoded map key with given hasher
+    :param hasher: hasher name as in the metadata
+    :param key: hex string, with or without 0x prefix
+    :return: hex string without 0x prefix
+    """
+    data = bytes.fromhex(key.replace('0x', ''))
+
+    if hasher == 'Blake2_256':
+        return blake2b(data, digest_size=32).hexdigest()
+    elif hasher == 'Blake2_128':
+        return blake2b(data, digest_size=16).hexdigest()
+    elif hasher == 'Blake2_128Concat':
+        return blake2b(data, digest_size=16).hexdigest() + data.hex()
+    elif hasher == 'Twox128':
+        return twox(data, 16).hex()
+    elif hasher == 'Twox256':
+        return twox(data, 32).hex()
+    elif hasher == 'Twox64Concat':
+        return twox(data, 8).hex() + data.hex()
+    elif hasher == 'Identity':
+        return data.hex()
+    else:
+        raise ValueError('Unsupported hasher "{}"'.format(hasher))
+
+
+def storage_map_key(module, function, hasher, key):
+    return storage_prefix(module, function) + hash_key(hasher, key)
+
+
+def key_from_storage_key(hasher, storage_key):
+    """
+    Recover the map key from an enumerated storage key, only possible for concat hashers
+    :param hasher:
+    :param storage_key: hex string with 0x prefix
+    :return: hex string without 0x prefix, or None
+    """
+    if hasher not in CONCAT_HASHERS:
+        return None
+
+    # Skip 0x, both 128-bit prefixes and the hash
+    return storage_key[2 + 64 + CONCAT_HASHERS[hasher] * 2:]
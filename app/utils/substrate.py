@@ -0,0 +1,468 @@
+#  Polkascan PRE Harvester
+#
+#  Copyright 2018-2019 openAware BV (NL).
+#  This file is part of Polkascan.
+#
+#  Polkascan is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Polkascan is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Polkascan. If not, see <http://www.gnu.org/licenses/>.
+#
+#  substrate.py
+
+""" Routing of Substrate RPC requests over a pool of nodes.
+
+    Each request is sent to the available node with the lowest observed latency. Idempotent requests for a specific
+    block hash are hedged: when the first node does not answer within the hedge delay the same request is sent to a
+    second node and the first successful response is used. Nodes failing consecutively are taken out of rotation by a
+    circuit breaker and get a single trial request after the cooldown period.
+
+    All requests of a process pass a shared concurrency limiter. The limit grows additively while the nodes respond
+    within the latency target and shrinks multiplicatively on slow responses or errors (AIMD), part of the limit is
+    reserved for the head follower.
+
+    The limiter, the head reserve and the node statistics are kept per process and are not shared between Celery
+    workers: the total number of concurrent requests to the nodes is up to the limit times the number of worker
+    processes, and the head reserve only applies to requests of the worker running the head follower. Coordinating
+    the limit across workers is out of scope, the metrics of each worker are reported by the status endpoint.
+
+"""
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+
+from substrateinterface import SubstrateInterface, SubstrateRequestException
+
+from app.settings import SUBSTRATE_RPC_TIMEOUT, SUBSTRATE_RPC_HEDGE_DELAY, SUBSTRATE_RPC_CIRCUIT_FAILURES, \
+    SUBSTRATE_RPC_CIRCUIT_COOLDOWN, SUBSTRATE_RPC_CONCURRENCY, SUBSTRATE_RPC_CONCURRENCY_MIN, \
+    SUBSTRATE_RPC_CONCURRENCY_MAX, SUBSTRATE_RPC_LATENCY_TARGET, SUBSTRATE_RPC_HEAD_RESERVE, STORAGE_PREFETCH_WORKERS
+
+RPC_PRIORITY_DEFAULT = 'default'
+RPC_PRIORITY_HEAD = 'head'
+
+# Methods that return the same result on every node when called with an explicit block hash as last parameter
+HEDGED_RPC_METHODS = [
+    'chain_getBlock',
+    'chain_getHeader',
+    'state_getRuntimeVersion',
+    'state_getMetadata',
+    'state_getStorageAt',
+]
+
+
+class AdaptiveConcurrencyLimiter(object):
+
+    backoff = 0.75
+    error_rate_decay = 0.05
+
+    def __init__(self, limit=SUBSTRATE_RPC_CONCURRENCY, min_limit=SUBSTRATE_RPC_CONCURRENCY_MIN,
+                 max_limit=SUBSTRATE_RPC_CONCURRENCY_MAX, latency_target=SUBSTRATE_RPC_LATENCY_TARGET,
+                 head_reserve=SUBSTRATE_RPC_HEAD_RESERVE):
+        self.limit = float(limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.head_reserve = head_reserve
+        self.in_flight = 0
+        self.queue_depth = {RPC_PRIORITY_DEFAULT: 0, RPC_PRIORITY_HEAD: 0}
+        self.error_rate = 0.0
+        self.last_decrease = 0
+        self.count_decrease = 0
+        self.condition = threading.Condition()
+
+    def capacity(self, priority):
+        limit = max(1, int(self.limit))
+
+        if priority == RPC_PRIORITY_HEAD or limit == 1:
+            return limit
+
+        return max(1, limit - math.ceil(limit * self.head_reserve))
+
+    def acquire(self, priority=RPC_PRIORITY_DEFAULT):
+        with self.condition:
+            self.queue_depth[priority] += 1
+            try:
+                while self.in_flight >= self.capacity(priority):
+                    self.condition.wait()
+            finally:
+                self.queue_depth[priority] -= 1
+
+            self.in_flight += 1
+
+    def release(self, latency=None, error=False):
+        with self.condition:
+            saturated = self.in_flight >= int(self.limit) or sum(self.queue_depth.values()) > 0
+            self.in_flight -= 1
+            self.error_rate += self.error_rate_decay * (int(error) - self.error_rate)
+
+            if error or latency > self.latency_target:
+                # Decrease at most once per latency window, a burst of slow responses is a single overload signal
+                now = time.time()
+                if now - self.last_decrease >= self.latency_target:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self.last_decrease = now
+                    self.count_decrease += 1
+            elif saturated:
+                # Grows by one for every full window of successful requests
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+            self.condition.notify_all()
+
+    def metrics(self):
+        with self.condition:
+            return {
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'queue_depth': sum(self.queue_depth.values()),
+                'queue_depth_head': self.queue_depth[RPC_PRIORITY_HEAD],
+                'error_rate': round(self.error_rate, 4),
+                'count_decrease': self.count_decrease
+            }
+
+
+concurrency_limiter = AdaptiveConcurrencyLimiter()
+
+_request_context = threading.local()
+
+
+@contextmanager
+def rpc_priority(priority):
+    previous = getattr(_request_context, 'priority', RPC_PRIORITY_DEFAULT)
+    _request_context.priority = priority
+    try:
+        yield
+    finally:
+        _request_context.priority = previous
+
+
+def get_rpc_priority():
+    return getattr(_request_context, 'priority', RPC_PRIORITY_DEFAULT)
+
+
+class SubstrateEndpoint(object):
+
+    def __init__(self, url):
+        self.url = url
+        self.latency = None
+        self.in_flight = 0
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.count_requests = 0
+        self.count_errors = 0
+
+    def metrics(self):
+        return {
+            'url': self.url,
+            'latency': self.latency,
+            'in_flight': self.in_flight,
+            'circuit_open': self.opened_at is not None,
+            'count_requests': self.count_requests,
+            'count_errors': self.count_errors
+        }
+
+
+class SubstrateNodePool(object):
+
+    latency_decay = 0.3
+
+    def __init__(self, urls, timeout=SUBSTRATE_RPC_TIMEOUT, hedge_delay=SUBSTRATE_RPC_HEDGE_DELAY,
+                 failure_threshold=SUBSTRATE_RPC_CIRCUIT_FAILURES, cooldown=SUBSTRATE_RPC_CIRCUIT_COOLDOWN):
+        self.endpoints = [SubstrateEndpoint(url) for url in urls]
+        self.timeout = timeout
+        self.hedge_delay = hedge_delay
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.count_hedged = 0
+        self.lock = threading.Lock()
+        self.executor = None
+        self.executor_pid = None
+
+    def get_executor(self):
+        # Threads do not survive a fork, so every (Celery) worker process gets its own executor
+        if self.executor is None or self.executor_pid != os.getpid():
+            self.executor = ThreadPoolExecutor(max_workers=max(4, len(self.endpoints) * 4))
+            self.executor_pid = os.getpid()
+        return self.executor
+
+    def is_available(self, endpoint, now):
+        if endpoint.opened_at is None:
+            return True
+        # Half-open: allow a single trial request after the cooldown period
+        return not endpoint.trial_running and now - endpoint.opened_at >= self.cooldown
+
+    def score(self, endpoint):
+        # Nodes without measurements yet are preferred, so every node gets sampled
+        return (endpoint.latency or 0) * (1 + endpoint.in_flight)
+
+    def select_endpoint(self, exclude=()):
+        with self.lock:
+            now = time.time()
+            candidates = [endpoint for endpoint in self.endpoints
+                          if endpoint not in exclude and self.is_available(endpoint, now)]
+
+            if not candidates:
+                # All nodes out of rotation: try the node that failed longest ago instead of failing directly
+                candidates = sorted(
+                    [endpoint for endpoint in self.endpoints if endpoint not in exclude],
+                    key=lambda endpoint: endpoint.opened_at or 0
+                )[:1]
+
+            if not candidates:
+                return None
+
+            endpoint = min(candidates, key=self.score)
+
+            if endpoint.opened_at is not None:
+                endpoint.trial_running = True
+
+            endpoint.in_flight += 1
+
+            return endpoint
+
+    def record(self, endpoint, latency=None, error=False):
+        with self.lock:
+            endpoint.in_flight -= 1
+            endpoint.trial_running = False
+            endpoint.count_requests += 1
+
+            if error:
+                endpoint.count_errors += 1
+                endpoint.failures += 1
+
+                if endpoint.failures >= self.failure_threshold or endpoint.opened_at is not None:
+                    endpoint.opened_at = time.time()
+            else:
+                endpoint.failures = 0
+                endpoint.opened_at = None
+
+                if endpoint.latency is None:
+                    endpoint.latency = latency
+                else:
+                    endpoint.latency += self.latency_decay * (latency - endpoint.latency)
+
+    def send(self, endpoint, payload, priority=RPC_PRIORITY_DEFAULT):
+        concurrency_limiter.acquire(priority)
+
+        start = time.time()
+
+        try:
+            response = requests.post(
+                endpoint.url,
+                data=json.dumps(payload),
+                headers={'content-type': 'application/json', 'cache-control': 'no-cache'},
+                timeout=self.timeout
+            )
+
+            if response.status_code != 200:
+                raise SubstrateRequestException(
+                    "RPC request failed with HTTP status code {}".format(response.status_code)
+                )
+
+            result = response.json()
+
+            # A JSON-RPC error is returned with HTTP status 200, the request failed on this node nonetheless
+            if 'error' in result:
+                raise SubstrateRequestException(
+                    "RPC request failed with error {}".format(json.dumps(result['error']))
+                )
+
+        except (requests.RequestException, ValueError, SubstrateRequestException):
+            self.record(endpoint, error=True)
+            concurrency_limiter.release(error=True)
+            raise
+
+        latency = time.time() - start
+
+        self.record(endpoint, latency=latency)
+        concurrency_limiter.release(latency=latency)
+
+        return result
+
+    def send_hedged(self, endpoint, payload, tried, priority=RPC_PRIORITY_DEFAULT):
+        executor = self.get_executor()
+
+        futures = [executor.submit(self.send, endpoint, payload, priority)]
+
+        done, pending = wait(futures, timeout=max(self.hedge_delay, 2 * (endpoint.latency or 0)))
+
+        if not done:
+            hedge_endpoint = self.select_endpoint(exclude=tried)
+            if hedge_endpoint:
+                tried.append(hedge_endpoint)
+                self.count_hedged += 1
+                futures.append(executor.submit(self.send, hedge_endpoint, payload, priority))
+
+        # Use the first successful response, the slower request is left to finish in the background
+        pending = futures
+        exception = None
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                exception = future.exception()
+
+        raise exception
+
+    def request(self, method, params, payload):
+        hedge = self.hedge_delay > 0 and len(self.endpoints) > 1 and method in HEDGED_RPC_METHODS \
+            and params and params[-1] is not None
+
+        # Priority is thread local, so it is determined here before requests are handed to the executor
+        priority = get_rpc_priority()
+
+        tried = []
+        exception = None
+
+        while len(tried) < len(self.endpoints):
+            endpoint = self.select_endpoint(exclude=tried)
+
+            if not endpoint:
+                break
+
+            tried.append(endpoint)
+
+            try:
+                if hedge:
+                    return self.send_hedged(endpoint, payload, tried, priority)
+                else:
+                    return self.send(endpoint, payload, priority)
+            except (requests.RequestException, ValueError, SubstrateRequestException) as e:
+                exception = e
+
+        raise SubstrateRequestException('RPC request "{}" failed on all nodes'.format(method)) from exception
+
+    def metrics(self):
+        with self.lock:
+            return {
+                'count_hedged': self.count_hedged,
+                'endpoints': [endpoint.metrics() for endpoint in self.endpoints]
+            }
+
+
+_node_pools = {}
+_node_pools_lock = threading.Lock()
+
+
+def get_node_pool(urls):
+    with _node_pools_lock:
+        key = tuple(urls)
+        if key not in _node_pools:
+            _node_pools[key] = SubstrateNodePool(urls)
+        return _node_pools[key]
+
+
+class StorageRequest(object):
+    """
+    Storage item to retrieve, identified for the requester by `key`
+    """
+
+    def __init__(self, key, block_hash, module, function, return_scale_type, hasher=None, params=None,
+                 metadata=None):
+        self.key = key
+        self.block_hash = block_hash
+        self.module = module
+        self.function = function
+        self.return_scale_type = return_scale_type
+        self.hasher = hasher
+        self.params = params
+        self.metadata = metadata
+
+    def get_identity(self):
+        return self.block_hash, self.module, self.function, self.params, self.return_scale_type, self.hasher
+
+
+_prefetch_executor = None
+_prefetch_executor_pid = None
+_prefetch_executor_lock = threading.Lock()
+
+
+def get_prefetch_executor():
+    global _prefetch_executor, _prefetch_executor_pid
+
+    with _prefetch_executor_lock:
+        # Threads do not survive a fork, so every (Celery) worker process gets its own executor
+        if _prefetch_executor is None or _prefetch_executor_pid != os.getpid():
+            _prefetch_executor = ThreadPoolExecutor(max_workers=STORAGE_PREFETCH_WORKERS)
+            _prefetch_executor_pid = os.getpid()
+        return _prefetch_executor
+
+
+def fetch_storage(substrate, request, priority):
+    with rpc_priority(priority):
+        return substrate.get_storage(
+            block_hash=request.block_hash,
+            module=request.module,
+            function=request.function,
+            params=request.params,
+            return_scale_type=request.return_scale_type,
+            hasher=request.hasher,
+            metadata=request.metadata
+        )
+
+
+def prefetch_storage(substrate, requests):
+    """
+    Retrieve given storage items concurrently, identical requests are sent once. Decoding errors are raised by
+    `Future.result()`, as they would have been by `get_storage()`.
+    :param substrate: SubstrateInterface
+    :param requests: list of StorageRequest
+    :return: list of Future, in the order of the requests
+    """
+    executor = get_prefetch_executor()
+    priority = get_rpc_priority()
+    futures = {}
+
+    for request in requests:
+        if request.get_identity() not in futures:
+            futures[request.get_identity()] = executor.submit(fetch_storage, substrate, request, priority)
+
+    return [futures[request.get_identity()] for request in requests]
+
+
+def rpc_metrics():
+    with _node_pools_lock:
+        node_pools = list(_node_pools.values())
+
+    return {
+        'concurrency': concurrency_limiter.metrics(),
+        'nodes': [endpoint for node_pool in node_pools for endpoint in node_pool.metrics()['endpoints']],
+        'count_hedged': sum([node_pool.count_hedged for node_pool in node_pools])
+    }
+
+
+class BalancedSubstrateInterface(SubstrateInterface):
+
+    def __init__(self, urls, **kwargs):
+        if type(urls) is str:
+            urls = [urls]
+
+        self.node_pool = get_node_pool(urls)
+
+        super().__init__(urls[0], **kwargs)
+
+    def rpc_request(self, method, params):
+        payload = {
+            "jsonrpc": "2.0",
+            "method": method,
+            "params": params,
+            "id": 1
+        }
+
+        return self.node_pool.request(method, params, payload)
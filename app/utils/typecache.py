@@ -0,0 +1,178 @@
+#  Polkascan PRE Harvester
+#
+#  Copyright 2018-2019 openAware BV (NL).
+#  This file is part of Polkascan.
+#
+#  Polkascan is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Polkascan is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Polkascan. If not, see <http://www.gnu.org/licenses/>.
+#
+#  typecache.py
+
+""" Memoized resolution of type strings to decoder classes. `ScaleDecoder.get_decoder_class` converts and parses
+the type string with regular expressions on every call, while the outcome only depends on the type registry.
+
+Concurrent decoding within a process is supported for one chain only: scalecodec reads its types from the global
+`RuntimeConfiguration`, so a process is configured with one type registry and keeps it. Harvesting several chains
+needs a worker process per chain.
+
+"""
+import threading
+
+from scalecodec.base import ScaleDecoder, RuntimeConfiguration
+
+# Resolutions that can't be replayed, e.g. decoders that can't be constructed without data
+UNCACHEABLE = object()
+
+
+class TypeResolution(object):
+
+    def __init__(self, decoder_class, sub_type, pass_sub_type):
+        self.decoder_class = decoder_class
+        # Sub type of the resolved decoder, either given by the type string or by the decoder class itself
+        self.sub_type = sub_type
+        self.pass_sub_type = pass_sub_type
+
+    def create(self, data=None, **kwargs):
+        if self.pass_sub_type:
+            return self.decoder_class(data, sub_type=self.sub_type, **kwargs)
+        return self.decoder_class(data, **kwargs)
+
+
+class TypeResolutionCache(object):
+    """
+    Decoder class and sub type by (spec_version, type_string), where spec_version is the runtime the type registry
+    is configured for. Cleared when the type registry changes.
+    """
+
+    def __init__(self, get_decoder_class):
+        self.get_decoder_class = get_decoder_class
+        self.resolutions = {}
+        self.type_registry = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+        # Separate lock for the counters, so hits don't wait for resolutions in progress
+        self.stats_lock = threading.Lock()
+
+    def use_type_registry(self, name, type_registry):
+        """
+        Configure the type registry, unless it is already active. The runtime configuration is global to the
+        process and read without locking while decoding, so once configured it can't be replaced by another one.
+        :param name: name of the type registry
+        :param type_registry: list of type registry dicts, applied in order
+        """
+        if self.type_registry == name:
+            return
+
+        with self.lock:
+            if self.type_registry == name:
+                return
+
+            if self.type_registry is not None:
+                raise ValueError('Type registry "{}" is active, a process can only decode one chain'.format(
+                    self.type_registry
+                ))
+
+            for registry in type_registry:
+                RuntimeConfiguration().update_type_registry(registry)
+
+            self.resolutions.clear()
+            self.type_registry = name
+
+    def resolve(self, type_string, data=None, **kwargs):
+        """
+        Create decoder for given type string, like `ScaleDecoder.get_decoder_class`
+        :return: ScaleDecoder
+        """
+        key = (RuntimeConfiguration().active_spec_version_id, type_string)
+
+        resolution = self.resolutions.get(key)
+
+        if resolution is None:
+            # Tuples are resolved by changing a shared struct class, which concurrent resolutions must not do at the
+            # same time
+            with self.lock:
+                self.misses += 1
+
+                decoder_obj = self.get_decoder_class(ScaleDecoder, type_string, data, **kwargs)
+                resolution = self.resolutions.setdefault(key, self.get_resolution(type_string, decoder_obj))
+
+            if resolution is UNCACHEABLE:
+                return decoder_obj
+
+        elif resolution is UNCACHEABLE:
+            with self.lock:
+                return self.get_decoder_class(ScaleDecoder, type_string, data, **kwargs)
+
+        else:
+            with self.stats_lock:
+                self.hits += 1
+
+        # Also on a miss, so the decoder uses the class of its own resolution instead of the shared one
+        return resolution.create(data, **kwargs)
+
+    @staticmethod
+    def get_resolution(type_string, decoder_obj):
+        decoder_class = decoder_obj.__class__
+
+        try:
+            if type_string != '()' and type_string[0] == '(' and type_string[-1] == ')':
+                # Tuples share one struct class of which the type mapping is replaced on every resolution, so each
+                # tuple gets a class of its own
+                decoder_class = type(decoder_class.__name__, (decoder_class,), {
+                    'type_string': decoder_obj.type_string,
+                    'type_mapping': decoder_obj.type_mapping
+                })
+
+            default_sub_type = decoder_class(None).sub_type
+        except Exception:
+            return UNCACHEABLE
+
+        return TypeResolution(
+            decoder_class=decoder_class,
+            sub_type=decoder_obj.sub_type,
+            pass_sub_type=decoder_obj.sub_type != default_sub_type
+        )
+
+    def stats(self):
+        with self.lock, self.stats_lock:
+            return {
+                'type_registry': self.type_registry,
+                'count': len(self.resolutions),
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+type_resolution_cache = TypeResolutionCache(ScaleDecoder.get_decoder_class.__func__)
+
+_install_lock = threading.Lock()
+
+
+def cached_get_decoder_class(cls, type_string, data=None, **kwargs):
+    return type_resolution_cache.resolve(type_string, data, **kwargs)
+
+
+def install_type_resolution_cache():
+    """
+    Route all decoder lookups, also those made by scalecodec while decoding, through the cache. Called when the
+    harvester configures its type registry, importing this module changes nothing.
+    """
+    with _install_lock:
+        if getattr(ScaleDecoder.get_decoder_class, '__func__', None) is cached_get_decoder_class:
+            return
+
+        # Create the runtime configuration singleton first, as its creation isn't thread-safe
+        RuntimeConfiguration()
+
+        ScaleDecoder.get_decoder_class = classmethod(cached_get_decoder_class)
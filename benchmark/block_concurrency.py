@@ -0,0 +1,103 @@
+#  Polkascan PRE Harvester
+#
+#  Copyright 2018-2019 openAware BV (NL).
+#  This file is part of Polkascan.
+#
+#  Polkascan is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Polkascan is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Polkascan. If not, see <http://www.gnu.org/licenses/>.
+#
+#  block_concurrency.py
+
+""" Throughput of blocks processed concurrently within one process, as a worker does with `-P gevent -c N`.
+
+A block is simulated as a number of RPC calls of fixed latency followed by decoding with the shared type resolution
+cache and scalecodec, so no node or database is needed. Run from the repository root:
+
+    python -m benchmark.block_concurrency --pool gevent
+    python -m benchmark.block_concurrency --pool threads --concurrency 1 8 32
+
+"""
+import argparse
+import sys
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--pool', choices=('gevent', 'threads'), default='gevent')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+    parser.add_argument('--blocks', type=int, default=200)
+    parser.add_argument('--rpc-calls', type=int, default=6, help='RPC calls per block')
+    parser.add_argument('--rpc-latency', type=float, default=0.015, help='seconds per RPC call')
+    parser.add_argument('--decodes', type=int, default=40, help='decodes per block')
+    return parser.parse_args()
+
+
+args = parse_args()
+
+if args.pool == 'gevent':
+    # Patch before anything else is imported, like the Celery gevent pool does
+    from gevent import monkey
+    monkey.patch_all()
+
+from scalecodec.base import ScaleDecoder, ScaleBytes
+
+from app.type_registry import use_type_registry
+
+# Vec<(AccountId, Balance)> of 4 items
+PAYLOAD = '0x10' + ('d43593c715fdd31c61141abd04a99fd6822c8558854ccde39a5684e7a56da27d' +
+                    '00e40b54020000000000000000000000') * 4
+
+
+def process_block(block_id):
+    for _ in range(args.rpc_calls):
+        time.sleep(args.rpc_latency)
+
+    for _ in range(args.decodes):
+        decoder = ScaleDecoder.get_decoder_class('Vec<(AccountId, Balance)>', ScaleBytes(PAYLOAD))
+        decoder.decode()
+
+    return block_id
+
+
+def run(concurrency):
+    if args.pool == 'gevent':
+        from gevent.pool import Pool
+        pool = Pool(concurrency)
+        return list(pool.imap_unordered(process_block, range(args.blocks)))
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(concurrency) as executor:
+        return list(executor.map(process_block, range(args.blocks)))
+
+
+def main():
+    use_type_registry('default')
+
+    print('pool: {}, {} blocks of {} RPC calls of {} ms and {} decodes'.format(
+        args.pool, args.blocks, args.rpc_calls, int(args.rpc_latency * 1000), args.decodes
+    ))
+
+    for concurrency in args.concurrency:
+        start = time.time()
+        processed = run(concurrency)
+        duration = time.time() - start
+
+        if sorted(processed) != list(range(args.blocks)):
+            sys.exit('Not all blocks were processed')
+
+        print('concurrency {:3d}: {:7.1f} blocks/s'.format(concurrency, args.blocks / duration))
+
+
+if __name__ == '__main__':
+    main()
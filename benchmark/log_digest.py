@@ -0,0 +1,64 @@
+#  Polkascan PRE Harvester
+#
+#  Copyright 2018-2019 openAware BV (NL).
+#  This file is part of Polkascan.
+#
+#  Polkascan is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Polkascan is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Polkascan. If not, see <http://www.gnu.org/licenses/>.
+#
+#  log_digest.py
+
+""" Decoding time of a BABE PreRuntime log, with the generic LogDigest decoder versus straight from bytes. Run from
+the repository root:
+
+    python -m benchmark.log_digest
+
+"""
+import argparse
+import timeit
+
+from scalecodec.base import ScaleBytes
+from scalecodec.block import LogDigest
+
+from app.utils.digest import decode_pre_runtime_log
+
+# Primary BABE pre-digest: authority index, slot number, weight, VRF output and VRF proof
+PRE_RUNTIME_LOG = '0x0642414245c501' + '00' + '01000000' + 'ef55a50f00000000' + '02000000' + '11' * 32 + '22' * 64
+
+
+def decode_generic():
+    log_digest = LogDigest(ScaleBytes(PRE_RUNTIME_LOG))
+    log_digest.decode()
+    return log_digest.value
+
+
+def decode_bytes():
+    value, pre_digest = decode_pre_runtime_log(PRE_RUNTIME_LOG)
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--number', type=int, default=5000)
+    args = parser.parse_args()
+
+    if decode_generic() != decode_bytes():
+        raise SystemExit('Decoded values differ')
+
+    for name, decode in (('LogDigest', decode_generic), ('bytes', decode_bytes)):
+        duration = min(timeit.repeat(decode, number=args.number, repeat=3)) / args.number
+        print('{:10s} {:8.1f} us per log'.format(name, duration * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#  Polkascan PRE Harvester
+#
+#  Copyright 2018-2019 openAware BV (NL).
+#  This file is part of Polkascan.
+#
+#  Polkascan is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Polkascan is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Polkascan. If not, see <http://www.gnu.org/licenses/>.
+#
+#  ss58.py
+
+""" SS58 encoding and decoding of transfer addresses, without memoization and with a cold and a warm cache. Addresses
+are drawn from a set of accounts of which a few are much more active than the others, as on a live chain. Run from
+the repository root:
+
+    python -m benchmark.ss58
+
+"""
+import argparse
+import random
+import time
+
+from app.utils import ss58
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--addresses', type=int, default=20000)
+    parser.add_argument('--accounts', type=int, default=5000)
+    parser.add_argument('--active-accounts', type=int, default=500)
+    parser.add_argument('--active-share', type=float, default=0.8)
+    return parser.parse_args()
+
+
+def measure(function, values):
+    start = time.time()
+    result = function(values)
+    return (time.time() - start) * 1000, result
+
+
+def main():
+    args = parse_args()
+    generator = random.Random(44)
+
+    accounts = [bytes([generator.randrange(256) for _ in range(32)]).hex() for _ in range(args.accounts)]
+    public_keys = [
+        generator.choice(accounts[:args.active_accounts]) if generator.random() < args.active_share
+        else generator.choice(accounts)
+        for _ in range(args.addresses)
+    ]
+
+    print('{} addresses of {} distinct accounts'.format(len(public_keys), len(set(public_keys))))
+
+    # The memoized functions keep the uncached ones as __wrapped__
+    encode_uncached = ss58._ss58_encode.__wrapped__
+    decode_uncached = ss58.ss58_decode.__wrapped__
+
+    duration, addresses = measure(lambda values: [encode_uncached(value, 42) for value in values], public_keys)
+    print('encode uncached: {:7.1f} ms'.format(duration))
+
+    ss58._ss58_encode.cache_clear()
+    duration, cached_addresses = measure(ss58.ss58_encode_many, public_keys)
+    print('encode cold:     {:7.1f} ms'.format(duration))
+    duration, cached_addresses = measure(ss58.ss58_encode_many, public_keys)
+    print('encode warm:     {:7.1f} ms'.format(duration))
+
+    duration, decoded = measure(lambda values: [decode_uncached(value, 42) for value in values], addresses)
+    print('decode uncached: {:7.1f} ms'.format(duration))
+
+    ss58.ss58_decode.cache_clear()
+    duration, cached_decoded = measure(ss58.ss58_decode_many, addresses)
+    print('decode cold:     {:7.1f} ms'.format(duration))
+    duration, cached_decoded = measure(ss58.ss58_decode_many, addresses)
+    print('decode warm:     {:7.1f} ms'.format(duration))
+
+    if cached_addresses != addresses or cached_decoded != decoded or decoded != public_keys:
+        raise SystemExit('Cached and uncached results differ')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#  Polkascan PRE Harvester
+#
+#  Copyright 2018-2019 openAware BV (NL).
+#  This file is part of Polkascan.
+#
+#  Polkascan is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Polkascan is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Polkascan. If not, see <http://www.gnu.org/licenses/>.
+#
+#  test_digest.py
+
+import unittest
+
+from scalecodec.base import ScaleBytes
+from scalecodec.block import LogDigest
+
+from app.utils.digest import decode_pre_runtime_log, parse_pre_runtime_log, decode_authority_index, \
+    LOG_DIGEST_PRE_RUNTIME
+
+# Primary: authority index, slot number, weight, VRF output and VRF proof
+PRIMARY_PRE_DIGEST = '0x0642414245c501' + '00' + '01000000' + 'ef55a50f00000000' + '02000000' + '11' * 32 + '22' * 64
+# Secondary: authority index and slot number
+SECONDARY_PRE_DIGEST = '0x064241424534' + '01' + '07000000' + 'f055a50f00000000'
+OTHER_ENGINE_PRE_DIGEST = '0x0661757261' + '20' + 'aabbccddeeff0011'
+NON_UTF8_ENGINE_PRE_DIGEST = '0x06ff00fe01' + '0c' + '000102'
+SEAL = '0x0542414245' + '0101' + '00' * 64
+
+
+class PreRuntimeLogTestCase(unittest.TestCase):
+
+    @staticmethod
+    def decode_generic(log_data):
+        log_digest = LogDigest(ScaleBytes(log_data))
+        log_digest.decode()
+        return log_digest
+
+    def assert_same_as_generic(self, log_data):
+        log_digest = self.decode_generic(log_data)
+        value, pre_digest = decode_pre_runtime_log(log_data)
+
+        self.assertEqual(log_digest.index, LOG_DIGEST_PRE_RUNTIME)
+        self.assertEqual(log_digest.index_value, 'PreRuntime')
+        self.assertEqual(value, log_digest.value)
+
+        return value, pre_digest
+
+    def test_primary_pre_digest(self):
+        value, pre_digest = self.assert_same_as_generic(PRIMARY_PRE_DIGEST)
+
+        self.assertEqual(pre_digest.type, 'Primary')
+        self.assertEqual(pre_digest.authority_index, 1)
+        self.assertEqual(pre_digest.slot_number, 262493679)
+        self.assertEqual(pre_digest, parse_pre_runtime_log(PRIMARY_PRE_DIGEST))
+        self.assertEqual(decode_authority_index(value['value']['data']), 1)
+
+    def test_secondary_pre_digest(self):
+        value, pre_digest = self.assert_same_as_generic(SECONDARY_PRE_DIGEST)
+
+        self.assertEqual(pre_digest.type, 'Secondary')
+        self.assertEqual(pre_digest.authority_index, 7)
+        self.assertEqual(pre_digest, parse_pre_runtime_log(SECONDARY_PRE_DIGEST))
+
+    def test_other_engine(self):
+        value, pre_digest = self.assert_same_as_generic(OTHER_ENGINE_PRE_DIGEST)
+
+        self.assertEqual(value['value']['engine'], 'aura')
+        self.assertIsNone(pre_digest)
+
+    def test_non_utf8_engine(self):
+        value, pre_digest = self.assert_same_as_generic(NON_UTF8_ENGINE_PRE_DIGEST)
+
+        self.assertEqual(value['value']['engine'], 'ff00fe01')
+        self.assertIsNone(pre_digest)
+
+    def test_other_log_types(self):
+        self.assertEqual(self.decode_generic(SEAL).index_value, 'Seal')
+        self.assertIsNone(decode_pre_runtime_log(SEAL))
+        self.assertIsNone(parse_pre_runtime_log(SEAL))
+
+    def test_malformed_logs_left_to_generic_decoder(self):
+        self.assertIsNone(decode_pre_runtime_log(PRIMARY_PRE_DIGEST[:-2]))
+        self.assertIsNone(decode_pre_runtime_log(PRIMARY_PRE_DIGEST + '00'))
+        self.assertIsNone(decode_pre_runtime_log('0x0642414245'))
+
+
+if __name__ == '__main__':
+    unittest.main()
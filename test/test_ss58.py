@@ -0,0 +1,206 @@
+#  Polkascan PRE Harvester
+#
+#  Copyright 2018-2019 openAware BV (NL).
+#  This file is part of Polkascan.
+#
+#  Polkascan is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Polkascan is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Polkascan. If not, see <http://www.gnu.org/licenses/>.
+#
+#  test_ss58.py
+
+import random
+import unittest
+from hashlib import blake2b
+
+import base58
+from scalecodec.base import ScaleBytes
+from scalecodec.types import U8, U16, U32, U64
+
+from app.utils.ss58 import ss58_encode, ss58_decode, ss58_encode_many, ss58_decode_many, ss58_encode_account_index, \
+    ss58_decode_account_index
+
+
+# Implementation before memoization and int.to_bytes, the new one must give the same output
+
+def reference_ss58_decode(address, valid_address_type=42):
+    checksum_prefix = b'SS58PRE'
+
+    ss58_format = base58.b58decode(address)
+
+    if ss58_format[0] != valid_address_type:
+        raise ValueError("Invalid Address type")
+
+    if len(ss58_format) in [3, 4, 6, 10]:
+        checksum_length = 1
+    elif len(ss58_format) in [5, 7, 11, 35]:
+        checksum_length = 2
+    elif len(ss58_format) in [8, 12]:
+        checksum_length = 3
+    elif len(ss58_format) in [9, 13]:
+        checksum_length = 4
+    elif len(ss58_format) in [14]:
+        checksum_length = 5
+    elif len(ss58_format) in [15]:
+        checksum_length = 6
+    elif len(ss58_format) in [16]:
+        checksum_length = 7
+    elif len(ss58_format) in [17]:
+        checksum_length = 8
+    else:
+        raise ValueError("Invalid address length")
+
+    checksum = blake2b(checksum_prefix + ss58_format[0:-checksum_length]).digest()
+
+    if checksum[0:checksum_length] != ss58_format[-checksum_length:]:
+        raise ValueError("Invalid checksum")
+
+    return ss58_format[1:len(ss58_format)-checksum_length].hex()
+
+
+def reference_ss58_encode(address, address_type=42):
+    checksum_prefix = b'SS58PRE'
+
+    if type(address) is bytes or type(address) is bytearray:
+        address_bytes = address
+    else:
+        address_bytes = bytes.fromhex(address)
+
+    if len(address_bytes) == 32:
+        checksum_length = 2
+    elif len(address_bytes) in [1, 2, 4, 8]:
+        checksum_length = 1
+    else:
+        raise ValueError("Invalid length for address")
+
+    address_format = bytes([address_type]) + address_bytes
+    checksum = blake2b(checksum_prefix + address_format).digest()
+
+    return base58.b58encode(address_format + checksum[:checksum_length]).decode()
+
+
+def reference_ss58_encode_account_index(account_index, address_type=42):
+
+    if 0 <= account_index <= 2**8 - 1:
+        account_idx_encoder = U8()
+    elif 2**8 <= account_index <= 2**16 - 1:
+        account_idx_encoder = U16()
+    elif 2**16 <= account_index <= 2**32 - 1:
+        account_idx_encoder = U32()
+    elif 2**32 <= account_index <= 2**64 - 1:
+        account_idx_encoder = U64()
+    else:
+        raise ValueError("Value too large for an account index")
+
+    return reference_ss58_encode(account_idx_encoder.encode(account_index).data, address_type)
+
+
+def reference_ss58_decode_account_index(address, valid_address_type=42):
+
+    account_index_bytes = reference_ss58_decode(address, valid_address_type)
+
+    if len(account_index_bytes) == 2:
+        return U8(ScaleBytes('0x{}'.format(account_index_bytes))).decode()
+    if len(account_index_bytes) == 4:
+        return U16(ScaleBytes('0x{}'.format(account_index_bytes))).decode()
+    if len(account_index_bytes) == 8:
+        return U32(ScaleBytes('0x{}'.format(account_index_bytes))).decode()
+    if len(account_index_bytes) == 16:
+        return U64(ScaleBytes('0x{}'.format(account_index_bytes))).decode()
+    else:
+        raise ValueError("Invalid account index length")
+
+
+ACCOUNT_INDICES = [
+    0, 1, 2**8 - 1, 2**8, 2**16 - 1, 2**16, 2**32 - 1, 2**32, 2**64 - 1
+]
+
+
+class SS58TestCase(unittest.TestCase):
+
+    def setUp(self):
+        generator = random.Random(44)
+        self.public_keys = [
+            bytes([generator.randrange(256) for _ in range(32)]).hex() for _ in range(200)
+        ]
+        self.account_indices = ACCOUNT_INDICES + [generator.randrange(2**64) for _ in range(200)]
+
+    def test_encode_same_as_reference(self):
+        for address_type in (42, 2, 0):
+            for public_key in self.public_keys:
+                expected = reference_ss58_encode(public_key, address_type)
+                self.assertEqual(ss58_encode(public_key, address_type), expected)
+                self.assertEqual(ss58_encode(bytes.fromhex(public_key), address_type), expected)
+                self.assertEqual(ss58_encode(bytearray.fromhex(public_key), address_type), expected)
+
+    def test_decode_same_as_reference(self):
+        addresses = [reference_ss58_encode(public_key, 2) for public_key in self.public_keys]
+
+        for address in addresses:
+            self.assertEqual(ss58_decode(address, 2), reference_ss58_decode(address, 2))
+
+    def test_encode_many_same_as_reference(self):
+        # Repeated addresses, as in the transfers of a block, are served by the cache
+        public_keys = self.public_keys + self.public_keys[:50]
+
+        self.assertEqual(
+            ss58_encode_many(public_keys, 2),
+            [reference_ss58_encode(public_key, 2) for public_key in public_keys]
+        )
+        self.assertEqual(ss58_encode_many([]), [])
+
+    def test_decode_many_same_as_reference(self):
+        addresses = [reference_ss58_encode(public_key) for public_key in self.public_keys]
+        addresses += addresses[:50]
+
+        self.assertEqual(ss58_decode_many(addresses), [reference_ss58_decode(address) for address in addresses])
+        self.assertEqual(ss58_decode_many([]), [])
+
+    def test_account_index_same_as_reference(self):
+        for account_index in self.account_indices:
+            address = reference_ss58_encode_account_index(account_index, 2)
+
+            self.assertEqual(ss58_encode_account_index(account_index, 2), address)
+            self.assertEqual(ss58_decode_account_index(address, 2), account_index)
+            self.assertEqual(reference_ss58_decode_account_index(address, 2), account_index)
+
+    def test_account_index_out_of_range(self):
+        for account_index in (-1, 2**64):
+            with self.assertRaises(ValueError):
+                reference_ss58_encode_account_index(account_index)
+            with self.assertRaises(ValueError):
+                ss58_encode_account_index(account_index)
+
+    def test_invalid_addresses(self):
+        address = reference_ss58_encode(self.public_keys[0])
+        corrupted = address[:-1] + ('1' if address[-1] != '1' else '2')
+
+        for invalid_address, valid_address_type in ((address, 2), (corrupted, 42)):
+            with self.assertRaises(ValueError):
+                reference_ss58_decode(invalid_address, valid_address_type)
+            with self.assertRaises(ValueError):
+                ss58_decode(invalid_address, valid_address_type)
+
+            # Failures are not cached
+            with self.assertRaises(ValueError):
+                ss58_decode(invalid_address, valid_address_type)
+
+    def test_invalid_length(self):
+        for address in ('00' * 3, b'\x00' * 31):
+            with self.assertRaises(ValueError):
+                reference_ss58_encode(address)
+            with self.assertRaises(ValueError):
+                ss58_encode(address)
+
+
+if __name__ == '__main__':
+    unittest.main()
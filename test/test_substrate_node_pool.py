@@ -0,0 +1,266 @@
+#  Polkascan PRE Harvester
+#
+#  Copyright 2018-2019 openAware BV (NL).
+#  This file is part of Polkascan.
+#
+#  Polkascan is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Polkascan is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Polkascan. If not, see <http://www.gnu.org/licenses/>.
+#
+#  test_substrate_node_pool.py
+
+import json
+import threading
+import time
+import unittest
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+from substrateinterface import SubstrateRequestException
+
+from app.utils import substrate
+from app.utils.substrate import SubstrateNodePool, AdaptiveConcurrencyLimiter
+
+
+class StubNodeHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        node = self.server.node
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode())
+
+        node.count_requests += 1
+
+        if node.delay:
+            time.sleep(node.delay)
+
+        if node.status != 200:
+            self.send_response(node.status)
+            self.end_headers()
+            return
+
+        if node.error:
+            response = {'jsonrpc': '2.0', 'error': {'code': -32000, 'message': 'stub error'}, 'id': payload['id']}
+        else:
+            response = {'jsonrpc': '2.0', 'result': node.name, 'id': payload['id']}
+
+        body = json.dumps(response).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubNode(object):
+    """
+    Substrate node answering every JSON-RPC request with its name, or with a failure when configured to
+    """
+
+    def __init__(self, name, delay=0, status=200, error=False):
+        self.name = name
+        self.delay = delay
+        self.status = status
+        self.error = error
+        self.count_requests = 0
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubNodeHandler)
+        self.server.node = self
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/'.format(self.server.server_address[1])
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class SubstrateNodePoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.nodes = []
+
+        # Limiter is shared by the process, a fresh one keeps the tests independent
+        self.concurrency_limiter = substrate.concurrency_limiter
+        substrate.concurrency_limiter = AdaptiveConcurrencyLimiter(limit=8)
+
+    def tearDown(self):
+        substrate.concurrency_limiter = self.concurrency_limiter
+
+        for node in self.nodes:
+            node.stop()
+
+    def start_node(self, name, **kwargs):
+        node = StubNode(name, **kwargs)
+        self.nodes.append(node)
+        return node
+
+    def create_pool(self, **kwargs):
+        kwargs.setdefault('timeout', 5)
+        kwargs.setdefault('hedge_delay', 0)
+        return SubstrateNodePool([node.url for node in self.nodes], **kwargs)
+
+    @staticmethod
+    def payload(method, params):
+        return {'jsonrpc': '2.0', 'method': method, 'params': params, 'id': 1}
+
+    def request(self, pool, method='system_health', params=None):
+        params = params or []
+        return pool.request(method, params, self.payload(method, params))
+
+    def test_node_selection_prefers_lowest_latency(self):
+        slow = self.start_node('slow', delay=0.1)
+        fast = self.start_node('fast')
+        pool = self.create_pool()
+
+        # Nodes without measurements are sampled first
+        self.assertEqual(self.request(pool)['result'], 'slow')
+        self.assertEqual(self.request(pool)['result'], 'fast')
+
+        results = [self.request(pool)['result'] for _ in range(5)]
+
+        self.assertEqual(results, ['fast'] * 5)
+        self.assertEqual(slow.count_requests, 1)
+        self.assertEqual(fast.count_requests, 6)
+
+        slow_endpoint, fast_endpoint = pool.endpoints
+        self.assertGreater(slow_endpoint.latency, fast_endpoint.latency)
+
+    def test_failover_on_http_error(self):
+        self.start_node('broken', status=500)
+        self.start_node('healthy')
+        pool = self.create_pool()
+
+        self.assertEqual(self.request(pool)['result'], 'healthy')
+
+        broken_endpoint, healthy_endpoint = pool.endpoints
+        self.assertEqual(broken_endpoint.count_errors, 1)
+        self.assertEqual(healthy_endpoint.count_errors, 0)
+
+    def test_json_rpc_error_counts_as_failure(self):
+        self.start_node('erroring', error=True)
+        self.start_node('healthy')
+        pool = self.create_pool()
+
+        self.assertEqual(self.request(pool)['result'], 'healthy')
+
+        erroring_endpoint = pool.endpoints[0]
+        self.assertEqual(erroring_endpoint.count_requests, 1)
+        self.assertEqual(erroring_endpoint.count_errors, 1)
+        self.assertEqual(erroring_endpoint.failures, 1)
+        self.assertEqual(substrate.concurrency_limiter.count_decrease, 1)
+
+    def test_request_fails_when_all_nodes_fail(self):
+        self.start_node('erroring', error=True)
+        self.start_node('broken', status=503)
+        pool = self.create_pool()
+
+        with self.assertRaises(SubstrateRequestException):
+            self.request(pool)
+
+        self.assertEqual([endpoint.count_errors for endpoint in pool.endpoints], [1, 1])
+
+    def test_circuit_breaker_opens_and_closes(self):
+        flaky = self.start_node('flaky', error=True)
+        self.start_node('healthy', delay=0.05)
+        pool = self.create_pool(failure_threshold=2, cooldown=0.3)
+        flaky_endpoint = pool.endpoints[0]
+
+        # Still preferred while it has no latency measurement, until consecutive failures open the circuit
+        self.request(pool)
+        self.assertIsNone(flaky_endpoint.opened_at)
+        self.request(pool)
+        self.assertIsNotNone(flaky_endpoint.opened_at)
+
+        # Out of rotation during the cooldown
+        for _ in range(3):
+            self.assertEqual(self.request(pool)['result'], 'healthy')
+        self.assertEqual(flaky.count_requests, 2)
+
+        # A failed trial request after the cooldown keeps the circuit open
+        time.sleep(0.3)
+        self.request(pool)
+        self.assertEqual(flaky.count_requests, 3)
+        self.assertIsNotNone(flaky_endpoint.opened_at)
+
+        # A successful trial request closes it
+        flaky.error = False
+        time.sleep(0.3)
+        self.assertEqual(self.request(pool)['result'], 'flaky')
+        self.assertIsNone(flaky_endpoint.opened_at)
+        self.assertEqual(flaky_endpoint.failures, 0)
+
+        self.assertEqual(self.request(pool)['result'], 'flaky')
+
+    def test_single_trial_request_while_half_open(self):
+        self.start_node('flaky', error=True)
+        pool = self.create_pool(failure_threshold=1, cooldown=0)
+        endpoint = pool.endpoints[0]
+
+        with self.assertRaises(SubstrateRequestException):
+            self.request(pool)
+
+        self.assertIs(pool.select_endpoint(), endpoint)
+        self.assertTrue(endpoint.trial_running)
+
+        # Only the last remaining node is tried while its trial runs
+        self.assertIs(pool.select_endpoint(), endpoint)
+
+    def test_hedged_request_uses_fastest_response(self):
+        slow = self.start_node('slow', delay=1)
+        self.start_node('fast')
+        pool = self.create_pool(hedge_delay=0.05)
+
+        start = time.time()
+        response = self.request(pool, 'chain_getBlock', ['0x01'])
+
+        self.assertEqual(response['result'], 'fast')
+        self.assertLess(time.time() - start, 0.5)
+        self.assertEqual(pool.count_hedged, 1)
+        self.assertEqual(slow.count_requests, 1)
+
+    def test_no_hedging_without_block_hash(self):
+        self.start_node('slow', delay=0.2)
+        fast = self.start_node('fast')
+        pool = self.create_pool(hedge_delay=0.05)
+
+        # Result depends on the chain head of the node, so it is not sent to another node
+        response = self.request(pool, 'chain_getBlock', [None])
+
+        self.assertEqual(response['result'], 'slow')
+        self.assertEqual(pool.count_hedged, 0)
+        self.assertEqual(fast.count_requests, 0)
+
+    def test_hedged_request_falls_back_on_failure(self):
+        self.start_node('erroring', error=True)
+        self.start_node('healthy')
+        pool = self.create_pool(hedge_delay=0.5)
+
+        response = self.request(pool, 'state_getStorageAt', ['0x00', '0x01'])
+
+        self.assertEqual(response['result'], 'healthy')
+        self.assertEqual(pool.count_hedged, 0)
+        self.assertEqual(pool.endpoints[0].count_errors, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()